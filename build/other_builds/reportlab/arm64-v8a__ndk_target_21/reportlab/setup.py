@@ -0,0 +1,2 @@
+/root/package/build/other_builds/freetype/arm64-v8a__ndk_target_21/freetype/objs/.libs
+/root/package/build/other_builds/freetype/arm64-v8a__ndk_target_21/freetype/include
@@ -0,0 +1,143 @@
+"""
+In-process extraction of the downloaded recipe archives.
+"""
+
+from os.path import (
+    abspath, basename, dirname, getsize, isdir, islink, join, lexists,
+    normpath, sep)
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from pythonforandroid.logger import info
+from pythonforandroid.util import ensure_dir
+
+ARCHIVE_EXTENSIONS = (
+    '.zip', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+CHUNK_SIZE = 256 * 1024
+
+# refuse members escaping the target dir on pythons supporting it
+TAR_EXTRACT_KWARGS = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+
+
+def _split_root(name):
+    '''Returns ``name`` without any leading ``./``, and its first path
+    component.'''
+    while name.startswith('./'):
+        name = name[2:]
+    return name, name.split('/')[0]
+
+
+def _rename_root(name, root, new_root):
+    if new_root is None or root is None:
+        return name
+    if name == root or name.startswith(root + '/'):
+        return new_root + name[len(root):]
+    return name
+
+
+def _target_path(target_dir, name):
+    path = normpath(join(target_dir, name))
+    if path != target_dir and not path.startswith(target_dir + sep):
+        raise ValueError('Archive member {} is outside of {}'.format(
+            name, target_dir))
+    return path
+
+
+def _extract_zip(filename, target_dir, root_name):
+    root = None
+    size = 0
+    with zipfile.ZipFile(filename) as zip_file:
+        for member in zip_file.infolist():
+            name, member_root = _split_root(member.filename)
+            if root is None:
+                root = member_root
+            path = _target_path(target_dir, _rename_root(name, root, root_name))
+            if member.is_dir():
+                ensure_dir(path)
+                continue
+            ensure_dir(dirname(path))
+            mode = member.external_attr >> 16
+            if stat.S_ISLNK(mode):
+                os.symlink(zip_file.read(member).decode('utf-8'), path)
+                continue
+            with zip_file.open(member) as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+            # keep the executable bits, configure scripts need them
+            if mode & 0o777:
+                os.chmod(path, mode & 0o777)
+            size += member.file_size
+    return root, size
+
+
+def _extract_tar(filename, target_dir, root_name):
+    root = None
+    size = 0
+
+    def members(tar):
+        nonlocal root, size
+        for member in tar:
+            member.name, member_root = _split_root(member.name)
+            if root is None:
+                root = member_root
+            member.name = _rename_root(member.name, root, root_name)
+            if member.islnk():
+                member.linkname = _rename_root(
+                    _split_root(member.linkname)[0], root, root_name)
+            size += member.size
+            yield member
+
+    # a stream, so that the archive is read and decompressed exactly once
+    with tarfile.open(filename, 'r|*') as tar:
+        tar.extractall(target_dir, members=members(tar), **TAR_EXTRACT_KWARGS)
+    return root, size
+
+
+def extract_archive(filename, target_dir, root_name=None):
+    '''Extracts the zip or tar (gz, bz2 or xz) archive ``filename`` into
+    ``target_dir``, reading it once.
+
+    If ``root_name`` is given, the top directory of the archive (the one
+    of its first member) is extracted as ``target_dir/root_name``
+    instead. Returns the original name of that top directory.
+
+    The archive is extracted into a temporary sibling of ``target_dir``,
+    and its top entries are then moved into place (replacing any existing
+    ones), so that an interrupted extraction never leaves a partial tree
+    behind.'''
+    if not filename.endswith(ARCHIVE_EXTENSIONS):
+        raise ValueError(
+            'Could not extract {}, it must be one of {}'.format(
+                filename, ', '.join(ARCHIVE_EXTENSIONS)))
+    target_dir = abspath(target_dir)
+    ensure_dir(dirname(target_dir))
+    temp_dir = tempfile.mkdtemp(
+        prefix='.{}.'.format(basename(target_dir)), suffix='.tmp',
+        dir=dirname(target_dir))
+    try:
+        start = time.time()
+        if filename.endswith('.zip'):
+            root, size = _extract_zip(filename, temp_dir, root_name)
+        else:
+            root, size = _extract_tar(filename, temp_dir, root_name)
+        ensure_dir(target_dir)
+        for entry in os.listdir(temp_dir):
+            path = join(target_dir, entry)
+            if isdir(path) and not islink(path):
+                shutil.rmtree(path)
+            elif lexists(path):
+                os.unlink(path)
+            os.replace(join(temp_dir, entry), path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    elapsed = max(time.time() - start, 1e-6)
+    info('Extracted {} ({:.1f} MB, {:.1f} MB unpacked) in {:.1f}s, '
+         '{:.1f} MB/s'.format(
+             filename, getsize(filename) / 1e6, size / 1e6, elapsed,
+             size / 1e6 / elapsed))
+    return root
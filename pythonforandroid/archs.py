@@ -1,7 +1,6 @@
 from distutils.spawn import find_executable
 from os import environ
 from os.path import join, split
-from multiprocessing import cpu_count
 from glob import glob
 
 from pythonforandroid.recipe import Recipe
@@ -54,6 +53,9 @@ class Arch:
         # linked for all others.
         self.extra_global_link_paths = []
 
+        # The environments returned by `get_env`, by `get_env_key`
+        self._env_cache = {}
+
     def __str__(self):
         return self.arch
 
@@ -118,7 +120,55 @@ class Arch:
             compiler += '++'
         return join(self.clang_path, compiler)
 
+    def get_env_key(self, with_flags_in_cc=True):
+        """Returns the state the environment of `get_env` is built from,
+        an environment is only built again when it changes."""
+        ctx = self.ctx
+        return (
+            with_flags_in_cc,
+            tuple(self.extra_global_link_paths),
+            ctx.ccache,
+            tuple(sorted((k, v) for k, v in environ.items()
+                         if k == 'USE_CCACHE' or k.startswith('CCACHE_'))),
+            ctx.ndk_dir,
+            ctx.ndk_api,
+            ctx.toolchain_prefix,
+            ctx.toolchain_version,
+            ctx.libs_dir,
+            ctx.build_dir,
+            ctx.python_installs_dir,
+            ctx.bootstrap.distribution.name if ctx.bootstrap else None,
+            ctx.python_recipe.name,
+            ctx.python_recipe.version,
+            environ['PATH'],
+        )
+
+    def clear_env_cache(self):
+        """Forgets the environments built by `get_env`, for the state they
+        depend on changes outside of `get_env_key` (e.g. the NDK is replaced
+        in place)."""
+        self._env_cache.clear()
+
     def get_env(self, with_flags_in_cc=True):
+        """Returns the environment to build for this arch.
+
+        The environments are built once for each `get_env_key` (recipes ask
+        for one for each command they run), callers get a copy they may
+        modify. See also `clear_env_cache`."""
+        # Compiler: the clang dir goes first in the `PATH`, only once
+        clang_path = self.clang_path
+        if environ['PATH'].split(':')[0] != clang_path:
+            environ['PATH'] = '{clang_path}:{path}'.format(
+                clang_path=clang_path, path=environ['PATH']
+            )
+
+        key = self.get_env_key(with_flags_in_cc)
+        env = self._env_cache.get(key)
+        if env is None:
+            env = self._env_cache[key] = self._get_env(with_flags_in_cc)
+        return dict(env)
+
+    def _get_env(self, with_flags_in_cc):
         env = {}
 
         # CFLAGS/CXXFLAGS: the processor flags
@@ -171,9 +221,6 @@ class Arch:
             )
 
         # Compiler: `CC` and `CXX` (and make sure that the compiler exists)
-        environ['PATH'] = '{clang_path}:{path}'.format(
-            clang_path=self.clang_path, path=environ['PATH']
-        )
         cc = find_executable(self.clang_exe, path=environ['PATH'])
         if cc is None:
             print('Searching path are: {!r}'.format(environ['PATH']))
@@ -205,8 +252,10 @@ class Arch:
         env['AR'] = '{}-ar'.format(command_prefix)
         env['RANLIB'] = '{}-ranlib'.format(command_prefix)
         env['STRIP'] = '{}-strip --strip-unneeded'.format(command_prefix)
-        env['MAKE'] = 'make -j{}'.format(str(cpu_count()))
+        # the jobs are handed out by the jobserver of the build
+        env['MAKE'] = 'make'
         env['READELF'] = '{}-readelf'.format(command_prefix)
+        env['OBJCOPY'] = '{}-objcopy'.format(command_prefix)
         env['NM'] = '{}-nm'.format(command_prefix)
         env['LD'] = '{}-ld'.format(command_prefix)
 
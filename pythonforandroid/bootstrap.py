@@ -8,7 +8,10 @@ import sh
 import shlex
 import shutil
 
+from pythonforandroid.elf import find_libraries, strip_files
+from pythonforandroid.jobserver import get_cpu_jobs, reserve_jobs
 from pythonforandroid.logger import (shprint, info, logger, debug)
+from pythonforandroid.profiler import profile
 from pythonforandroid.util import (
     current_directory, ensure_dir, temp_directory, BuildInterruptingException)
 from pythonforandroid.recipe import Recipe
@@ -222,7 +225,7 @@ class Bootstrap:
                 ok = True
                 # Check if the bootstap's dependencies have an internal conflict:
                 for recipe in possible_dependencies:
-                    recipe = Recipe.get_recipe(recipe, ctx)
+                    recipe = Recipe.get_recipe_info(recipe, ctx)
                     if any(conflict in recipes for conflict in recipe.conflicts):
                         ok = False
                         break
@@ -230,7 +233,7 @@ class Bootstrap:
                 # packages:
                 for recipe in recipes:
                     try:
-                        recipe = Recipe.get_recipe(recipe, ctx)
+                        recipe = Recipe.get_recipe_info(recipe, ctx)
                     except ValueError:
                         conflicts = []
                     else:
@@ -367,26 +370,27 @@ class Bootstrap:
             shprint(sh.cp, '-a', *so_files, so_tgt_dir)
 
     def strip_libraries(self, arch):
-        info('Stripping libraries')
-        env = arch.get_env()
-        tokens = shlex.split(env['STRIP'])
-        strip = sh.Command(tokens[0])
-        if len(tokens) > 1:
-            strip = strip.bake(tokens[1:])
-
-        libs_dir = join(self.dist_dir, '_python_bundle',
-                        '_python_bundle', 'modules')
-        filens = shprint(sh.find, libs_dir, join(self.dist_dir, 'libs'),
-                         '-iname', '*.so', _env=env).stdout.decode('utf-8')
-
-        logger.info('Stripping libraries in private dir')
-        for filen in filens.split('\n'):
-            if not filen:
-                continue  # skip the last ''
-            try:
-                strip(filen, _env=env)
-            except sh.ErrorReturnCode_1:
-                logger.debug('Failed to strip ' + filen)
+        with profile(self.ctx, 'strip', arch=arch):
+            info('Stripping libraries')
+            env = arch.get_env()
+            tokens = shlex.split(env['STRIP'])
+            strip = sh.Command(tokens[0])
+            if len(tokens) > 1:
+                strip = strip.bake(tokens[1:])
+            objcopy = None
+            if self.ctx.debug_symbols_dir:
+                objcopy = sh.Command(env['OBJCOPY'])
+
+            libs_dir = join(self.dist_dir, '_python_bundle',
+                            '_python_bundle', 'modules')
+            logger.info('Stripping libraries in private dir')
+            with reserve_jobs(self.ctx, get_cpu_jobs(self.ctx) - 1,
+                              blocking=False) as jobs:
+                strip_files(
+                    find_libraries(libs_dir, join(self.dist_dir, 'libs')),
+                    strip, env, jobs=jobs + 1, objcopy=objcopy,
+                    debug_dir=self.ctx.debug_symbols_dir,
+                    root_dir=self.dist_dir)
 
     def fry_eggs(self, sitepackages):
         info('Frying eggs in {}'.format(sitepackages))
@@ -415,7 +419,7 @@ def expand_dependencies(recipes, ctx):
             if isinstance(entry, (tuple, list)):
                 entry = entry[0]
             try:
-                recipe = Recipe.get_recipe(entry, ctx)
+                recipe = Recipe.get_recipe_info(entry, ctx)
                 recipes_with_deps += recipe.depends
             except ValueError:
                 # it's a pure python package without a recipe, so we
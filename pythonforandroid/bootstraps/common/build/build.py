@@ -1,19 +1,24 @@
 #!/usr/bin/env python3
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 from os.path import (
-    dirname, join, isfile, realpath,
-    relpath, split, exists, basename
+    dirname, join, isfile, islink, realpath,
+    relpath, exists, basename
 )
 from os import listdir, makedirs, remove
 import os
 import shlex
 import shutil
+import struct
 import subprocess
 import sys
 import tarfile
 import tempfile
 import time
+import zlib
 
 from distutils.version import LooseVersion
 from fnmatch import fnmatch
@@ -80,7 +85,7 @@ WHITELIST_PATTERNS = []
 if get_bootstrap_name() in ('sdl2', 'webview', 'service_only'):
     WHITELIST_PATTERNS.append('pyconfig.h')
 
-python_files = []
+python_files = set()
 
 
 environment = jinja2.Environment(loader=jinja2.FileSystemLoader(
@@ -130,31 +135,156 @@ def match_filename(pattern_list, name):
             return True
 
 
-def listfiles(d):
-    basedir = d
-    subdirlist = []
-    for item in os.listdir(d):
-        fn = join(d, item)
-        if isfile(fn):
-            yield fn
-        else:
-            subdirlist.append(join(basedir, item))
-    for subdir in subdirlist:
-        for fn in listfiles(subdir):
-            yield fn
+class ParallelGzipFile(object):
+    '''
+    A write-only gzip file compressed by several threads, the way pigz does.
+
+    The data is split into blocks deflated separately, each one using the end
+    of the previous block as its dictionary, and the deflated blocks are
+    written in order as a single gzip member any gzip reader can inflate.
+    '''
+
+    block_size = 1024 * 1024
+    window_size = 32 * 1024
+
+    def __init__(self, filename, compresslevel=9, threads=None):
+        self.compresslevel = compresslevel
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        self.fileobj = open(filename, 'wb')
+        # no name and no mtime in the header, the archive is reproducible
+        self.fileobj.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+
+    def deflate(self, block, dictionary, last):
+        args = [self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS]
+        if dictionary:
+            args += [zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary]
+        compressor = zlib.compressobj(*args)
+        # a sync flush ends the block on a byte boundary, without marking
+        # the end of the stream, so that the next block can follow it
+        return compressor.compress(block) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def submit(self, block, last=False):
+        self.pending.append(self.executor.submit(
+            self.deflate, block, self.dictionary, last))
+        self.dictionary = block[-self.window_size:]
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        try:
+            self.submit(bytes(self.buffer), last=True)
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            self.fileobj.write(struct.pack(
+                '<LL', self.crc & 0xffffffff, self.size & 0xffffffff))
+        finally:
+            self.executor.shutdown()
+            self.fileobj.close()
+
 
+# changing it makes the private data be packed again
+PRIVATE_DIGEST_VERSION = 1
 
-def make_tar(tfn, source_dirs, ignore_path=[], optimize_python=True):
+
+def read_json(filename, default=None):
+    try:
+        with open(filename) as fileh:
+            return json.load(fileh)
+    except (OSError, ValueError):
+        return default
+
+
+def files_digest(files, cache):
     '''
-    Make a zip file `fn` from the contents of source_dis.
+    The sha256 of the contents and names of `files`, a list of (filename,
+    archive name) tuples.
+
+    `cache` maps filenames to their size, mtime and sha256 of a previous run,
+    the files that still match it are not read again. It is updated with the
+    files hashed.
     '''
+    digest = hashlib.sha256(str(PRIVATE_DIGEST_VERSION).encode('utf-8'))
+    for fn, afn in files:
+        fn_stat = os.stat(fn)
+        cached = cache.get(fn)
+        if cached is None or cached[:2] != [fn_stat.st_size,
+                                            fn_stat.st_mtime_ns]:
+            fn_digest = hashlib.sha256()
+            with open(fn, 'rb') as fileh:
+                for chunk in iter(lambda: fileh.read(1024 * 1024), b''):
+                    fn_digest.update(chunk)
+            cached = cache[fn] = [fn_stat.st_size, fn_stat.st_mtime_ns,
+                                  fn_digest.hexdigest()]
+        digest.update('{}\0{:o}\0{}\0'.format(
+            afn, fn_stat.st_mode & 0o777, cached[2]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def write_manifest(manifest_file, files, cache):
+    '''
+    Write the "<sha256> <archive name>" lines of `files` to `manifest_file`,
+    unless it already has them. The device uses it to only extract the files
+    changed since the previous version of the app.
+    '''
+    hashes = {}
+    for fn, afn in files:
+        # the last file with a name is the one left once extracted
+        hashes[afn.lstrip('/')] = cache[fn][2]
+    data = ''.join('{} {}\n'.format(fn_hash, afn)
+                   for afn, fn_hash in sorted(hashes.items()))
+    try:
+        with open(manifest_file) as fileh:
+            if fileh.read() == data:
+                return
+    except OSError:
+        pass
+    with open(manifest_file, 'w') as fileh:
+        fileh.write(data)
+
+
+def write_digest(digest_file, digest, files, cache):
+    '''
+    Write `digest` and the entries of `cache` for `files` to `digest_file`,
+    for :func:`make_tar` to read on the next build.
+    '''
+    with open(digest_file + '.tmp', 'w') as fileh:
+        json.dump({'digest': digest,
+                   'files': {fn: cache[fn] for fn, afn in files}}, fileh)
+    os.replace(digest_file + '.tmp', digest_file)
+
 
-    # selector function
-    def select(fn):
-        rfn = realpath(fn)
+def make_tar(tfn, source_dirs, ignore_path=[], optimize_python=True,
+             digest_file=None, manifest_file=None):
+    '''
+    Make a tar.gz file `tfn` from the contents of source_dirs, and return the
+    digest of those contents.
+
+    The files of each source dir are added in sorted order, so the same files
+    always make the same archive. If `digest_file` is given, the digest is
+    stored in it and `tfn` is only made again when the digest changed. If
+    `manifest_file` is given, the hash of each file is written to it.
+    '''
+    ignore_path = [p[:-1] if p.endswith('/') else p for p in ignore_path]
+
+    # selector function, `rfn` is the real path of `fn`
+    def select(fn, rfn):
         for p in ignore_path:
-            if p.endswith('/'):
-                p = p[:-1]
             if rfn.startswith(p):
                 return False
         if rfn in python_files:
@@ -166,43 +296,138 @@ def make_tar(tfn, source_dirs, ignore_path=[], optimize_python=True):
     for sd in source_dirs:
         sd = realpath(sd)
         compile_dir(sd, optimize_python=optimize_python)
-        files += [(x, relpath(realpath(x), sd)) for x in listfiles(sd)
-                  if select(x)]
+        for root, dirnames, filenames in os.walk(sd, followlinks=True):
+            dirnames.sort()
+            real_root = realpath(root)
+            for filename in sorted(filenames):
+                fn = join(root, filename)
+                rfn = realpath(fn) if islink(fn) else join(real_root, filename)
+                if select(fn, rfn):
+                    files.append((fn, relpath(rfn, sd)))
+
+    previous = read_json(digest_file, {}) if digest_file else {}
+    cache = previous.get('files', {})
+    digest = files_digest(files, cache)
+    if manifest_file:
+        write_manifest(manifest_file, files, cache)
+    if digest == previous.get('digest') and exists(tfn):
+        print('Private data is unchanged, keeping {}'.format(tfn))
+        # the files touched since are not hashed again by the next build
+        write_digest(digest_file, digest, files, cache)
+        return digest
 
     # create tar.gz of thoses files
-    tf = tarfile.open(tfn, 'w:gz', format=tarfile.USTAR_FORMAT)
-    dirs = []
-    for fn, afn in files:
-        dn = dirname(afn)
-        if dn not in dirs:
+    start = time.time()
+    sizes = {}
+    # written aside and moved into place, an interrupted build must not
+    # leave a partial archive that the digest would then validate
+    temp_tfn = tfn + '.tmp'
+    complete = False
+    gzip_file = ParallelGzipFile(temp_tfn)
+    try:
+        tf = tarfile.open(tfn, 'w|', fileobj=gzip_file,
+                          format=tarfile.USTAR_FORMAT)
+        dirs = set()
+        for fn, afn in files:
             # create every dirs first if not exist yet
-            d = ''
-            for component in split(dn):
-                d = join(d, component)
-                if d.startswith('/'):
-                    d = d[1:]
-                if d == '' or d in dirs:
-                    continue
-                dirs.append(d)
-                tinfo = tarfile.TarInfo(d)
+            parents = []
+            dn = dirname(afn)
+            while dn not in ('', '/') and dn not in dirs:
+                dirs.add(dn)
+                parents.append(dn)
+                dn = dirname(dn)
+            for d in reversed(parents):
+                tinfo = tarfile.TarInfo(d.lstrip('/'))
                 tinfo.type = tarfile.DIRTYPE
                 tf.addfile(tinfo)
 
-        # put the file
-        tf.add(fn, afn)
-    tf.close()
+            # put the file
+            tinfo = tf.gettarinfo(fn, afn)
+            tinfo.uid = tinfo.gid = 0
+            tinfo.uname = tinfo.gname = ''
+            if tinfo.isreg():
+                with open(fn, 'rb') as fileh:
+                    tf.addfile(tinfo, fileh)
+            else:
+                tf.addfile(tinfo)
+            top_dir = afn.split('/')[0] if '/' in afn else '.'
+            sizes[top_dir] = sizes.get(top_dir, 0) + tinfo.size
+        tf.close()
+        complete = True
+    finally:
+        gzip_file.close()
+        if not complete:
+            remove(temp_tfn)
+    os.replace(temp_tfn, tfn)
+
+    print('Packed {} files ({:.1f} MB) into {} ({:.1f} MB) in {:.1f}s'.format(
+        len(files), sum(sizes.values()) / 1e6, tfn,
+        os.path.getsize(tfn) / 1e6, time.time() - start))
+    for top_dir, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        print('{:>10.1f} MB  {}'.format(size / 1e6, top_dir))
+
+    if digest_file:
+        write_digest(digest_file, digest, files, cache)
+    return digest
+
+
+def copy_if_changed(src, dest):
+    '''
+    Copy `src` to `dest`, unless `dest` already has its size and mtime.
+    '''
+    src_stat = os.stat(src)
+    try:
+        dest_stat = os.stat(dest)
+    except OSError:
+        dest_stat = None
+    if dest_stat is None or (
+            (dest_stat.st_size, dest_stat.st_mtime_ns) !=
+            (src_stat.st_size, src_stat.st_mtime_ns)):
+        ensure_dir(dirname(dest))
+        shutil.copy2(src, dest)
+
+
+def stage_asset(src, dest, staged):
+    '''
+    Copy the file or directory `src` to `dest`, adding the files copied to
+    the set `staged`.
+    '''
+    if isfile(src):
+        copy_if_changed(src, dest)
+        staged.add(dest)
+        return
+    for root, dirnames, filenames in os.walk(src, followlinks=True):
+        for filename in filenames:
+            fn_dest = join(dest, relpath(join(root, filename), src))
+            copy_if_changed(join(root, filename), fn_dest)
+            staged.add(fn_dest)
+
+
+def remove_unstaged(directory, staged):
+    '''
+    Remove the files of `directory` missing from the set `staged`, and the
+    directories left empty.
+    '''
+    for root, dirnames, filenames in os.walk(directory, topdown=False):
+        for filename in filenames:
+            if join(root, filename) not in staged:
+                os.remove(join(root, filename))
+        if root != directory and not os.listdir(root):
+            os.rmdir(root)
 
 
 def compile_dir(dfn, optimize_python=True):
     '''
     Compile *.py in directory `dfn` to *.pyo
+
+    With python3, the files whose compiled file is up to date are skipped.
     '''
 
     if PYTHON is None:
         return
 
     if int(PYTHON_VERSION[0]) >= 3:
-        args = [PYTHON, '-m', 'compileall', '-b', '-f', dfn]
+        args = [PYTHON, join(curdir, 'compile_pyfiles.py'), dfn]
     else:
         args = [PYTHON, '-m', 'compileall', '-f', dfn]
     if optimize_python:
@@ -233,9 +458,11 @@ main.py that loads it.''')
 
     assets_dir = "src/main/assets"
 
-    # Delete the old assets.
-    shutil.rmtree(assets_dir, ignore_errors=True)
+    # The assets of the previous build are kept, and only copied again if
+    # they changed, those not staged again are removed below.
     ensure_dir(assets_dir)
+    staged_assets = set()
+    private_version = None
 
     # Add extra environment variable file into tar-able directory:
     env_vars_tarpath = tempfile.mkdtemp(prefix="p4a-extra-env-")
@@ -246,6 +473,8 @@ main.py that loads it.''')
             f.write("P4A_ORIENTATION=" + str(args.orientation) + "\n")
         f.write("P4A_NUMERIC_VERSION=" + str(args.numeric_version) + "\n")
         f.write("P4A_MINSDK=" + str(args.min_sdk_version) + "\n")
+        if getattr(args, "log_rate_limit", 0):
+            f.write("P4A_LOG_RATE_LIMIT=" + str(args.log_rate_limit) + "\n")
 
     # Package up the private data (public not supported).
     use_setup_py = get_dist_info_for("use_setup_py",
@@ -301,19 +530,24 @@ main.py that loads it.''')
 
         for asset in args.assets:
             asset_src, asset_dest = asset.split(":")
-            if isfile(realpath(asset_src)):
-                ensure_dir(dirname(join(assets_dir, asset_dest)))
-                shutil.copy(realpath(asset_src), join(assets_dir, asset_dest))
-            else:
-                shutil.copytree(realpath(asset_src), join(assets_dir, asset_dest))
+            stage_asset(realpath(asset_src), join(assets_dir, asset_dest),
+                        staged_assets)
 
         if args.private or args.launcher:
-            make_tar(
-                join(assets_dir, 'private.mp3'), tar_dirs, args.ignore_path,
-                optimize_python=args.optimize_python)
+            private_tar = join(assets_dir, 'private.mp3')
+            # the digest is used as the version of the private data, so that
+            # it is only extracted again on the device when it changed
+            private_manifest = join(assets_dir, 'private.manifest')
+            private_version = make_tar(
+                private_tar, tar_dirs, args.ignore_path,
+                optimize_python=args.optimize_python,
+                digest_file='private.mp3.json',
+                manifest_file=private_manifest)
+            staged_assets.update([private_tar, private_manifest])
     finally:
         for directory in _temp_dirs_to_clean:
             shutil.rmtree(directory)
+    remove_unstaged(assets_dir, staged_assets)
 
     # Remove extra env vars tar-able directory:
     shutil.rmtree(env_vars_tarpath)
@@ -498,7 +732,7 @@ main.py that loads it.''')
     # String resources:
     render_args = {
         "args": args,
-        "private_version": str(time.time())
+        "private_version": private_version or str(time.time())
     }
     if get_bootstrap_name() == "sdl2":
         render_args["url_scheme"] = url_scheme
@@ -668,6 +902,11 @@ tools directory of the Android SDK.
     ap.add_argument('--wakelock', dest='wakelock', action='store_true',
                     help=('Indicate if the application needs the device '
                           'to stay on'))
+    ap.add_argument('--log-rate-limit', dest='log_rate_limit', type=int,
+                    default=0,
+                    help=('The maximum number of entries the output of the '
+                          'app may write to the logcat per second, the '
+                          'others are dropped (default: no limit)'))
     ap.add_argument('--blacklist', dest='blacklist',
                     default=join(curdir, 'blacklist.txt'),
                     help=('Use a blacklist file to match unwanted file in '
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+'''
+Byte-compile the python files of some directories into legacy ``.pyc``
+files, next to their sources, the way ``compileall -b`` does.
+
+This must run with the python the files are compiled for, e.g.
+``hostpython3 -OO compile_pyfiles.py dir [dir...]``. The files are
+compiled by a pool of worker processes, and those whose ``.pyc`` already
+matches the modification time and size of their source are skipped, so
+compiling the same directories again only compiles what changed.
+'''
+
+import argparse
+import importlib.util
+import os
+import py_compile
+import struct
+import sys
+import time
+
+
+def list_sources(directories):
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+            for filename in sorted(files):
+                if filename.endswith('.py'):
+                    yield os.path.join(root, filename)
+
+
+def pyc_header(source):
+    '''The header the ``.pyc`` of an up to date ``source`` starts with.'''
+    source_stat = os.stat(source)
+    mtime = int(source_stat.st_mtime) & 0xFFFFFFFF
+    size = source_stat.st_size & 0xFFFFFFFF
+    if sys.version_info >= (3, 7):
+        # PEP 552: magic, flags (0 for timestamp based pycs), mtime, size
+        return importlib.util.MAGIC_NUMBER + struct.pack('<3L', 0, mtime, size)
+    return importlib.util.MAGIC_NUMBER + struct.pack('<2L', mtime, size)
+
+
+def is_up_to_date(source):
+    header = pyc_header(source)
+    try:
+        with open(source + 'c', 'rb') as fileh:
+            return fileh.read(len(header)) == header
+    except OSError:
+        return False
+
+
+def compile_file(source):
+    '''Compiles ``source``, returns the error message if it fails.'''
+    kwargs = {}
+    if hasattr(py_compile, 'PycInvalidationMode'):
+        # the headers checked by is_up_to_date, even with SOURCE_DATE_EPOCH
+        kwargs['invalidation_mode'] = py_compile.PycInvalidationMode.TIMESTAMP
+    try:
+        py_compile.compile(source, cfile=source + 'c', doraise=True, **kwargs)
+    except (py_compile.PyCompileError, OSError) as error:
+        return str(error)
+    return None
+
+
+def compile_files(sources, jobs):
+    if jobs > 1 and len(sources) > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+            from concurrent.futures.process import BrokenProcessPool
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                return list(executor.map(compile_file, sources, chunksize=32))
+        except (ImportError, NotImplementedError, OSError):
+            # no working multiprocessing in this python, compile serially
+            pass
+        except BrokenProcessPool:
+            # a worker died (e.g. killed when out of memory), start over
+            print('A compile worker died, compiling serially')
+    return [compile_file(source) for source in sources]
+
+
+def main(argv=None):
+    # no __doc__ here, this usually runs with -OO
+    parser = argparse.ArgumentParser(
+        description='Byte-compile the python files of some directories')
+    parser.add_argument('directories', nargs='+')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help='How many worker processes to use (default: the cpu count)')
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help='Compile all the files, even those that seem up to date')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    sources = list(list_sources(args.directories))
+    stale = [source for source in sources
+             if args.force or not is_up_to_date(source)]
+    errors = [(source, error)
+              for source, error in zip(stale, compile_files(stale, args.jobs))
+              if error is not None]
+    for source, error in errors:
+        print('Error compiling {}: {}'.format(source, error))
+    print('Compiled {} of {} python files in {:.1f}s ({} up to date, '
+          '{} failed)'.format(len(stale) - len(errors), len(sources),
+                              time.time() - start, len(sources) - len(stale),
+                              len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,12 +7,14 @@
 
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include <unistd.h>
 #include <dirent.h>
 #include <jni.h>
 #include <sys/stat.h>
 #include <sys/types.h>
 #include <errno.h>
+#include <time.h>
 
 #include "bootstrap_name.h"
 
@@ -40,11 +42,201 @@ static PyMethodDef AndroidEmbedMethods[] = {
     {NULL, NULL, 0, NULL}};
 
 #if PY_MAJOR_VERSION >= 3
+/* androidembed.LogStream: the text stream sys.stdout and sys.stderr are
+ * redirected to. The complete lines of each write are sent to the logcat
+ * as a single entry, and the last line is kept until it is complete. Its
+ * methods run with the GIL held, which serializes the writes of all the
+ * threads. With P4A_LOG_RATE_LIMIT=N in the environment, at most N entries
+ * are logged per second, the others are dropped and counted.
+ */
+#define LOG_ENTRY_MAX 4000  /* logd truncates the entries to ~4 KB */
+#define LOG_TAG_MAX 64
+
+typedef struct {
+  PyObject_HEAD
+  char tag[LOG_TAG_MAX];
+  char buffer[LOG_ENTRY_MAX + 1];
+  Py_ssize_t length;    /* bytes in the buffer */
+  Py_ssize_t complete;  /* bytes of complete lines in the buffer */
+  long rate_limit;      /* entries per second, 0 for no limit */
+  time_t window;        /* the second the entries are counted for */
+  long window_entries;
+  long dropped;
+} LogStreamObject;
+
+static int logstream_allow(LogStreamObject *self) {
+  struct timespec now;
+  char message[64];
+
+  if (self->rate_limit <= 0)
+    return 1;
+  clock_gettime(CLOCK_MONOTONIC, &now);
+  if (now.tv_sec != self->window) {
+    self->window = now.tv_sec;
+    self->window_entries = 0;
+    if (self->dropped > 0) {
+      snprintf(message, sizeof(message), "[dropped %ld log entries]",
+               self->dropped);
+      __android_log_write(ANDROID_LOG_WARN, self->tag, message);
+      self->dropped = 0;
+      self->window_entries++;
+    }
+  }
+  if (self->window_entries >= self->rate_limit) {
+    self->dropped++;
+    return 0;
+  }
+  self->window_entries++;
+  return 1;
+}
+
+/* Logs the first size bytes of the buffer, without their final newline,
+ * as one entry, and removes them from the buffer.
+ */
+static void logstream_emit(LogStreamObject *self, Py_ssize_t size) {
+  Py_ssize_t end = size;
+  char saved;
+
+  if (end > 0 && self->buffer[end - 1] == '\n')
+    end--;
+  if (logstream_allow(self)) {
+    saved = self->buffer[end];
+    self->buffer[end] = '\0';
+    __android_log_write(ANDROID_LOG_INFO, self->tag, self->buffer);
+    self->buffer[end] = saved;
+  }
+  memmove(self->buffer, self->buffer + size, self->length - size);
+  self->length -= size;
+  self->complete = self->complete > size ? self->complete - size : 0;
+}
+
+static int logstream_init(LogStreamObject *self, PyObject *args,
+                          PyObject *kwds) {
+  static char *kwlist[] = {"tag", NULL};
+  const char *tag = getenv("PYTHON_NAME");
+  const char *rate_limit = getenv("P4A_LOG_RATE_LIMIT");
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwds, "|s", kwlist, &tag))
+    return -1;
+  snprintf(self->tag, LOG_TAG_MAX, "%s", tag ? tag : "python");
+  self->length = self->complete = 0;
+  self->rate_limit = rate_limit ? atol(rate_limit) : 0;
+  self->window = 0;
+  self->window_entries = self->dropped = 0;
+  return 0;
+}
+
+static PyObject *logstream_write(LogStreamObject *self, PyObject *args) {
+  PyObject *text;
+  const char *data;
+  const char *newline;
+  Py_ssize_t size, chunk;
+
+  if (!PyArg_ParseTuple(args, "U", &text))
+    return NULL;
+  data = PyUnicode_AsUTF8AndSize(text, &size);
+  if (data == NULL)
+    return NULL;
+  while (size > 0) {
+    newline = memchr(data, '\n', size);
+    chunk = newline ? newline - data + 1 : size;
+    /* the final newline is not logged */
+    if (self->length + chunk - (newline != NULL) > LOG_ENTRY_MAX) {
+      if (self->complete > 0) {
+        /* no room left: log the complete lines first */
+        logstream_emit(self, self->complete);
+        continue;
+      }
+      /* or split the line, between two UTF-8 characters */
+      chunk = LOG_ENTRY_MAX - self->length;
+      while (chunk > 0 && (data[chunk] & 0xC0) == 0x80)
+        chunk--;
+      if (chunk == 0) {
+        logstream_emit(self, self->length);
+        continue;
+      }
+      newline = NULL;
+    }
+    memcpy(self->buffer + self->length, data, chunk);
+    self->length += chunk;
+    data += chunk;
+    size -= chunk;
+    if (newline)
+      self->complete = self->length;
+    else if (self->length == LOG_ENTRY_MAX)
+      logstream_emit(self, self->length);
+  }
+  if (self->complete > 0)
+    logstream_emit(self, self->complete);
+  return PyLong_FromSsize_t(PyUnicode_GET_LENGTH(text));
+}
+
+static PyObject *logstream_flush(LogStreamObject *self,
+                                 PyObject *Py_UNUSED(ignored)) {
+  if (self->length > 0)
+    logstream_emit(self, self->length);
+  Py_RETURN_NONE;
+}
+
+static PyObject *logstream_true(PyObject *self, PyObject *Py_UNUSED(ignored)) {
+  Py_RETURN_TRUE;
+}
+
+static PyObject *logstream_false(PyObject *self,
+                                 PyObject *Py_UNUSED(ignored)) {
+  Py_RETURN_FALSE;
+}
+
+static PyObject *logstream_get_encoding(PyObject *self, void *closure) {
+  return PyUnicode_FromString("utf-8");
+}
+
+static PyMethodDef LogStreamMethods[] = {
+    {"write", (PyCFunction)logstream_write, METH_VARARGS,
+     "Write a string to the logcat, line by line"},
+    {"flush", (PyCFunction)logstream_flush, METH_NOARGS,
+     "Log the last line even if it is not complete"},
+    {"writable", logstream_true, METH_NOARGS, NULL},
+    {"readable", logstream_false, METH_NOARGS, NULL},
+    {"seekable", logstream_false, METH_NOARGS, NULL},
+    {"isatty", logstream_false, METH_NOARGS, NULL},
+    {NULL, NULL, 0, NULL}};
+
+static PyGetSetDef LogStreamGetSet[] = {
+    {"encoding", logstream_get_encoding, NULL, NULL, NULL},
+    {NULL, NULL, NULL, NULL, NULL}};
+
+static PyTypeObject LogStreamType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "androidembed.LogStream",
+    .tp_doc = "A text stream writing to the logcat",
+    .tp_basicsize = sizeof(LogStreamObject),
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_new = PyType_GenericNew,
+    .tp_init = (initproc)logstream_init,
+    .tp_methods = LogStreamMethods,
+    .tp_getset = LogStreamGetSet,
+};
+
 static struct PyModuleDef androidembed = {PyModuleDef_HEAD_INIT, "androidembed",
                                           "", -1, AndroidEmbedMethods};
 
 PyMODINIT_FUNC initandroidembed(void) {
-  return PyModule_Create(&androidembed);
+  PyObject *module;
+
+  if (PyType_Ready(&LogStreamType) < 0)
+    return NULL;
+  module = PyModule_Create(&androidembed);
+  if (module == NULL)
+    return NULL;
+  Py_INCREF(&LogStreamType);
+  if (PyModule_AddObject(module, "LogStream",
+                         (PyObject *)&LogStreamType) < 0) {
+    Py_DECREF(&LogStreamType);
+    Py_DECREF(module);
+    return NULL;
+  }
+  return module;
 }
 #else
 PyMODINIT_FUNC initandroidembed(void) {
@@ -79,7 +271,9 @@ int main(int argc, char *argv[]) {
   char entrypoint[ENTRYPOINT_MAXLEN];
   int ret = 0;
   FILE *fd;
+  struct timespec start_time, end_time;
 
+  clock_gettime(CLOCK_MONOTONIC, &start_time);
   LOGP("Initializing Python for Android");
 
   // Set a couple of built-in environment vars:
@@ -200,8 +394,7 @@ int main(int argc, char *argv[]) {
   initandroidembed();
 #endif
 
-  PyRun_SimpleString("import androidembed\nandroidembed.log('testing python "
-                     "print redirection')");
+  PyRun_SimpleString("import androidembed\n");
 
   /* inject our bootstrap code to redirect python stdin/stdout
    * replace sys.path with our path
@@ -221,8 +414,52 @@ int main(int argc, char *argv[]) {
     PyRun_SimpleString(add_site_packages_dir);
     /* "sys.path.append(join(dirname(realpath(__file__)), 'site-packages'))") */
     PyRun_SimpleString("sys.path = ['.'] + sys.path");
+
+#if PY_MAJOR_VERSION >= 3
+    /* the stdlib modules frozen into libpython (with --freeze-stdlib) have
+     * no __file__, and their packages no __path__ to import the submodules
+     * which are not frozen from: point them to the stdlib zip
+     */
+    char fix_frozen_modules[1024];
+    snprintf(fix_frozen_modules, 1024,
+             "def _p4a_fix_frozen_modules():\n"
+             "    for name, module in list(sys.modules.items()):\n"
+             "        spec = getattr(module, '__spec__', None)\n"
+             "        if (spec is None or spec.origin != 'frozen' or\n"
+             "                name.startswith('_frozen_importlib')):\n"
+             "            continue\n"
+             "        path = '%s/stdlib.zip/' + name.replace('.', '/')\n"
+             "        if spec.submodule_search_locations is not None:\n"
+             "            module.__path__ = [path]\n"
+             "            spec.submodule_search_locations = [path]\n"
+             "            path += '/__init__'\n"
+             "        module.__file__ = path + '.pyc'\n"
+             "_p4a_fix_frozen_modules()\n"
+             "del _p4a_fix_frozen_modules",
+             python_bundle_dir);
+    PyRun_SimpleString(fix_frozen_modules);
+
+    /* import the pure python site-packages from their indexed zip, if
+     * the dist was built with --site-packages-zip
+     */
+    char site_packages_zip[256];
+    char install_site_packages_zip[512];
+    snprintf(site_packages_zip, 256,
+             "%s/site-packages.zip", python_bundle_dir);
+    if (file_exists(site_packages_zip)) {
+      snprintf(install_site_packages_zip, 512,
+               "import _p4a_sitezip\n"
+               "_p4a_sitezip.install('%s')",
+               site_packages_zip);
+      PyRun_SimpleString(install_site_packages_zip);
+    }
+#endif
   }
 
+#if PY_MAJOR_VERSION >= 3
+  PyRun_SimpleString("sys.stdout = androidembed.LogStream()\n"
+                     "sys.stderr = androidembed.LogStream()\n");
+#else
   PyRun_SimpleString(
       "class LogFile(object):\n"
       "    def __init__(self):\n"
@@ -235,11 +472,8 @@ int main(int argc, char *argv[]) {
       "        self.buffer = lines[-1]\n"
       "    def flush(self):\n"
       "        return\n"
-      "sys.stdout = sys.stderr = LogFile()\n"
-      "print('Android path', sys.path)\n"
-      "import os\n"
-      "print('os.environ is', os.environ)\n"
-      "print('Android kivy bootstrap done. __name__ is', __name__)");
+      "sys.stdout = sys.stderr = LogFile()\n");
+#endif
 
 #if PY_MAJOR_VERSION < 3
   PyRun_SimpleString("import site; print site.getsitepackages()\n");
@@ -310,6 +544,13 @@ int main(int argc, char *argv[]) {
     return -1;
   }
 
+  clock_gettime(CLOCK_MONOTONIC, &end_time);
+  char startup_time[64];
+  snprintf(startup_time, sizeof(startup_time), "Python startup took %ld ms",
+           (long)((end_time.tv_sec - start_time.tv_sec) * 1000 +
+                  (end_time.tv_nsec - start_time.tv_nsec) / 1000000));
+  LOGP(startup_time);
+
   /* run python !
    */
   ret = PyRun_SimpleFile(fd, entrypoint);
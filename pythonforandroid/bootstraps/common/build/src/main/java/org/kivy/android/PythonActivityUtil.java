@@ -1,9 +1,10 @@
 package org.kivy.android;
 
-import java.io.InputStream;
-import java.io.FileInputStream;
+import java.io.BufferedReader;
+import java.io.FileReader;
 import java.io.FileOutputStream;
 import java.io.File;
+import java.util.Map;
 
 import android.app.Activity;
 import android.util.Log;
@@ -71,28 +72,46 @@ public class PythonActivityUtil {
         String filesDir = target.getAbsolutePath();
         String diskVersionFn = filesDir + "/" + resource + ".version";
 
+        // The version is a digest of the data, read it whatever its length.
         try {
-            byte buf[] = new byte[64];
-            InputStream is = new FileInputStream(diskVersionFn);
-            int len = is.read(buf);
-            diskVersion = new String(buf, 0, len);
-            is.close();
+            BufferedReader reader = new BufferedReader(new FileReader(diskVersionFn));
+            diskVersion = reader.readLine();
+            reader.close();
         } catch (Exception e) {
             diskVersion = "";
         }
 
         // If the disk data is out of date, extract it and write the version file.
         if (! dataVersion.equals(diskVersion)) {
-            Log.v(TAG, "Extracting " + resource + " assets.");
-
-            recursiveDelete(target);
-            target.mkdirs();
-
             AssetExtract ae = new AssetExtract(mActivity);
-            if (!ae.extractTar(resource + ".mp3", target.getAbsolutePath())) {
+            File diskManifestFile = new File(filesDir + "/" + resource + ".manifest");
+            Map<String, String> manifest = ae.readManifest(resource + ".manifest");
+            Map<String, String> diskManifest = AssetExtract.readManifest(diskManifestFile);
+            boolean extracted;
+
+            // With the manifests of both versions, only extract what changed.
+            if (manifest != null && diskManifest != null) {
+                Log.v(TAG, "Updating " + resource + " assets.");
+                extracted = ae.updateTar(resource + ".mp3", filesDir, manifest, diskManifest);
+            } else {
+                Log.v(TAG, "Extracting " + resource + " assets.");
+
+                recursiveDelete(target);
+                target.mkdirs();
+
+                extracted = ae.extractTar(resource + ".mp3", filesDir);
+            }
+
+            if (!extracted) {
                 toastError("Could not extract " + resource + " data.");
             }
 
+            // Without a manifest matching the files, extract everything next time.
+            if (!extracted || manifest == null ||
+                    !AssetExtract.writeManifest(manifest, diskManifestFile)) {
+                diskManifestFile.delete();
+            }
+
             try {
                 // Write .nomedia.
                 new File(target, ".nomedia").createNewFile();
@@ -7,13 +7,20 @@ import android.util.Log;
 
 import java.io.BufferedInputStream;
 import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
 import java.io.IOException;
 import java.io.InputStream;
+import java.io.InputStreamReader;
 import java.io.OutputStream;
+import java.io.FileInputStream;
 import java.io.FileOutputStream;
 import java.io.FileNotFoundException;
 import java.io.File;
 
+import java.util.HashSet;
+import java.util.LinkedHashMap;
+import java.util.Map;
+import java.util.Set;
 import java.util.zip.GZIPInputStream;
 
 import android.content.res.AssetManager;
@@ -28,9 +35,119 @@ public class AssetExtract {
         mAssetManager = context.getAssets();
     }
 
+    /**
+     * Reads a manifest, made of "<sha256> <path>" lines, into a map of path
+     * to hash. Returns null if it can't be read.
+     */
+    private static Map<String, String> readManifest(InputStream stream) {
+        Map<String, String> manifest = new LinkedHashMap<String, String>();
+
+        try {
+            BufferedReader reader = new BufferedReader(new InputStreamReader(stream, "UTF-8"));
+            String line;
+            while ((line = reader.readLine()) != null) {
+                int space = line.indexOf(' ');
+                if (space > 0) {
+                    manifest.put(line.substring(space + 1), line.substring(0, space));
+                }
+            }
+            reader.close();
+        } catch (IOException e) {
+            Log.w("python", "reading manifest", e);
+            return null;
+        }
+
+        return manifest;
+    }
+
+    /**
+     * Reads the manifest `asset`, returns null if there is none.
+     */
+    public Map<String, String> readManifest(String asset) {
+        try {
+            return readManifest(mAssetManager.open(asset));
+        } catch (IOException e) {
+            return null;
+        }
+    }
+
+    /**
+     * Reads the manifest `file`, returns null if there is none.
+     */
+    public static Map<String, String> readManifest(File file) {
+        try {
+            return readManifest(new FileInputStream(file));
+        } catch (IOException e) {
+            return null;
+        }
+    }
+
+    /**
+     * Writes `manifest` to `file`, the way it is read by readManifest.
+     */
+    public static boolean writeManifest(Map<String, String> manifest, File file) {
+        try {
+            OutputStream out = new BufferedOutputStream(new FileOutputStream(file), 8192);
+            for (Map.Entry<String, String> entry : manifest.entrySet()) {
+                out.write((entry.getValue() + " " + entry.getKey() + "\n").getBytes("UTF-8"));
+            }
+            out.close();
+        } catch (IOException e) {
+            Log.w("python", "writing manifest", e);
+            return false;
+        }
+
+        return true;
+    }
+
+    /**
+     * Updates the files extracted from the tar `asset` into `target`, whose
+     * contents are described by `manifest`, when the files in `target` were
+     * extracted from a tar described by `diskManifest`: only the files added
+     * or changed since (or missing from `target`) are extracted, and the
+     * files removed since are deleted.
+     */
+    public boolean updateTar(String asset, String target,
+                             Map<String, String> manifest, Map<String, String> diskManifest) {
+
+        Set<String> changed = new HashSet<String>();
+        for (Map.Entry<String, String> entry : manifest.entrySet()) {
+            String path = entry.getKey();
+            if (!entry.getValue().equals(diskManifest.get(path)) ||
+                    !new File(target, path).exists()) {
+                changed.add(path);
+            }
+        }
+
+        int removed = 0;
+        for (String path : diskManifest.keySet()) {
+            if (!manifest.containsKey(path) && new File(target, path).delete()) {
+                removed++;
+            }
+        }
+
+        Log.v("python", "updating " + changed.size() + " of " + manifest.size() +
+              " files, removed " + removed + " files");
+
+        if (changed.isEmpty()) {
+            return true;
+        }
+
+        return extractTar(asset, target, changed);
+    }
+
     public boolean extractTar(String asset, String target) {
+        return extractTar(asset, target, null);
+    }
+
+    /**
+     * Extracts the tar `asset` into `target`. If `only` is given, only the
+     * files it names are extracted (the directories always are).
+     */
+    public boolean extractTar(String asset, String target, Set<String> only) {
 
         byte buf[] = new byte[1024 * 1024];
+        int remaining = only == null ? -1 : only.size();
 
         InputStream assetStream = null;
         TarInputStream tis = null;
@@ -53,12 +170,10 @@ public class AssetExtract {
                 return false;
             }
 
-            if ( entry == null ) {
+            if ( entry == null || remaining == 0 ) {
                 break;
             }
 
-            Log.v("python", "extracting " + entry.getName());
-
             if (entry.isDirectory()) {
 
                 try {
@@ -68,6 +183,15 @@ public class AssetExtract {
                 continue;
             }
 
+            if ( only != null ) {
+                if ( !only.contains(entry.getName()) ) {
+                    continue;
+                }
+                remaining--;
+            }
+
+            Log.v("python", "extracting " + entry.getName());
+
             OutputStream out = null;
             String path = target + "/" + entry.getName();
 
@@ -1,5 +1,6 @@
 from pythonforandroid.toolchain import (
     Bootstrap, shprint, current_directory, info, info_main)
+from pythonforandroid.profiler import profile
 from pythonforandroid.util import ensure_dir
 from os.path import join
 import sh
@@ -40,8 +41,9 @@ class SDL2GradleBootstrap(Bootstrap):
                                         dest_dir=join("src", "main", "java"))
 
             ensure_dir(python_bundle_dir)
-            site_packages_dir = self.ctx.python_recipe.create_python_bundle(
-                join(self.dist_dir, python_bundle_dir), arch)
+            with profile(self.ctx, 'bundle', arch=arch):
+                site_packages_dir = self.ctx.python_recipe.create_python_bundle(
+                    join(self.dist_dir, python_bundle_dir), arch)
 
             if 'sqlite3' not in self.ctx.recipe_build_order:
                 with open('blacklist.txt', 'a') as fileh:
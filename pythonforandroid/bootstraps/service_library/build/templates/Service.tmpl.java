@@ -1,9 +1,10 @@
 package {{ args.package }};
 
+import java.io.BufferedReader;
 import java.io.File;
-import java.io.FileInputStream;
 import java.io.FileOutputStream;
-import java.io.InputStream;
+import java.io.FileReader;
+import java.util.Map;
 
 import android.os.Build;
 import android.content.Intent;
@@ -84,12 +85,11 @@ public class Service{{ name|capitalize }} extends PythonService {
         String filesDir = target.getAbsolutePath();
         String disk_version_fn = filesDir + "/" + resource + ".version";
 
+        // The version is a digest of the data, read it whatever its length.
         try {
-            byte buf[] = new byte[64];
-            InputStream is = new FileInputStream(disk_version_fn);
-            int len = is.read(buf);
-            disk_version = new String(buf, 0, len);
-            is.close();
+            BufferedReader reader = new BufferedReader(new FileReader(disk_version_fn));
+            disk_version = reader.readLine();
+            reader.close();
         } catch (Exception e) {
             disk_version = "";
         }
@@ -98,17 +98,36 @@ public class Service{{ name|capitalize }} extends PythonService {
         // version file.
         // if (! data_version.equals(disk_version)) {
         if (! data_version.equals(disk_version)) {
-            Log.v(TAG, "Extracting " + resource + " assets.");
-
-            // Don't delete existing files
-            // recursiveDelete(target);
-            target.mkdirs();
-
             AssetExtract ae = new AssetExtract(ctx);
-            if (!ae.extractTar(resource + ".mp3", target.getAbsolutePath())) {
+            File disk_manifest_file = new File(filesDir + "/" + resource + ".manifest");
+            Map<String, String> manifest = ae.readManifest(resource + ".manifest");
+            Map<String, String> disk_manifest = AssetExtract.readManifest(disk_manifest_file);
+            boolean extracted;
+
+            // With the manifests of both versions, only extract what changed.
+            if (manifest != null && disk_manifest != null) {
+                Log.v(TAG, "Updating " + resource + " assets.");
+                extracted = ae.updateTar(resource + ".mp3", filesDir, manifest, disk_manifest);
+            } else {
+                Log.v(TAG, "Extracting " + resource + " assets.");
+
+                // Don't delete existing files
+                // recursiveDelete(target);
+                target.mkdirs();
+
+                extracted = ae.extractTar(resource + ".mp3", filesDir);
+            }
+
+            if (!extracted) {
                 Log.v(TAG, "Could not extract " + resource + " data.");
             }
 
+            // Without a manifest matching the files, extract everything next time.
+            if (!extracted || manifest == null ||
+                    !AssetExtract.writeManifest(manifest, disk_manifest_file)) {
+                disk_manifest_file.delete();
+            }
+
             try {
                 // Write .nomedia.
                 new File(target, ".nomedia").createNewFile();
@@ -2,6 +2,7 @@ import sh
 from os.path import join
 from pythonforandroid.toolchain import (
     Bootstrap, current_directory, info, info_main, shprint)
+from pythonforandroid.profiler import profile
 from pythonforandroid.util import ensure_dir
 
 
@@ -39,8 +40,9 @@ class ServiceOnlyBootstrap(Bootstrap):
 
             python_bundle_dir = join('_python_bundle', '_python_bundle')
             ensure_dir(python_bundle_dir)
-            site_packages_dir = self.ctx.python_recipe.create_python_bundle(
-                join(self.dist_dir, python_bundle_dir), arch)
+            with profile(self.ctx, 'bundle', arch=arch):
+                site_packages_dir = self.ctx.python_recipe.create_python_bundle(
+                    join(self.dist_dir, python_bundle_dir), arch)
 
             if 'sqlite3' not in self.ctx.recipe_build_order:
                 with open('blacklist.txt', 'a') as fileh:
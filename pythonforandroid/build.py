@@ -1,9 +1,11 @@
 from os.path import (
-    abspath, join, realpath, dirname, expanduser, exists,
+    abspath, join, realpath, relpath, dirname, expanduser, exists,
     split, isdir
 )
 from os import environ
+import atexit
 import copy
+import json
 import os
 import glob
 import sys
@@ -11,16 +13,23 @@ import re
 import sh
 import shutil
 import subprocess
-from contextlib import suppress
+from contextlib import ExitStack, contextmanager, suppress
 
 from pythonforandroid.util import (
-    current_directory, ensure_dir,
-    BuildInterruptingException,
+    current_directory, ensure_dir, file_lock, run_parallel_tasks,
+    temp_directory, BuildInterruptingException,
 )
 from pythonforandroid.logger import (info, warning, info_notify, info_main, shprint)
 from pythonforandroid.archs import ArchARM, ArchARMv7_a, ArchAarch_64, Archx86, Archx86_64
+from pythonforandroid.download import DownloadCache
+from pythonforandroid.elf import DependencyIndex
+from pythonforandroid.jobserver import reserve_jobs, start_jobserver
+from pythonforandroid.prebuilt import (
+    PrebuiltCache, TreeCache, changed_files, copied_files, snapshot_dir)
+from pythonforandroid.profiler import profile
+from pythonforandroid.graph import fix_deplist
 from pythonforandroid.pythonpackage import get_package_name
-from pythonforandroid.recipe import CythonRecipe, Recipe
+from pythonforandroid.recipe import CythonRecipe, PythonRecipe, Recipe
 from pythonforandroid.recommendations import (
     check_ndk_version, check_target_api, check_ndk_api,
     RECOMMENDED_NDK_API, RECOMMENDED_TARGET_API)
@@ -78,6 +87,99 @@ def get_available_apis(sdk_dir):
     return apis
 
 
+def get_dir_key(directory, *subdirs):
+    '''Identifies the state of ``directory`` by its path and the mtimes of
+    it and of ``subdirs`` (which change as things are installed in them),
+    or returns ``None`` if it doesn't exist.'''
+    key = [directory]
+    for path in (directory, ) + tuple(join(directory, d) for d in subdirs):
+        try:
+            key.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            if path == directory:
+                return None
+            key.append(None)
+    return key
+
+
+def get_path_key(path):
+    '''Identifies the state of the executable search ``path`` (a ``PATH``
+    string) by the string and the mtimes of its dirs, which change as
+    executables are installed in or removed from them.'''
+    key = [path]
+    for directory in (path or '').split(os.pathsep):
+        try:
+            key.append(os.stat(directory or '.').st_mtime_ns)
+        except OSError:
+            key.append(None)
+    return key
+
+
+class ToolchainProbe:
+    '''The results of probing the SDK, the NDK and the host tools, stored in
+    ``filename`` to skip the probes (like listing the SDK targets) in the
+    next runs.
+
+    Each result is reused while the key it was probed with is the same, the
+    stored results are discarded by :meth:`clear`.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename) as fileh:
+                self.entries = json.load(fileh)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, name, key, probe):
+        '''Returns the result of ``probe()``, stored as ``name`` for
+        ``key``. A ``None`` key (e.g. a missing directory) is never
+        stored.'''
+        entry = self.entries.get(name)
+        if key is not None and entry is not None and entry['key'] == key:
+            return entry['value']
+        value = probe()
+        if key is not None:
+            self.entries[name] = {'key': key, 'value': value}
+            self.save()
+        return value
+
+    def save(self):
+        temp_filename = '{}.{}.tmp'.format(self.filename, os.getpid())
+        try:
+            with open(temp_filename, 'w') as fileh:
+                json.dump(self.entries, fileh)
+            os.replace(temp_filename, self.filename)
+        except OSError as e:
+            warning('Could not save the toolchain probe {}: {}'.format(
+                self.filename, e))
+
+    def clear(self):
+        self.entries = {}
+        with suppress(FileNotFoundError):
+            os.remove(self.filename)
+
+
+def probe_cython():
+    try:
+        subprocess.check_output([
+            "python3", "-m", "cython", "--help",
+        ])
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+
+def probe_which(executable):
+    path = sh.which(executable)
+    return str(path) if path else None
+
+
+def probe_missing_executables(executables):
+    return [executable for executable in executables
+            if not probe_which(executable)]
+
+
 class Context:
     '''A build context. If anything will be built, an instance this class
     will be instantiated and used to hold all the build state.'''
@@ -88,6 +190,9 @@ class Context:
     # Whether to strip debug symbols in `.so` files
     with_debug_symbols = False
 
+    # Where the debug information of the `.so` files is kept when stripping
+    debug_symbols_dir = None
+
     env = environ.copy()
     # the filepath of toolchain.py
     root_dir = None
@@ -125,11 +230,80 @@ class Context:
 
     java_build_tool = 'auto'
 
+    jobs = 1  # how many recipes may be built at the same time
+
+    # The budget of CPU jobs shared by all the builds (None for one per
+    # CPU), handed out by the JobServer once started
+    cpu_jobs = None
+    jobserver = None
+
+    # The BuildProfiler measuring the phases of the build, if any
+    profiler = None
+
+    # If True, sources are unpacked once and cloned to each arch build dir
+    clone_source_trees = False
+
+    download_jobs = 4  # how many recipes may be downloaded at the same time
+    download_progress = True  # whether to print the download progress
+    download_mirrors = []  # urls or dirs tried before the upstream urls
+
+    # where downloads are cached by content, may be shared between
+    # storage dirs, defaults to a directory inside the storage dir
+    download_cache_dir = None
+
+    # where built recipes are cached, to be restored instead of rebuilt
+    prebuilt_cache_dir = None
+
+    # where the built hostpython trees are cached, shared between all the
+    # storage dirs of the host
+    hostpython_cache_dir = None
+
     @property
     def packages_path(self):
         '''Where packages are downloaded before being unpacked'''
         return join(self.storage_dir, 'packages')
 
+    def start_jobserver(self):
+        '''Starts the :class:`~pythonforandroid.jobserver.JobServer`
+        sharing ``cpu_jobs`` between the builds, if not started yet. Its
+        dir is the same for every build of the storage dir, as it goes in
+        the ``PATH`` the build stamps depend on.'''
+        if self.jobserver is None:
+            self.jobserver = start_jobserver(
+                self, join(self.build_dir, 'jobserver'))
+            atexit.register(self.jobserver.close)
+
+    @property
+    def toolchain_probe(self):
+        '''The :class:`ToolchainProbe` of this storage dir.'''
+        if self._toolchain_probe is None:
+            self._toolchain_probe = ToolchainProbe(
+                join(self.build_dir, 'toolchain_probe.json'))
+        return self._toolchain_probe
+
+    @property
+    def prebuilt_cache(self):
+        '''The :class:`~pythonforandroid.prebuilt.PrebuiltCache` of built
+        recipes, or None if not enabled'''
+        if self.prebuilt_cache_dir is None:
+            return None
+        return PrebuiltCache(self.prebuilt_cache_dir)
+
+    @property
+    def hostpython_cache(self):
+        '''The :class:`~pythonforandroid.prebuilt.TreeCache` of built
+        hostpython trees, or None if not enabled'''
+        if self.hostpython_cache_dir is None:
+            return None
+        return TreeCache(self.hostpython_cache_dir)
+
+    @property
+    def download_cache(self):
+        '''The :class:`~pythonforandroid.download.DownloadCache` holding
+        the downloaded packages'''
+        return DownloadCache(
+            self.download_cache_dir or join(self.storage_dir, 'download_cache'))
+
     @property
     def templates_dir(self):
         return join(self.root_dir, 'templates')
@@ -297,7 +471,11 @@ class Context:
         self.android_api = android_api
 
         check_target_api(android_api, self.archs[0].arch)
-        apis = get_available_apis(self.sdk_dir)
+        # listing the SDK targets takes seconds, it is only done again
+        # once something is installed in the SDK
+        apis = self.toolchain_probe.get(
+            'apis', get_dir_key(self.sdk_dir, 'platforms', 'tools'),
+            lambda: get_available_apis(self.sdk_dir))
         info('Available Android APIs are ({})'.format(
             ', '.join(map(str, apis))))
         if android_api in apis:
@@ -361,16 +539,14 @@ class Context:
 
         check_ndk_api(ndk_api, self.android_api)
 
-        # path to some tools
-        self.ccache = sh.which("ccache")
+        # path to some tools, probed again when the PATH changes
+        path_key = get_path_key(environ.get('PATH'))
+        self.ccache = self.toolchain_probe.get(
+            'ccache', path_key, lambda: probe_which("ccache"))
         if not self.ccache:
             info('ccache is missing, the build will not be optimized in the '
                  'future.')
-        try:
-            subprocess.check_output([
-                "python3", "-m", "cython", "--help",
-            ])
-        except subprocess.CalledProcessError:
+        if not self.toolchain_probe.get('cython', path_key, probe_cython):
             warning('Cython for python3 missing. If you are building for '
                     ' a python 3 target (which is the default)'
                     ' then THINGS WILL BREAK.')
@@ -385,8 +561,10 @@ class Context:
         py_platform = sys.platform
         if py_platform in ['linux2', 'linux3']:
             py_platform = 'linux'
-        toolchain_versions, toolchain_path_exists = get_toolchain_versions(
-            self.ndk_dir, arch)
+        toolchain_versions, toolchain_path_exists = self.toolchain_probe.get(
+            'toolchain_versions_{}'.format(toolchain_prefix),
+            get_dir_key(self.ndk_dir, 'toolchains'),
+            lambda: get_toolchain_versions(self.ndk_dir, arch))
         ok = ok and toolchain_path_exists
         toolchain_versions.sort()
 
@@ -421,19 +599,25 @@ class Context:
                 toolchain_version=toolchain_version,
                 py_platform=py_platform, path=environ.get('PATH'))
 
-        for executable in ("pkg-config", "autoconf", "automake", "libtoolize",
-                           "tar", "bzip2", "unzip", "make", "gcc", "g++"):
-            if not sh.which(executable):
-                warning(f"Missing executable: {executable} is not installed")
+        missing_executables = self.toolchain_probe.get(
+            'missing_executables', get_path_key(environ.get('PATH')),
+            lambda: probe_missing_executables((
+                "pkg-config", "autoconf", "automake", "libtoolize", "tar",
+                "bzip2", "unzip", "make", "gcc", "g++")))
+        for executable in missing_executables:
+            warning(f"Missing executable: {executable} is not installed")
 
         if not ok:
             raise BuildInterruptingException(
                 'python-for-android cannot continue due to the missing executables above')
 
+        self._build_env_prepared = True
+
     def __init__(self):
         self.include_dirs = []
 
         self._build_env_prepared = False
+        self._toolchain_probe = None
 
         self._sdk_dir = None
         self._ndk_dir = None
@@ -446,6 +630,16 @@ class Context:
 
         self.local_recipes = None
         self.copy_libs = False
+        # whether biglink links with lld, using several threads
+        self.biglink_lld = False
+        # whether the pure Python site-packages are bundled in a zip
+        self.site_packages_zip = False
+        # whether python3 and hostpython3 are built with LTO (and PGO for
+        # hostpython3), and the dir of the profile data of python3
+        self.optimize_python = False
+        self.python_pgo_dir = None
+        # whether the startup modules of the stdlib are frozen into python3
+        self.freeze_stdlib = False
 
         self.activity_class_name = u'org.kivy.android.PythonActivity'
 
@@ -550,59 +744,341 @@ def build_recipes(build_order, python_modules, ctx, project_dir,
              'installed with pip.').format(', '.join(python_modules)))
 
     recipes = [Recipe.get_recipe(name, ctx) for name in build_order]
+    ctx.start_jobserver()
 
     # download is arch independent
     info_main('# Downloading recipes ')
-    for recipe in recipes:
-        recipe.download_if_necessary()
+    download_recipes(recipes, ctx)
+
+    if ctx.jobs > 1:
+        build_recipes_in_parallel(recipes, ctx)
+    else:
+        build_recipes_serially(recipes, ctx)
+
+    info_main('# Installing pure Python modules')
+    with profile(ctx, 'pymodules_install'):
+        run_pymodules_install(
+            ctx, python_modules, project_dir,
+            ignore_setup_py=ignore_project_setup_py
+        )
+
+
+def download_recipes(recipes, ctx):
+    '''Downloads the recipes using up to ``ctx.download_jobs`` worker
+    processes. Each recipe is fetched through the shared download cache,
+    so concurrent builds do not download the same file twice.'''
+    if ctx.download_jobs <= 1 or len(recipes) <= 1:
+        for recipe in recipes:
+            with profile(ctx, 'download', recipe.name):
+                recipe.download_if_necessary()
+        return
+
+    recipes_by_name = {recipe.name: recipe for recipe in recipes}
+
+    def download(name):
+        # progress lines of concurrent downloads would garble each other
+        ctx.download_progress = False
+        with profile(ctx, 'download', name):
+            recipes_by_name[name].download_if_necessary()
+
+    run_parallel_tasks(list(recipes_by_name), download, ctx.download_jobs)
+
+
+def prepare_recipe_build_dir(recipe, arch):
+    '''Prepares the build dir of ``recipe`` for ``arch``, starting from a
+    clean one if the recipe sources (version, downloads, patches...)
+    changed since it was prepared.'''
+    source_stamp = recipe.get_source_stamp(arch)
+    build_dir = recipe.get_build_dir(arch.arch)
+    with profile(recipe.ctx, 'unpack', recipe.name, arch):
+        if recipe.read_stamp(arch, 'source') not in (None, source_stamp) and \
+                exists(build_dir):
+            info('{} sources changed, deleting {}'.format(
+                recipe.name, build_dir))
+            shutil.rmtree(build_dir)
+        if exists(build_dir) or not restore_prebuilt_recipe(recipe, arch):
+            recipe.prepare_build_dir(arch.arch)
+    recipe.write_stamp(arch, 'source', source_stamp)
+
+
+def get_prebuilt_roots(recipe, arch):
+    '''Returns the directories a prebuilt recipe artifact is made of.'''
+    ctx = recipe.ctx
+    return {'build': ctx.build_dir,
+            'libs': ctx.get_libs_dir(arch.arch),
+            'python': ctx.get_python_install_dir()}
+
+
+def get_prebuilt_lock(recipe, arch):
+    '''The lock serializing the writes of prebuilt artifacts to the libs
+    dir of ``arch``.'''
+    return join(recipe.ctx.build_dir, 'prebuilt-{}.lock'.format(arch.arch))
+
+
+def use_prebuilt_cache(recipe):
+    return (recipe.ctx.prebuilt_cache is not None and
+            recipe.prebuilt_cacheable and
+            'P4A_{}_DIR'.format(recipe.name.lower()) not in environ)
+
+
+def restore_prebuilt_recipe(recipe, arch):
+    '''Restores the build outputs of ``recipe`` for ``arch`` from the
+    prebuilt recipes cache, if they are there. Returns whether they
+    were.'''
+    if not use_prebuilt_cache(recipe):
+        return False
+    cache = recipe.ctx.prebuilt_cache
+    artifact = cache.lookup(recipe.name, recipe.get_stamp_arch(arch).arch,
+                            recipe.get_artifact_key(arch))
+    if artifact is None:
+        return False
+    info_main('Restoring prebuilt {} for {}'.format(recipe.name, arch.arch))
+    with file_lock(get_prebuilt_lock(recipe, arch)):
+        cache.restore(artifact, get_prebuilt_roots(recipe, arch),
+                      recipe.ctx.storage_dir)
+    # the restored build is not the one the build stamp was stored for
+    build_stamp_filename = recipe.get_stamp_filename(arch, 'build')
+    if exists(build_stamp_filename):
+        os.unlink(build_stamp_filename)
+    # tells build_recipe not to build it again
+    recipe.write_stamp(arch, 'prebuilt', recipe.get_artifact_key(arch))
+    return True
+
+
+@contextmanager
+def store_prebuilt_recipe(recipe, arch):
+    '''Stores what the build of ``recipe`` for ``arch`` run in this
+    context produced in the prebuilt recipes cache: its build dir, its
+    objects dir and the files added to the libs and python-installs dirs.
+
+    Files are attributed to the recipe by comparing the dirs before and
+    after the build. The libs dir is shared by the builds running at the
+    same time for the arch, so only the libraries copied from the build
+    dirs of the recipe are kept. The python recipes install much more
+    into the python-installs dir, so their builds are serialized.'''
+    if not use_prebuilt_cache(recipe):
+        yield
+        return
+    ctx = recipe.ctx
+    roots = get_prebuilt_roots(recipe, arch)
+    is_python_recipe = isinstance(recipe, PythonRecipe)
+    with ExitStack() as locks:
+        if is_python_recipe:
+            locks.enter_context(file_lock(
+                join(ctx.build_dir, 'prebuilt-python.lock')))
+        libs_snapshot = snapshot_dir(roots['libs'])
+        python_snapshot = snapshot_dir(roots['python']) if is_python_recipe else None
+        yield
+        build_dirs = [recipe.get_build_dir(arch.arch)]
+        objects_dir = join(recipe.get_build_container_dir(arch.arch),
+                           'objects_{}'.format(recipe.name))
+        if exists(objects_dir):
+            build_dirs.append(objects_dir)
+        locks.enter_context(file_lock(get_prebuilt_lock(recipe, arch)))
+        contents = {
+            'build': (ctx.build_dir, [relpath(build_dir, ctx.build_dir)
+                                      for build_dir in build_dirs]),
+            'libs': (roots['libs'], copied_files(
+                roots['libs'], changed_files(roots['libs'], libs_snapshot),
+                build_dirs)),
+        }
+        if is_python_recipe:
+            contents['python'] = (
+                roots['python'], changed_files(roots['python'], python_snapshot))
+        ctx.prebuilt_cache.store(
+            recipe.name, recipe.get_stamp_arch(arch).arch,
+            recipe.get_artifact_key(arch), contents, ctx.storage_dir)
+
+
+def build_recipe(recipe, arch):
+    '''Builds ``recipe`` for ``arch`` if the recipe says so, or if its
+    build stamp changed since it was last built: its sources, build
+    environment or any of its dependencies changed. A recipe which was
+    just restored from the prebuilt cache is not built.'''
+    needs_build = recipe.should_build(arch)
+    build_stamp = recipe.get_build_stamp(arch)
+    restored = use_prebuilt_cache(recipe) and (
+        recipe.read_stamp(arch, 'prebuilt') == recipe.get_artifact_key(arch))
+    if restored:
+        info('{} was restored from the prebuilt cache, skipping'.format(
+            recipe.name))
+        needs_build = False
+    elif not needs_build and \
+            recipe.read_stamp(arch, 'build') not in (None, build_stamp):
+        info('{} build inputs changed, rebuilding'.format(recipe.name))
+        needs_build = True
+    ctx = recipe.ctx
+    if needs_build:
+        with store_prebuilt_recipe(recipe, arch):
+            # the job of the make run by the recipe, the other ones are
+            # taken by make from the jobserver
+            with profile(ctx, 'build', recipe.name, arch), \
+                    reserve_jobs(ctx):
+                recipe.build_arch(arch)
+            with profile(ctx, 'install_libraries', recipe.name, arch):
+                recipe.install_libraries(arch)
+    else:
+        if not restored:
+            info('{} said it is already built, skipping'.format(recipe.name))
+        with profile(ctx, 'install_libraries', recipe.name, arch):
+            recipe.install_libraries(arch)
+    recipe.write_stamp(arch, 'build', build_stamp)
+    if restored:
+        # the next runs go by the build stamp and the recipe again
+        os.unlink(recipe.get_stamp_filename(arch, 'prebuilt'))
+
+
+def prebuild_recipe(recipe, arch):
+    with profile(recipe.ctx, 'prebuild', recipe.name, arch):
+        recipe.prebuild_arch(arch)
+    with profile(recipe.ctx, 'patch', recipe.name, arch):
+        recipe.apply_patches(arch)
 
+
+def biglink_arch(ctx, arch):
+    if not ctx.python_recipe:
+        with profile(ctx, 'biglink', arch=arch):
+            biglink(ctx, arch)
+    else:
+        warning(
+            "Context's python recipe found, "
+            "skipping biglink (will this work?)"
+        )
+
+
+def postbuild_recipe(recipe, arch):
+    with profile(recipe.ctx, 'postbuild', recipe.name, arch):
+        recipe.postbuild_arch(arch)
+
+
+def build_recipes_serially(recipes, ctx):
     for arch in ctx.archs:
         info_main('# Building all recipes for arch {}'.format(arch.arch))
 
         info_main('# Unpacking recipes')
         for recipe in recipes:
             ensure_dir(recipe.get_build_container_dir(arch.arch))
-            recipe.prepare_build_dir(arch.arch)
+            prepare_recipe_build_dir(recipe, arch)
 
         info_main('# Prebuilding recipes')
         # 2) prebuild packages
         for recipe in recipes:
             info_main('Prebuilding {} for {}'.format(recipe.name, arch.arch))
-            recipe.prebuild_arch(arch)
-            recipe.apply_patches(arch)
+            prebuild_recipe(recipe, arch)
 
         # 3) build packages
         info_main('# Building recipes')
         for recipe in recipes:
             info_main('Building {} for {}'.format(recipe.name, arch.arch))
-            if recipe.should_build(arch):
-                recipe.build_arch(arch)
-            else:
-                info('{} said it is already built, skipping'
-                     .format(recipe.name))
-            recipe.install_libraries(arch)
+            build_recipe(recipe, arch)
 
         # 4) biglink everything
         info_main('# Biglinking object files')
-        if not ctx.python_recipe:
-            biglink(ctx, arch)
-        else:
-            warning(
-                "Context's python recipe found, "
-                "skipping biglink (will this work?)"
-            )
+        biglink_arch(ctx, arch)
 
         # 5) postbuild packages
         info_main('# Postbuilding recipes')
         for recipe in recipes:
             info_main('Postbuilding {} for {}'.format(recipe.name, arch.arch))
-            recipe.postbuild_arch(arch)
+            postbuild_recipe(recipe, arch)
 
-    info_main('# Installing pure Python modules')
-    run_pymodules_install(
-        ctx, python_modules, project_dir,
-        ignore_setup_py=ignore_project_setup_py
-    )
+
+def get_recipe_build_graph(recipes, archs):
+    '''Returns a dict mapping each ``(recipe name, arch name)`` build step
+    to the set of build steps that must be finished before it can start.
+
+    Besides the dependencies of each recipe (for the same arch), the build
+    steps of a recipe whose build dir is shared between archs (e.g.
+    hostpython3 or the bootstrap's NDK recipes), or which installs into the
+    arch independent site-packages, are chained one arch after the other.
+    '''
+    names = {recipe.name.lower(): recipe.name for recipe in recipes}
+    graph = {}
+    for recipe in recipes:
+        depends = {dep for alternatives in fix_deplist(recipe.depends or [])
+                   for dep in alternatives}
+        depends.update(dep.lower() for dep in recipe.opt_depends or [])
+        depends = {names[dep] for dep in depends if dep in names}
+        for index, arch in enumerate(archs):
+            graph[(recipe.name, arch.arch)] = {
+                (dep, arch.arch) for dep in depends}
+            if index == 0:
+                continue
+            previous_arch = archs[index - 1].arch
+            if (isinstance(recipe, PythonRecipe) or
+                    recipe.get_build_dir(arch.arch) ==
+                    recipe.get_build_dir(previous_arch)):
+                graph[(recipe.name, arch.arch)].add(
+                    (recipe.name, previous_arch))
+    return graph
+
+
+def build_recipes_in_parallel(recipes, ctx):
+    '''Builds the recipes for all archs using up to ``ctx.jobs`` worker
+    processes, building a recipe as soon as all of its dependencies are
+    built for the same arch.
+
+    The per recipe phases keep the same order as :func:`build_recipes_serially`:
+    every recipe is unpacked, prebuilt and patched before anything gets
+    built, and biglink and postbuild happen once all the recipes of an arch
+    are built.
+    '''
+    archs = {arch.arch: arch for arch in ctx.archs}
+    recipes_by_name = {recipe.name: recipe for recipe in recipes}
+
+    info_main('# Unpacking recipes using {} jobs'.format(ctx.jobs))
+    # A build dir shared between archs must be unpacked by a single worker
+    unpack_steps = {}
+    for arch in ctx.archs:
+        for recipe in recipes:
+            ensure_dir(recipe.get_build_container_dir(arch.arch))
+            unpack_steps.setdefault(
+                recipe.get_build_dir(arch.arch), []).append((recipe, arch))
+
+    def unpack(build_dir):
+        for recipe, arch in unpack_steps[build_dir]:
+            prepare_recipe_build_dir(recipe, arch)
+
+    run_parallel_tasks(unpack_steps, unpack, ctx.jobs)
+
+    info_main('# Prebuilding recipes')
+    for arch in ctx.archs:
+        for recipe in recipes:
+            info_main('Prebuilding {} for {}'.format(recipe.name, arch.arch))
+            prebuild_recipe(recipe, arch)
+
+    def build(step):
+        recipe, arch = recipes_by_name[step[0]], archs[step[1]]
+        info_main('Building {} for {}'.format(recipe.name, arch.arch))
+        build_recipe(recipe, arch)
+        # The state that recipes share through the context, which the
+        # workers of the recipes depending on this one must inherit
+        return {
+            'hostpython': getattr(ctx, 'hostpython', None),
+            'extra_global_link_paths': arch.extra_global_link_paths,
+        }
+
+    def restore_shared_state(step, state):
+        if state['hostpython'] is not None:
+            ctx.hostpython = state['hostpython']
+        arch = archs[step[1]]
+        for link_path in state['extra_global_link_paths']:
+            if link_path not in arch.extra_global_link_paths:
+                arch.extra_global_link_paths.append(link_path)
+
+    info_main('# Building recipes using {} jobs'.format(ctx.jobs))
+    graph = get_recipe_build_graph(recipes, ctx.archs)
+    run_parallel_tasks(graph, build, ctx.jobs, dependencies=graph,
+                       on_result=restore_shared_state)
+
+    for arch in ctx.archs:
+        info_main('# Biglinking object files for arch {}'.format(arch.arch))
+        biglink_arch(ctx, arch)
+
+        info_main('# Postbuilding recipes')
+        for recipe in recipes:
+            info_main('Postbuilding {} for {}'.format(recipe.name, arch.arch))
+            postbuild_recipe(recipe, arch)
 
 
 def project_has_setup_py(project_dir):
@@ -843,10 +1319,9 @@ def run_pymodules_install(ctx, modules, project_dir=None,
 
 
 def biglink(ctx, arch):
-    # First, collate object files from each recipe
+    # First, find the object files of each recipe, linked from where they are
     info('Collating object files from each recipe')
-    obj_dir = join(ctx.bootstrap.build_dir, 'collated_objects')
-    ensure_dir(obj_dir)
+    objs_paths = []
     recipes = [Recipe.get_recipe(name, ctx) for name in ctx.recipe_build_order]
     for recipe in recipes:
         recipe_obj_dir = join(recipe.get_build_container_dir(arch.arch),
@@ -855,40 +1330,70 @@ def biglink(ctx, arch):
             info('{} recipe has no biglinkable files dir, skipping'
                  .format(recipe.name))
             continue
-        files = glob.glob(join(recipe_obj_dir, '*'))
-        if not len(files):
+        if not os.listdir(recipe_obj_dir):
             info('{} recipe has no biglinkable files, skipping'
                  .format(recipe.name))
             continue
-        info('{} recipe has object files, copying'.format(recipe.name))
-        files.append(obj_dir)
-        shprint(sh.cp, '-r', *files)
+        info('{} recipe has object files'.format(recipe.name))
+        objs_paths.append(recipe_obj_dir)
 
     env = arch.get_env()
     env['LDFLAGS'] = env['LDFLAGS'] + ' -L{}'.format(
         join(ctx.bootstrap.build_dir, 'obj', 'local', arch.arch))
 
-    if not len(glob.glob(join(obj_dir, '*'))):
+    if not objs_paths:
         info('There seem to be no libraries to biglink, skipping.')
         return
     info('Biglinking')
     info('target {}'.format(join(ctx.get_libs_dir(arch.arch),
                                  'libpymodules.so')))
-    do_biglink = copylibs_function if ctx.copy_libs else biglink_function
+    kwargs = {}
+    if ctx.copy_libs:
+        do_biglink = copylibs_function
+        kwargs['dependency_index'] = DependencyIndex(
+            join(ctx.build_dir, 'elf_dependency_index.json'))
+    else:
+        do_biglink = biglink_function
+        kwargs['use_lld'] = ctx.biglink_lld
 
     # Move to the directory containing crtstart_so.o and crtend_so.o
     # This is necessary with newer NDKs? A gcc bug?
     with current_directory(join(ctx.ndk_platform, 'usr', 'lib')):
         do_biglink(
             join(ctx.get_libs_dir(arch.arch), 'libpymodules.so'),
-            obj_dir.split(' '),
+            objs_paths,
             extra_link_dirs=[join(ctx.bootstrap.build_dir,
                                   'obj', 'local', arch.arch),
                              os.path.abspath('.')],
-            env=env)
+            env=env, **kwargs)
+
+
+def unique_link_args(args):
+    '''Returns ``args`` without the empty and repeated arguments (nor lone
+    ``-L``), keeping the last occurrence of each, so that the libraries
+    stay after the objects needing them.'''
+    seen = set()
+    unique_args = []
+    for arg in reversed(args):
+        if not arg or arg == '-L' or arg in seen:
+            continue
+        seen.add(arg)
+        unique_args.append(arg)
+    unique_args.reverse()
+    return unique_args
+
 
+def write_response_file(filename, args):
+    '''Writes ``args`` to the response file ``filename``, read by the
+    compiler when given ``@filename``, so that there is no limit on the
+    length of the command line.'''
+    with open(filename, 'w') as fileh:
+        for arg in args:
+            fileh.write(re.sub(r'([\s"\'\\])', r'\\\1', arg) + '\n')
 
-def biglink_function(soname, objs_paths, extra_link_dirs=None, env=None):
+
+def biglink_function(soname, objs_paths, extra_link_dirs=None, env=None,
+                     use_lld=False):
     if extra_link_dirs is None:
         extra_link_dirs = []
     print('objs_paths are', objs_paths)
@@ -917,33 +1422,42 @@ def biglink_function(soname, objs_paths, extra_link_dirs=None, env=None):
             data = fd.read()
             args.extend(data.split(" "))
 
-    unique_args = []
-    while args:
-        a = args.pop()
-        if a in ('-L', ):
-            continue
-        if a not in unique_args:
-            unique_args.insert(0, a)
-
-    for dir in extra_link_dirs:
-        link = '-L{}'.format(dir)
-        if link not in unique_args:
-            unique_args.append(link)
+    args.extend('-L{}'.format(dir) for dir in extra_link_dirs)
+    unique_args = unique_link_args(args)
+    if use_lld:
+        # lld uses all the cpus by default, and lld 11 replaced the
+        # --threads flag by --threads=N
+        unique_args = ['-fuse-ld=lld'] + unique_args
 
     cc_name = env['CC']
     cc = sh.Command(cc_name.split()[0])
     cc = cc.bake(*cc_name.split()[1:])
 
-    shprint(cc, '-shared', '-O3', '-o', soname, *unique_args, _env=env)
+    with temp_directory() as temp_dir:
+        response_file = join(temp_dir, 'biglink.args')
+        write_response_file(response_file, unique_args)
+        shprint(cc, '-shared', '-O3', '-o', soname, '@' + response_file,
+                _env=env)
+
+
+def _list_dir(directory, listings):
+    if directory not in listings:
+        try:
+            listings[directory] = set(os.listdir(directory))
+        except OSError:
+            listings[directory] = set()
+    return listings[directory]
 
 
-def copylibs_function(soname, objs_paths, extra_link_dirs=None, env=None):
+def copylibs_function(soname, objs_paths, extra_link_dirs=None, env=None,
+                      dependency_index=None):
     if extra_link_dirs is None:
         extra_link_dirs = []
+    if dependency_index is None:
+        dependency_index = DependencyIndex()
     print('objs_paths are', objs_paths)
 
-    re_needso = re.compile(r'^.*\(NEEDED\)\s+Shared library: \[lib(.*)\.so\]\s*$')
-    blacklist_libs = (
+    blacklist_libs = {
         'c',
         'stdc++',
         'dl',
@@ -963,16 +1477,11 @@ def copylibs_function(soname, objs_paths, extra_link_dirs=None, env=None):
         'SDL2_ttf',
         'SDL2_image',
         'SDL2_mixer',
-    )
-    found_libs = []
+    }
+    found_libs = set()
     sofiles = []
-    if env and 'READELF' in env:
-        readelf = env['READELF']
-    elif 'READELF' in os.environ:
-        readelf = os.environ['READELF']
-    else:
-        readelf = sh.which('readelf').strip()
-    readelf = sh.Command(readelf).bake('-d')
+    # the files of each lib dir, listed once
+    listings = {}
 
     dest = dirname(soname)
 
@@ -989,82 +1498,72 @@ def copylibs_function(soname, objs_paths, extra_link_dirs=None, env=None):
 
             with open(fn) as f:
                 libs = f.read().strip().split(' ')
-                needed_libs = [lib for lib in libs
-                               if lib and
-                               lib not in blacklist_libs and
-                               lib not in found_libs]
+            # a dict, to keep the libs in order
+            needed_libs = dict.fromkeys(
+                lib for lib in libs
+                if lib and lib not in blacklist_libs and lib not in found_libs)
+
+            with open(dirfn) as f:
+                # don't need to copy from dest to dest!
+                libdirs = [libdir.strip() for libdir in f.read().split()
+                           if libdir != dest]
 
             while needed_libs:
                 print('need libs:\n\t' + '\n\t'.join(needed_libs))
 
-                start_needed_libs = needed_libs[:]
+                start_needed_libs = list(needed_libs)
                 found_sofiles = []
 
-                with open(dirfn) as f:
-                    libdirs = f.read().split()
-                    for libdir in libdirs:
-                        if not needed_libs:
-                            break
+                for libdir in libdirs:
+                    if not needed_libs:
+                        break
+
+                    print('scanning', libdir)
+                    libdir_files = _list_dir(libdir, listings)
+                    for lib in list(needed_libs):
+                        if lib.endswith('.a'):
+                            del needed_libs[lib]
+                            found_libs.add(lib)
+                            continue
 
-                        if libdir == dest:
-                            # don't need to copy from dest to dest!
+                        sopath = None
+                        if 'lib' + lib + '.so' in libdir_files:
+                            sopath = join(libdir, 'lib' + lib + '.so')
+                        elif lib + '.so' in libdir_files:
+                            sopath = join(libdir, lib + '.so')
+
+                        if sopath:
+                            print('found', lib, 'in', libdir)
+                            found_sofiles.append(sopath)
+                            del needed_libs[lib]
+                            found_libs.add(lib)
                             continue
 
-                        libdir = libdir.strip()
-                        print('scanning', libdir)
-                        for lib in needed_libs[:]:
-                            if lib in found_libs:
-                                continue
-
-                            if lib.endswith('.a'):
-                                needed_libs.remove(lib)
-                                found_libs.append(lib)
-                                continue
-
-                            lib_a = 'lib' + lib + '.a'
-                            libpath_a = join(libdir, lib_a)
-                            lib_so = 'lib' + lib + '.so'
-                            libpath_so = join(libdir, lib_so)
-                            plain_so = lib + '.so'
-                            plainpath_so = join(libdir, plain_so)
-
-                            sopath = None
-                            if exists(libpath_so):
-                                sopath = libpath_so
-                            elif exists(plainpath_so):
-                                sopath = plainpath_so
-
-                            if sopath:
-                                print('found', lib, 'in', libdir)
-                                found_sofiles.append(sopath)
-                                needed_libs.remove(lib)
-                                found_libs.append(lib)
-                                continue
-
-                            if exists(libpath_a):
-                                print('found', lib, '(static) in', libdir)
-                                needed_libs.remove(lib)
-                                found_libs.append(lib)
-                                continue
+                        if 'lib' + lib + '.a' in libdir_files:
+                            print('found', lib, '(static) in', libdir)
+                            del needed_libs[lib]
+                            found_libs.add(lib)
+                            continue
 
                 for sofile in found_sofiles:
                     print('scanning dependencies for', sofile)
-                    out = readelf(sofile)
-                    for line in out.splitlines():
-                        needso = re_needso.match(line)
-                        if needso:
-                            lib = needso.group(1)
-                            if (lib not in needed_libs
-                                    and lib not in found_libs
-                                    and lib not in blacklist_libs):
-                                needed_libs.append(needso.group(1))
+                    for needed in dependency_index.get_needed(sofile):
+                        if not (needed.startswith('lib') and
+                                needed.endswith('.so')):
+                            continue
+                        lib = needed[3:-3]
+                        if (lib not in needed_libs
+                                and lib not in found_libs
+                                and lib not in blacklist_libs):
+                            needed_libs[lib] = None
 
                 sofiles += found_sofiles
 
-                if needed_libs == start_needed_libs:
+                if list(needed_libs) == start_needed_libs:
                     raise RuntimeError(
                             'Failed to locate needed libraries!\n\t' +
                             '\n\t'.join(needed_libs))
 
+    dependency_index.save()
     print('Copying libraries')
     shprint(sh.cp, *sofiles, dest)
@@ -0,0 +1,235 @@
+"""
+Helpers to fetch recipe sources: a resumable url downloader and a
+content-addressed cache that can be shared between storage dirs.
+"""
+
+from http.client import HTTPException
+from os.path import (
+    abspath, basename, dirname, exists, getsize, isdir, isfile, join)
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import Request, pathname2url, urlopen
+import hashlib
+import os
+import shutil
+import time
+
+from pythonforandroid.logger import debug, info, warning
+from pythonforandroid.util import ensure_dir, file_lock
+
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_ATTEMPTS = 5
+
+DownloadError = (OSError, HTTPException)
+'''The exceptions raised by a failed or interrupted transfer.'''
+
+
+def sha256sum(filen):
+    '''Calculate the sha256sum of a file.'''
+    sha256 = hashlib.sha256()
+    with open(filen, 'rb') as fileh:
+        for chunk in iter(lambda: fileh.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def url_key(url):
+    '''The name under which ``url`` is indexed in a :class:`DownloadCache`.'''
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def mirror_url(mirror, url):
+    '''Returns the location of ``url`` in ``mirror``, which may be an url
+    (e.g. ``file:///srv/p4a-mirror`` or ``https://host/p4a``) or a local
+    directory. Mirrors are flat: files are looked up by their basename.'''
+    filename = basename(urlparse(url).path)
+    if '://' not in mirror:
+        return 'file://' + pathname2url(abspath(join(mirror, filename)))
+    return '{}/{}'.format(mirror.rstrip('/'), filename)
+
+
+def _fetch(url, partial, report_hook=None):
+    offset = getsize(partial) if exists(partial) else 0
+    request = Request(url)
+    if offset:
+        request.add_header('Range', 'bytes={}-'.format(offset))
+    with urlopen(request) as response:
+        if offset and getattr(response, 'status', None) != 206:
+            # the server ignored the range, start over
+            offset = 0
+        length = response.headers.get('Content-Length')
+        total = offset + int(length) if length else -1
+        received = offset
+        with open(partial, 'ab' if offset else 'wb') as fileh:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                fileh.write(chunk)
+                received += len(chunk)
+                if report_hook:
+                    report_hook(received, total)
+    if total > 0 and received < total:
+        raise OSError('Connection closed after {} of {} bytes'.format(
+            received, total))
+
+
+def download_url(url, target, report_hook=None, attempts=DOWNLOAD_ATTEMPTS):
+    '''Downloads ``url`` (http, https or file) to ``target``.
+
+    Data goes to ``target + '.part'`` until the transfer completes, so an
+    interrupted download is resumed with an HTTP range request by the next
+    attempt, or by the next call. ``report_hook`` is called as
+    ``report_hook(received_bytes, total_bytes)``, ``total_bytes`` being -1
+    when unknown.'''
+    partial = target + '.part'
+    attempt = 0
+    while True:
+        try:
+            _fetch(url, partial, report_hook)
+        except DownloadError as exc:
+            if isinstance(exc, HTTPError) and exc.code == 416:
+                # range not satisfiable: the partial file is no good
+                os.unlink(partial)
+            attempt += 1
+            if attempt >= attempts:
+                raise
+            warning('Download of {} failed ({}), retrying in a second...'.format(
+                url, exc))
+            time.sleep(1)
+            continue
+        break
+    os.replace(partial, target)
+    return target
+
+
+def link_or_copy(source, target):
+    '''Hardlinks ``source`` to ``target``, or copies it if the two are not
+    on the same filesystem.'''
+    if exists(target):
+        os.unlink(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+    return target
+
+
+class DownloadCache:
+    '''A content-addressed store for downloaded files.
+
+    Files are stored once under ``<root>/sha256/<digest>``, whatever the
+    url or mirror they came from, and ``<root>/urls/<key>`` records the
+    digest a given url resolved to. Every url is fetched while holding a
+    file lock, so several processes sharing ``root`` (parallel downloads,
+    other storage dirs or CI workers on the same host) download it only
+    once, and resume each other's interrupted transfers.'''
+
+    def __init__(self, root):
+        self.root = root
+
+    def blob_path(self, digest):
+        return join(self.root, 'sha256', digest)
+
+    def index_path(self, url):
+        return join(self.root, 'urls', url_key(url))
+
+    def lookup(self, url, sha256=None):
+        '''Returns the cached file for ``url``, or ``None``. If ``sha256`` is
+        known, a file with that content is returned even if it was
+        downloaded from elsewhere.'''
+        if sha256 is None:
+            index = self.index_path(url)
+            if not isfile(index):
+                return None
+            with open(index) as fileh:
+                sha256 = fileh.read().strip()
+        path = self.blob_path(sha256)
+        return path if isfile(path) else None
+
+    def fetch(self, url, sha256=None, mirrors=(), report_hook=None):
+        '''Returns the path of the cached file for ``url``, downloading it
+        first if needed. ``mirrors`` are tried in order before the url
+        itself (see :func:`mirror_url`). Raises a ``ValueError`` if
+        ``sha256`` is given and the downloaded data does not match it.'''
+        key = url_key(url)
+        with file_lock(join(self.root, 'locks', key)):
+            path = self.lookup(url, sha256)
+            if path is not None:
+                info('Found {} in download cache'.format(url))
+                return path
+
+            partial = join(self.root, 'partial', key)
+            ensure_dir(dirname(partial))
+            for mirror in mirrors:
+                source = mirror_url(mirror, url)
+                try:
+                    download_url(source, partial, report_hook, attempts=1)
+                except DownloadError as exc:
+                    debug('Could not download from mirror {}: {}'.format(
+                        source, exc))
+                    if exists(partial + '.part'):
+                        os.unlink(partial + '.part')
+                    continue
+                info('Downloaded {} from mirror {}'.format(url, source))
+                break
+            else:
+                download_url(url, partial, report_hook)
+
+            digest = sha256sum(partial)
+            if sha256 is not None and digest != sha256:
+                os.unlink(partial)
+                raise ValueError(
+                    'Downloaded sha256sum {} does not match expected sha256sum '
+                    '{} for {}'.format(digest, sha256, url))
+            return self.add(partial, url, digest)
+
+    def add(self, filename, url, digest):
+        '''Moves ``filename`` into the cache as the content of ``url``.'''
+        path = self.blob_path(digest)
+        ensure_dir(dirname(path))
+        # blobs are hardlinked into the packages dirs, keep them read-only
+        os.chmod(filename, 0o444)
+        os.replace(filename, path)
+        index = self.index_path(url)
+        ensure_dir(dirname(index))
+        with open(index + '.tmp', 'w') as fileh:
+            fileh.write(digest)
+        os.replace(index + '.tmp', index)
+        return path
+
+    def _remove(self, key, sha256=None):
+        # the lock of ``key`` must be held
+        index = join(self.root, 'urls', key)
+        if sha256 is None and isfile(index):
+            with open(index) as fileh:
+                sha256 = fileh.read().strip()
+        removed = False
+        paths = [index, join(self.root, 'partial', key),
+                 join(self.root, 'partial', key + '.part')]
+        if sha256 is not None:
+            paths.append(self.blob_path(sha256))
+        for path in paths:
+            if isfile(path):
+                os.unlink(path)
+                removed = True
+        return removed
+
+    def remove(self, url, sha256=None):
+        '''Removes the cached file for ``url`` (or with the content
+        ``sha256``, if given) and its index entry. Returns whether anything
+        was removed.'''
+        if not exists(self.root):
+            return False
+        key = url_key(url)
+        with file_lock(join(self.root, 'locks', key)):
+            return self._remove(key, sha256)
+
+    def clear(self):
+        '''Removes every cached url, each while holding its lock, so that
+        the fetches of other processes sharing the cache are not broken.'''
+        keys = set()
+        for subdir in ('urls', 'partial'):
+            directory = join(self.root, subdir)
+            if isdir(directory):
+                keys.update(name.split('.')[0] for name in os.listdir(directory))
+        for key in sorted(keys):
+            with file_lock(join(self.root, 'locks', key)):
+                self._remove(key)
@@ -0,0 +1,277 @@
+"""
+Reads the section headers and the libraries needed by ELF files (the
+libraries and executables built for Android) without running the binutils
+of the NDK, and strips them over a pool of workers.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, dirname, join, relpath
+import json
+import os
+import struct
+
+import sh
+
+from pythonforandroid.logger import debug, info
+from pythonforandroid.util import ensure_dir
+
+ELF_MAGIC = b'\x7fELF'
+
+# e_ident[EI_CLASS] and e_ident[EI_DATA]
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+
+# the header fields after e_ident, then the fields of a section header
+HEADER_FORMATS = {ELFCLASS32: 'HHIIIIIHHHHHH', ELFCLASS64: 'HHIQQQIHHHHHH'}
+SECTION_FORMATS = {ELFCLASS32: 'IIIIIIIIII', ELFCLASS64: 'IIQQQQIIQQ'}
+
+# the fields of an entry of the dynamic section
+DYNAMIC_FORMATS = {ELFCLASS32: 'iI', ELFCLASS64: 'qQ'}
+
+SHN_XINDEX = 0xffff
+SHT_DYNAMIC = 6
+DT_NULL = 0
+DT_NEEDED = 1
+
+# changing it discards the indexes written by previous versions
+INDEX_VERSION = 1
+
+ElfSection = namedtuple('ElfSection', ['name', 'type', 'offset', 'size',
+                                       'link'])
+
+
+class ElfFile(object):
+    '''The section headers of the ELF file ``filename``. Raises
+    ``ValueError`` if it is not an ELF file, or a truncated one.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fileh:
+            ident = fileh.read(16)
+            if len(ident) < 16 or ident[:4] != ELF_MAGIC:
+                raise ValueError('{} is not an ELF file'.format(filename))
+            self.elf_class = ident[4]
+            if self.elf_class not in HEADER_FORMATS:
+                raise ValueError('{} has an unknown ELF class {}'.format(
+                    filename, self.elf_class))
+            self.endian = '<' if ident[5] == ELFDATA2LSB else '>'
+            header = self._unpack(fileh, HEADER_FORMATS[self.elf_class])
+            (self.type, self.machine, _, _, _, shoff, _, _, _, _,
+             shentsize, shnum, shstrndx) = header
+
+            section_format = self.endian + SECTION_FORMATS[self.elf_class]
+            headers = []
+            if shoff:
+                fileh.seek(shoff)
+                first = self._unpack(fileh, SECTION_FORMATS[self.elf_class])
+                # with too many sections to fit in the ELF header, their
+                # number and the index of the names are in the first one
+                if shnum == 0:
+                    shnum = first[5]
+                if shstrndx == SHN_XINDEX:
+                    shstrndx = first[6]
+                fileh.seek(shoff)
+                data = fileh.read(shnum * shentsize)
+                if len(data) < shnum * shentsize:
+                    raise ValueError('{} is truncated'.format(filename))
+                size = struct.calcsize(section_format)
+                headers = [
+                    struct.unpack(section_format,
+                                  data[index:index + size])
+                    for index in range(0, len(data), shentsize)]
+
+            names = b''
+            if 0 < shstrndx < len(headers):
+                fileh.seek(headers[shstrndx][4])
+                names = fileh.read(headers[shstrndx][5])
+        self.sections = [
+            ElfSection(self._get_string(names, name), sh_type, offset, size,
+                       link)
+            for (name, sh_type, _, _, offset, size, link, _, _, _)
+            in headers]
+
+    def _unpack(self, fileh, fmt):
+        fmt = self.endian + fmt
+        data = fileh.read(struct.calcsize(fmt))
+        if len(data) < struct.calcsize(fmt):
+            raise ValueError('{} is truncated'.format(self.filename))
+        return struct.unpack(fmt, data)
+
+    @staticmethod
+    def _get_string(strings, offset):
+        end = strings.find(b'\0', offset)
+        if end < 0:
+            end = len(strings)
+        return strings[offset:end].decode('utf-8', 'replace')
+
+    def get_section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def read_section(self, section):
+        with open(self.filename, 'rb') as fileh:
+            fileh.seek(section.offset)
+            return fileh.read(section.size)
+
+    def get_needed(self):
+        '''Returns the names of the libraries this file needs (its
+        ``DT_NEEDED`` entries), in order.'''
+        dynamic = None
+        for section in self.sections:
+            if section.type == SHT_DYNAMIC:
+                dynamic = section
+                break
+        if dynamic is None or not 0 < dynamic.link < len(self.sections):
+            return []
+        data = self.read_section(dynamic)
+        strings = self.read_section(self.sections[dynamic.link])
+        entry_format = self.endian + DYNAMIC_FORMATS[self.elf_class]
+        entry_size = struct.calcsize(entry_format)
+        needed = []
+        for index in range(0, len(data) - entry_size + 1, entry_size):
+            tag, value = struct.unpack(entry_format,
+                                       data[index:index + entry_size])
+            if tag == DT_NULL:
+                break
+            if tag == DT_NEEDED:
+                needed.append(self._get_string(strings, value))
+        return needed
+
+    def has_debug_info(self):
+        return any(section.name.startswith(('.debug_', '.zdebug_'))
+                   for section in self.sections)
+
+    def is_stripped(self):
+        '''Whether stripping the file would not remove anything, that is
+        if it has neither a symbol table nor debug sections.'''
+        return (self.get_section('.symtab') is None and
+                not self.has_debug_info())
+
+
+def _file_stat(filename):
+    try:
+        file_stat = os.stat(filename)
+    except OSError:
+        return None
+    return [file_stat.st_size, file_stat.st_mtime_ns]
+
+
+class DependencyIndex(object):
+    '''The libraries needed by ELF files, by file path, stored in
+    ``filename`` (or only in memory if it is ``None``). Each entry is only
+    used while its file keeps its size and mtime.'''
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self.changed = False
+        if filename is None:
+            return
+        try:
+            with open(filename) as fileh:
+                data = json.load(fileh)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == INDEX_VERSION:
+            self.entries = data.get('files', {})
+
+    def get_needed(self, filename):
+        '''Returns the names of the libraries needed by ``filename``, or an
+        empty list if it is not an ELF file.'''
+        filename = os.path.realpath(filename)
+        stat = _file_stat(filename)
+        entry = self.entries.get(filename)
+        if entry is not None and stat is not None and entry['stat'] == stat:
+            return entry['needed']
+        try:
+            needed = ElfFile(filename).get_needed()
+        except ValueError as e:
+            debug('Could not read the needed libraries: {}'.format(e))
+            needed = []
+        if stat is not None:
+            self.entries[filename] = {'stat': stat, 'needed': needed}
+            self.changed = True
+        return needed
+
+    def save(self):
+        if self.filename is None or not self.changed:
+            return
+        temp_filename = '{}.{}.tmp'.format(self.filename, os.getpid())
+        try:
+            with open(temp_filename, 'w') as fileh:
+                json.dump({'version': INDEX_VERSION,
+                           'files': self.entries}, fileh)
+            os.replace(temp_filename, self.filename)
+        except OSError as e:
+            debug('Could not save the ELF dependency index {}: {}'.format(
+                self.filename, e))
+        self.changed = False
+
+
+def find_libraries(*directories):
+    '''Returns the ``.so`` files found in ``directories``, like ``find
+    -iname '*.so'`` does.'''
+    filenames = []
+    for directory in directories:
+        for root, dirnames, files in os.walk(directory):
+            dirnames.sort()
+            filenames.extend(join(root, filename) for filename in sorted(files)
+                             if filename.lower().endswith('.so'))
+    return filenames
+
+
+def _strip_file(filename, strip, env, objcopy=None, debug_file=None):
+    try:
+        elf = ElfFile(filename)
+    except ValueError:
+        # let strip tell what is wrong with it
+        elf = None
+    except OSError as e:
+        debug('Failed to read {}: {}'.format(filename, e))
+        return False
+    if elf is not None and elf.is_stripped():
+        return False
+    try:
+        # not stripped yet: it has a symbol table or debug sections,
+        # either one is worth keeping for symbolizing the crashes
+        if debug_file is not None and elf is not None:
+            ensure_dir(dirname(debug_file))
+            objcopy('--only-keep-debug', filename, debug_file, _env=env)
+            strip(filename, _env=env)
+            objcopy('--add-gnu-debuglink=' + debug_file, filename, _env=env)
+        else:
+            strip(filename, _env=env)
+    except sh.ErrorReturnCode as e:
+        debug('Failed to strip {}: {}'.format(filename, e))
+        return False
+    return True
+
+
+def strip_files(filenames, strip, env, jobs=None, objcopy=None,
+                debug_dir=None, root_dir=None):
+    '''Strips the ELF files ``filenames`` with the ``strip`` command, up to
+    ``jobs`` of them at a time (by default, one per CPU). Files which are
+    already stripped are skipped.
+
+    If ``debug_dir`` is given, the debug information of the files is first
+    kept in ``<debug_dir>/<path relative to root_dir>.debug`` with the
+    ``objcopy`` command, and the stripped files link to it. Returns how
+    many files were stripped.'''
+    jobs = jobs or os.cpu_count() or 1
+    tasks = []
+    for filename in filenames:
+        debug_file = None
+        if debug_dir is not None:
+            debug_file = join(debug_dir, relpath(filename, root_dir)
+                              if root_dir else basename(filename)) + '.debug'
+        tasks.append((filename, strip, env, objcopy, debug_file))
+    # the work is done by the strip processes, threads are enough
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        stripped = sum(executor.map(lambda task: _strip_file(*task), tasks))
+    info('Stripped {} of {} files ({} already stripped or failed)'.format(
+        stripped, len(tasks), len(tasks) - stripped))
+    return stripped
@@ -1,5 +1,4 @@
-from copy import deepcopy
-from itertools import product
+from collections import deque
 
 from pythonforandroid.logger import info
 from pythonforandroid.recipe import Recipe
@@ -22,23 +21,6 @@ def fix_deplist(deps):
     return deps
 
 
-class RecipeOrder(dict):
-    def __init__(self, ctx):
-        self.ctx = ctx
-
-    def conflicts(self):
-        for name in self.keys():
-            try:
-                recipe = Recipe.get_recipe(name, self.ctx)
-                conflicts = [dep.lower() for dep in recipe.conflicts]
-            except ValueError:
-                conflicts = []
-
-            if any([c in self for c in conflicts]):
-                return True
-        return False
-
-
 def get_dependency_tuple_list_for_recipe(recipe, blacklist=None):
     """ Get the dependencies of a recipe with filtered out blacklist, and
         turned into tuples with fix_deplist()
@@ -52,76 +34,152 @@ def get_dependency_tuple_list_for_recipe(recipe, blacklist=None):
         # Turn all dependencies into tuples so that product will work
         dependencies = fix_deplist(recipe.depends)
 
-        # Filter out blacklisted items and turn lowercase:
+        # Filter out blacklisted items, keeping the order of the
+        # alternatives (the first ones are preferred):
         dependencies = [
-            tuple(set(deptuple) - blacklist)
+            tuple(dep for dep in deptuple if dep not in blacklist)
             for deptuple in dependencies
-            if tuple(set(deptuple) - blacklist)
         ]
+        dependencies = [deptuple for deptuple in dependencies if deptuple]
     return dependencies
 
 
-def recursively_collect_orders(
-        name, ctx, all_inputs, orders=None, blacklist=None
-        ):
-    '''For each possible recipe ordering, try to add the new recipe name
-    to that order. Recursively do the same thing with all the
-    dependencies of each recipe.
+class DependencyResolver(object):
+    '''Finds a set of recipes satisfying some requirements, each one a tuple
+    of alternative recipe names, and the dependency graph between them.
 
+    The requirements left with a single usable alternative are propagated
+    first, the choice between several alternatives is only made once
+    nothing else can be decided, and undone if it leads to a conflict or a
+    cycle. The recipes already chosen are preferred, then python3 and sdl2.
+    The dependencies of each recipe are only computed once, and the states
+    known to fail are not explored again.
     '''
-    name = name.lower()
-    if orders is None:
-        orders = []
-    if blacklist is None:
-        blacklist = set()
-    try:
-        recipe = Recipe.get_recipe(name, ctx)
-        dependencies = get_dependency_tuple_list_for_recipe(
-            recipe, blacklist=blacklist
-        )
 
-        # handle opt_depends: these impose requirements on the build
-        # order only if already present in the list of recipes to build
-        dependencies.extend(fix_deplist(
-            [[d] for d in recipe.get_opt_depends_in_list(all_inputs)
-             if d.lower() not in blacklist]
-        ))
-
-        if recipe.conflicts is None:
-            conflicts = []
-        else:
-            conflicts = [dep.lower() for dep in recipe.conflicts]
-    except ValueError:
-        # The recipe does not exist, so we assume it can be installed
-        # via pip with no extra dependencies
-        dependencies = []
-        conflicts = []
-
-    new_orders = []
-    # for each existing recipe order, see if we can add the new recipe name
-    for order in orders:
-        if name in order:
-            new_orders.append(deepcopy(order))
-            continue
-        if order.conflicts():
-            continue
-        if any([conflict in order for conflict in conflicts]):
-            continue
-
-        for dependency_set in product(*dependencies):
-            new_order = deepcopy(order)
-            new_order[name] = set(dependency_set)
-
-            dependency_new_orders = [new_order]
-            for dependency in dependency_set:
-                dependency_new_orders = recursively_collect_orders(
-                    dependency, ctx, all_inputs, dependency_new_orders,
-                    blacklist=blacklist
-                )
+    preferred_recipes = ('python3', 'sdl2')
 
-            new_orders.extend(dependency_new_orders)
-
-    return new_orders
+    def __init__(self, ctx, blacklist=None):
+        self.ctx = ctx
+        self.blacklist = blacklist or set()
+        self._recipes = {}
+        self._failed = set()
+
+    def get_recipe_dependencies(self, name, all_inputs):
+        '''Returns the dependency tuples, the optional dependencies (those
+        in ``all_inputs``) and the conflicts of the recipe ``name``.'''
+        if name not in self._recipes:
+            try:
+                recipe = Recipe.get_recipe_info(name, self.ctx)
+            except ValueError:
+                # The recipe does not exist, so we assume it can be installed
+                # via pip with no extra dependencies
+                self._recipes[name] = ([], set(), set())
+            else:
+                dependencies = get_dependency_tuple_list_for_recipe(
+                    recipe, blacklist=self.blacklist)
+                # opt_depends only impose requirements on the build order if
+                # already present in the list of recipes to build
+                opt_depends = {
+                    d.lower() for d in recipe.get_opt_depends_in_list(
+                        all_inputs)} - self.blacklist
+                conflicts = {c.lower() for c in recipe.conflicts or []}
+                self._recipes[name] = (dependencies, opt_depends, conflicts)
+        return self._recipes[name]
+
+    def resolve(self, names):
+        '''Returns the dependency graph (a dict of each recipe name to the
+        set of the names it depends on) of a set of recipes satisfying
+        ``names``, a list of tuples of alternative names, or ``None`` if
+        there is none.'''
+        all_inputs = sorted({name for name_tuple in names
+                             for name in name_tuple})
+        graph = self._search(
+            {}, set(), [(None, name_tuple) for name_tuple in names],
+            all_inputs)
+        if graph is None:
+            return None
+        return {name: set(dependencies)
+                for name, dependencies in graph.items()}
+
+    def _can_add(self, graph, forbidden, name, all_inputs):
+        conflicts = self.get_recipe_dependencies(name, all_inputs)[2]
+        return name not in forbidden and not conflicts.intersection(graph)
+
+    def _add(self, graph, forbidden, pending, parent, name, all_inputs):
+        dependencies, opt_depends, conflicts = self.get_recipe_dependencies(
+            name, all_inputs)
+        graph[name] = set()
+        forbidden.update(conflicts)
+        pending.extend((name, name_tuple) for name_tuple in dependencies)
+        if parent is not None:
+            graph[parent].add(name)
+
+    def _search(self, graph, forbidden, pending, all_inputs):
+        graph = {name: set(dependencies)
+                 for name, dependencies in graph.items()}
+        forbidden = set(forbidden)
+        queue = deque(pending)
+        deferred = []
+        changed = False
+        while queue:
+            parent, name_tuple = queue.popleft()
+            chosen = [name for name in name_tuple if name in graph]
+            if chosen:
+                if parent is not None:
+                    graph[parent].add(chosen[0])
+            else:
+                usable = [name for name in name_tuple if self._can_add(
+                    graph, forbidden, name, all_inputs)]
+                if not usable:
+                    return None
+                if len(usable) > 1:
+                    deferred.append((parent, name_tuple))
+                else:
+                    self._add(graph, forbidden, queue, parent, usable[0],
+                              all_inputs)
+                    changed = True
+            if not queue and deferred and changed:
+                # what was added may have settled some deferred choices
+                queue.extend(deferred)
+                deferred = []
+                changed = False
+
+        if not deferred:
+            for name in graph:
+                graph[name].update(
+                    self.get_recipe_dependencies(name, all_inputs)[1] & graph.keys())
+            try:
+                list(find_order({name: set(dependencies)
+                                 for name, dependencies in graph.items()}))
+            except ValueError:
+                info('Circular dependency found in graph {}, skipping '
+                     'it.'.format(graph))
+                return None
+            return graph
+
+        state = (frozenset((name, frozenset(dependencies))
+                           for name, dependencies in graph.items()),
+                 frozenset(deferred))
+        if state in self._failed:
+            return None
+        parent, name_tuple = deferred[0]
+        usable = [name for name in name_tuple if self._can_add(
+            graph, forbidden, name, all_inputs)]
+        usable.sort(key=lambda name: name not in self.preferred_recipes)
+        for name in usable:
+            new_graph = dict(graph)
+            if parent is not None:
+                new_graph[parent] = set(graph[parent])
+            new_forbidden = set(forbidden)
+            new_pending = list(deferred[1:])
+            self._add(new_graph, new_forbidden, new_pending, parent, name,
+                      all_inputs)
+            result = self._search(
+                new_graph, new_forbidden, new_pending, all_inputs)
+            if result is not None:
+                return result
+        self._failed.add(state)
+        return None
 
 
 def find_order(graph):
@@ -173,7 +231,7 @@ def obvious_conflict_checker(ctx, name_tuples, blacklist=None):
             recipe_dependencies = []
             try:
                 # Get recipe to add and who's ultimately adding it:
-                recipe = Recipe.get_recipe(name, ctx)
+                recipe = Recipe.get_recipe_info(name, ctx)
                 recipe_conflicts = {c.lower() for c in recipe.conflicts}
                 recipe_dependencies = get_dependency_tuple_list_for_recipe(
                     recipe, blacklist=blacklist
@@ -198,7 +256,7 @@ def obvious_conflict_checker(ctx, name_tuples, blacklist=None):
                     # (remember this function only catches obvious issues)
                     continue
                 try:
-                    dep_recipe = Recipe.get_recipe(dep_tuple_list[0], ctx)
+                    dep_recipe = Recipe.get_recipe_info(dep_tuple_list[0], ctx)
                 except ValueError:
                     continue
                 conflicts = [c.lower() for c in dep_recipe.conflicts]
@@ -269,50 +327,17 @@ def get_recipe_order_and_bootstrap(ctx, names, bs=None, blacklist=None):
     obvious_conflict_checker(ctx, names, blacklist=blacklist)
     # If we get here, no obvious conflicts!
 
-    # get all possible order graphs, as names may include tuples/lists
-    # of alternative dependencies
-    possible_orders = []
-    for name_set in product(*names):
-        new_possible_orders = [RecipeOrder(ctx)]
-        for name in name_set:
-            new_possible_orders = recursively_collect_orders(
-                name, ctx, name_set, orders=new_possible_orders,
-                blacklist=blacklist
-            )
-        possible_orders.extend(new_possible_orders)
-
-    # turn each order graph into a linear list if possible
-    orders = []
-    for possible_order in possible_orders:
-        try:
-            order = find_order(possible_order)
-        except ValueError:  # a circular dependency was found
-            info('Circular dependency found in graph {}, skipping it.'.format(
-                possible_order))
-            continue
-        orders.append(list(order))
-
-    # prefer python3 and SDL2 if available
-    orders = sorted(orders,
-                    key=lambda order: -('python3' in order) - ('sdl2' in order))
-
-    if not orders:
+    # find a set of recipes satisfying the names, some of which may be
+    # tuples/lists of alternative dependencies, and turn its graph into a
+    # linear list
+    graph = DependencyResolver(ctx, blacklist=blacklist).resolve(names)
+    if graph is None:
         raise BuildInterruptingException(
             'Didn\'t find any valid dependency graphs. '
             'This means that some of your '
             'requirements pull in conflicting dependencies.')
-
-    # It would be better to check against possible orders other
-    # than the first one, but in practice clashes will be rare,
-    # and can be resolved by specifying more parameters
-    chosen_order = orders[0]
-    if len(orders) > 1:
-        info('Found multiple valid dependency orders:')
-        for order in orders:
-            info('    {}'.format(order))
-        info('Using the first of these: {}'.format(chosen_order))
-    else:
-        info('Found a single valid recipe set: {}'.format(chosen_order))
+    chosen_order = list(find_order(graph))
+    info('Found a valid recipe set: {}'.format(chosen_order))
 
     if bs is None:
         bs = Bootstrap.get_bootstrap_from_recipes(chosen_order, ctx)
@@ -330,7 +355,7 @@ def get_recipe_order_and_bootstrap(ctx, names, bs=None, blacklist=None):
         python_modules = []
         for name in chosen_order:
             try:
-                recipe = Recipe.get_recipe(name, ctx)
+                recipe = Recipe.get_recipe_info(name, ctx)
                 python_modules += recipe.python_depends
             except ValueError:
                 python_modules.append(name)
@@ -0,0 +1,134 @@
+"""
+A GNU make jobserver sharing a budget of CPU jobs between everything a
+build runs at the same time.
+
+The jobserver is a FIFO holding one token per job. Each recipe build takes
+a token while it runs (see :func:`reserve_jobs`), and the ``make`` it runs
+takes the other ones: a ``make`` wrapper, found first in the ``PATH``,
+opens the FIFO and runs the real ``make`` as a client of the jobserver, in
+``MAKEFLAGS``, dropping any ``-jN`` it is given. Tools which don't know the
+jobserver (like ``setup.py build_ext -j``) reserve tokens from Python
+before running. A FIFO is used rather than a pipe because the commands run
+with ``sh`` don't inherit the file descriptors of p4a.
+"""
+
+from contextlib import contextmanager
+from os.path import join, lexists
+import os
+import select
+import shutil
+
+from pythonforandroid.logger import info
+from pythonforandroid.util import ensure_dir
+
+TOKEN = b'+'
+
+MAKE_WRAPPER = '''#!/bin/sh
+# Runs make as a client of the jobserver of python-for-android, dropping
+# the number of jobs given on the command line, which would disable it
+skip=
+for arg do
+    shift
+    if [ -n "$skip" ]; then
+        skip=
+        case "$arg" in
+            ''|*[!0-9]*) ;;
+            *) continue ;;
+        esac
+    fi
+    case "$arg" in
+        -j|--jobs) skip=1; continue ;;
+        -j[0-9]*|--jobs=*) continue ;;
+    esac
+    set -- "$@" "$arg"
+done
+case "$MAKEFLAGS" in
+    *jobserver*) ;;
+    *)
+        exec 3<>'{fifo}'
+        MAKEFLAGS="$MAKEFLAGS -j --jobserver-fds=3,3"
+        export MAKEFLAGS
+        ;;
+esac
+exec '{make}' "$@"
+'''
+
+
+def get_cpu_jobs(ctx):
+    '''The budget of CPU jobs of the build of ``ctx``.'''
+    return getattr(ctx, 'cpu_jobs', None) or os.cpu_count() or 1
+
+
+class JobServer(object):
+    '''A jobserver of ``jobs`` tokens, with its FIFO and ``make`` wrapper
+    in ``directory``. The wrapper dir has to be added to the ``PATH``.'''
+
+    def __init__(self, jobs, directory):
+        self.jobs = jobs
+        self.directory = directory
+        self.bin_dir = join(directory, 'bin')
+        self.fifo = join(directory, 'jobserver.fifo')
+        ensure_dir(self.bin_dir)
+        # left by a build which was killed
+        if lexists(self.fifo):
+            os.remove(self.fifo)
+        os.mkfifo(self.fifo)
+        # read-write, so that opening does not wait for a writer, and the
+        # tokens are kept while no client has the FIFO open
+        self.fd = os.open(self.fifo, os.O_RDWR)
+        os.write(self.fd, TOKEN * jobs)
+
+        make = shutil.which('make')
+        self.make = None
+        if make is not None:
+            self.make = join(self.bin_dir, 'make')
+            with open(self.make, 'w') as fileh:
+                fileh.write(MAKE_WRAPPER.format(fifo=self.fifo, make=make))
+            os.chmod(self.make, 0o755)
+
+    def acquire(self, count=1, blocking=True):
+        '''Takes ``count`` tokens, or as many as are available (up to
+        ``count``) if not ``blocking``, and returns them.'''
+        tokens = b''
+        while len(tokens) < count:
+            if not blocking:
+                readable, _, _ = select.select([self.fd], [], [], 0)
+                if not readable:
+                    break
+            tokens += os.read(self.fd, count - len(tokens))
+        return tokens
+
+    def release(self, tokens):
+        if tokens:
+            os.write(self.fd, tokens)
+
+    def close(self):
+        os.close(self.fd)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def start_jobserver(ctx, directory):
+    '''Starts the :class:`JobServer` of ``ctx`` in ``directory``, and puts
+    its ``make`` wrapper first in the ``PATH``.'''
+    jobs = get_cpu_jobs(ctx)
+    jobserver = JobServer(jobs, directory)
+    if jobserver.make is not None:
+        os.environ['PATH'] = jobserver.bin_dir + ':' + os.environ['PATH']
+    info('Sharing {} CPU jobs between the builds'.format(jobs))
+    return jobserver
+
+
+@contextmanager
+def reserve_jobs(ctx, count=1, blocking=True):
+    '''Takes ``count`` tokens from the jobserver of ``ctx`` while in this
+    context, or only those available if not ``blocking``. Yields how many
+    were taken, ``count`` if the build has no jobserver.'''
+    jobserver = getattr(ctx, 'jobserver', None)
+    if not isinstance(jobserver, JobServer):
+        yield count
+        return
+    tokens = jobserver.acquire(count, blocking)
+    try:
+        yield len(tokens)
+    finally:
+        jobserver.release(tokens)
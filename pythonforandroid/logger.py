@@ -1,7 +1,11 @@
+import itertools
 import logging
 import os
 import re
+import select
 import sh
+import time
+from os.path import basename, join
 from sys import stdout, stderr
 from math import log10
 from collections import defaultdict
@@ -109,6 +113,10 @@ def shorten_string(string, max_width):
                      str(string_len - visible), u' more)'))
 
 
+# The console width reported by stty, see `get_console_width`
+_stty_columns = None
+
+
 def get_console_width():
     try:
         cols = int(os.environ['COLUMNS'])
@@ -118,21 +126,180 @@ def get_console_width():
         if cols >= 25:
             return cols
 
+    global _stty_columns
+    if _stty_columns is None:
+        # spawning stty for each command adds up, ask it once
+        try:
+            _stty_columns = max(
+                25, int(os.popen('stty size', 'r').read().split()[1]))
+        except Exception:
+            _stty_columns = 100
+    return _stty_columns
+
+
+# The directory where `shprint` logs the output of each command, see
+# `setup_command_logs`
+command_log_dir = None
+# Numbers the command log files of this process
+_command_log_counter = itertools.count(1)
+
+# How many commands `shprint` ran in this process
+command_count = 0
+
+# The minimum interval (in seconds) between updates of the status line of a
+# command logged to a file
+STATUS_INTERVAL = 0.5
+
+
+def setup_command_logs(log_dir):
+    '''Makes `shprint` stream the output of each command to its own file in
+    `log_dir`, and only show a status line, or restores the console output
+    if `log_dir` is ``None``. The debug modes always use the console.'''
+    global command_log_dir
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+    command_log_dir = log_dir
+
+
+def read_log(filename, offset=0, tail_lines=None):
+    '''Returns the contents of the log `filename` after `offset`, or only its
+    last `tail_lines` lines (read from the end of the file).'''
+    with open(filename, 'rb') as fileh:
+        end = fileh.seek(0, os.SEEK_END)
+        start = end
+        data = b''
+        while start > offset and (
+                tail_lines is None or data.count(b'\n') <= tail_lines):
+            start = max(offset, start - 65536)
+            fileh.seek(start)
+            data = fileh.read(end - start)
+    if tail_lines is not None:
+        data = b''.join(data.splitlines(True)[-tail_lines:])
+    return data
+
+
+class LoggedCommand:
+    '''The result of a command run by `shprint` with its output logged to
+    `log_file`, with the attributes of the ``sh.RunningCommand`` that the
+    callers use.'''
+
+    stderr = b''
+
+    def __init__(self, command, log_file, offset, exit_code):
+        self.command = command
+        self.log_file = log_file
+        self.offset = offset
+        self.exit_code = exit_code
+
+    @property
+    def stdout(self):
+        return read_log(self.log_file, self.offset)
+
+    def __str__(self):
+        return self.stdout.decode('utf-8', errors='replace')
+
+    def __getattr__(self, name):
+        # like sh, the other attributes are those of the output string
+        return getattr(str(self), name)
+
+
+def clear_status(columns):
+    stdout.write('{}\r{:>{width}}\r'.format(
+        Err_Style.RESET_ALL, ' ', width=(columns - 1)))
+    stdout.flush()
+
+
+def _run_to_log(command, command_string, args, kwargs, columns, msg_hdr,
+                failure_lines=None):
+    '''Runs the command with its output going to a new file in
+    `command_log_dir`, through a pipe read in large chunks. Returns the
+    :class:`LoggedCommand`, raises ``sh.ErrorReturnCode`` with the output
+    (or its last `failure_lines` lines) if it fails.'''
+    log_file = join(command_log_dir, '{:04d}-{}-{}.log'.format(
+        next(_command_log_counter), os.getpid(), basename(command_string)))
+    show_status = "CI" not in os.environ
+    msg_width = columns - len(msg_hdr) - 1
+    need_closing_newline = False
+    read_fd, write_fd = os.pipe()
     try:
-        cols = max(25, int(os.popen('stty size', 'r').read().split()[1]))
-    except Exception:
-        pass
-    else:
-        return cols
+        # the command writes to the pipe directly, sh doesn't read it
+        with open(write_fd, 'wb') as write_file, \
+                open(log_file, 'wb') as fileh:
+            fileh.write('# cd {} && {} {}\n'.format(
+                os.getcwd(), command, ' '.join(map(str, args))).encode(
+                    'utf-8', errors='replace'))
+            offset = fileh.tell()
+            # the exit code is checked by running.wait() below, not reported
+            # by the sh thread
+            running = command(*args, _out=write_file, _bg_exc=False,
+                              **kwargs)
+            write_file.close()
+
+            last_status = 0
+            while True:
+                if select.select([read_fd], [], [], STATUS_INTERVAL)[0]:
+                    chunk = os.read(read_fd, 65536)
+                    if not chunk:
+                        break
+                    fileh.write(chunk)
+                elif not running.process.is_alive()[0]:
+                    # exited, but something it started holds the pipe
+                    break
+                else:
+                    continue
+                now = time.monotonic()
+                if show_status and now - last_status >= STATUS_INTERVAL:
+                    last_status = now
+                    lines = chunk[-1024:].decode(
+                        'utf-8', errors='replace').splitlines()
+                    msg = ' '.join(lines[-1:]).replace(
+                        '\t', ' ').replace('\b', ' ').rstrip()
+                    if msg:
+                        stdout.write(u'{}\r{}{:<{width}}'.format(
+                            Err_Style.RESET_ALL, msg_hdr,
+                            shorten_string(msg, msg_width), width=msg_width))
+                        stdout.flush()
+                        need_closing_newline = True
+    finally:
+        os.close(read_fd)
+        if need_closing_newline:
+            clear_status(columns)
+    try:
+        running.wait()
+    except sh.ErrorReturnCode as err:
+        info('The full output is in {}'.format(log_file))
+        raise type(err)(err.full_cmd,
+                        read_log(log_file, offset, failure_lines),
+                        b'') from None
+    return LoggedCommand(command, log_file, offset, running.exit_code)
 
-    return 100
+
+def print_tail(out, name, forecolor, tail_n=0,
+               re_filter_in=None, re_filter_out=None):
+    lines = out.splitlines()
+    if re_filter_in is not None:
+        lines = [line for line in lines if re_filter_in.search(line)]
+    if re_filter_out is not None:
+        lines = [line for line in lines if not re_filter_out.search(line)]
+    if tail_n == 0 or len(lines) <= tail_n:
+        info('{}:\n{}\t{}{}'.format(
+            name, forecolor, '\t\n'.join(lines), Out_Fore.RESET))
+    else:
+        info('{} (last {} lines of {}):\n{}\t{}{}'.format(
+            name, tail_n, len(lines),
+            forecolor, '\t\n'.join([s for s in lines[-tail_n:]]),
+            Out_Fore.RESET))
 
 
 def shprint(command, *args, **kwargs):
     '''Runs the command (which should be an sh.Command instance), while
-    logging the output.'''
-    kwargs["_iter"] = True
-    kwargs["_out_bufsize"] = 1
+    logging the output.
+
+    If `setup_command_logs` was given a directory, the output goes to a log
+    file there and the console only shows a status line, otherwise each
+    line of output is shown as it comes.'''
+    global command_count
+    command_count += 1
     kwargs["_err_to_out"] = True
     kwargs["_bg"] = True
     is_critical = kwargs.pop('_critical', False)
@@ -159,9 +326,20 @@ def shprint(command, *args, **kwargs):
     else:
         logger.debug('{}{}'.format(string, Err_Style.RESET_ALL))
 
+    log_to_file = (command_log_dir is not None and not full_debug and
+                   logger.level > logging.DEBUG)
+    if not log_to_file:
+        kwargs["_iter"] = True
+        kwargs["_out_bufsize"] = 1
+
     need_closing_newline = False
     try:
         msg_hdr = '           working: '
+        if log_to_file:
+            # only the end of the output is read back, unless it's filtered
+            return _run_to_log(
+                command, command_string, args, kwargs, columns, msg_hdr,
+                failure_lines=None if filter_in or filter_out else 1000)
         msg_width = columns - len(msg_hdr) - 1
         output = command(*args, **kwargs)
         for line in output:
@@ -186,34 +364,17 @@ def shprint(command, *args, **kwargs):
             else:
                 logger.debug(''.join(['\t', line.rstrip()]))
         if need_closing_newline:
-            stdout.write('{}\r{:>{width}}\r'.format(
-                Err_Style.RESET_ALL, ' ', width=(columns - 1)))
-            stdout.flush()
+            clear_status(columns)
     except sh.ErrorReturnCode as err:
         if need_closing_newline:
-            stdout.write('{}\r{:>{width}}\r'.format(
-                Err_Style.RESET_ALL, ' ', width=(columns - 1)))
-            stdout.flush()
+            clear_status(columns)
         if tail_n is not None or filter_in or filter_out:
-            def printtail(out, name, forecolor, tail_n=0,
-                          re_filter_in=None, re_filter_out=None):
-                lines = out.splitlines()
-                if re_filter_in is not None:
-                    lines = [line for line in lines if re_filter_in.search(line)]
-                if re_filter_out is not None:
-                    lines = [line for line in lines if not re_filter_out.search(line)]
-                if tail_n == 0 or len(lines) <= tail_n:
-                    info('{}:\n{}\t{}{}'.format(
-                        name, forecolor, '\t\n'.join(lines), Out_Fore.RESET))
-                else:
-                    info('{} (last {} lines of {}):\n{}\t{}{}'.format(
-                        name, tail_n, len(lines),
-                        forecolor, '\t\n'.join([s for s in lines[-tail_n:]]),
-                        Out_Fore.RESET))
-            printtail(err.stdout.decode('utf-8'), 'STDOUT', Out_Fore.YELLOW, tail_n,
-                      re.compile(filter_in) if filter_in else None,
-                      re.compile(filter_out) if filter_out else None)
-            printtail(err.stderr.decode('utf-8'), 'STDERR', Err_Fore.RED)
+            print_tail(err.stdout.decode('utf-8', errors='replace'),
+                       'STDOUT', Out_Fore.YELLOW, tail_n,
+                       re.compile(filter_in) if filter_in else None,
+                       re.compile(filter_out) if filter_out else None)
+            print_tail(err.stderr.decode('utf-8', errors='replace'),
+                       'STDERR', Err_Fore.RED)
         if is_critical:
             env = kwargs.get("env")
             if env is not None:
@@ -0,0 +1,226 @@
+"""
+A cache of prebuilt recipes, which can be shared between storage dirs.
+
+Each artifact is a tarball holding what a recipe build produced for an
+arch: its build dir, and the files it added to the libs dir and to the
+python-installs dir. The top level dirs of the tarball name the root
+each file is restored to.
+
+Built trees needed by every build, like the hostpython, may instead be
+kept unpacked in a :class:`TreeCache`, and cloned into the storage dirs.
+"""
+
+from io import BytesIO
+from os.path import basename, dirname, exists, isfile, join, relpath
+import json
+import os
+import shutil
+import stat
+import tarfile
+
+from pythonforandroid.archive import TAR_EXTRACT_KWARGS
+from pythonforandroid.download import sha256sum
+from pythonforandroid.logger import debug, info
+from pythonforandroid.util import clone_tree, ensure_dir, file_lock
+
+ARTIFACT_VERSION = 1
+METADATA_NAME = 'p4a-artifact.json'
+
+
+def snapshot_dir(directory):
+    '''Returns the size and modification time of every file in
+    ``directory``, by path relative to it.'''
+    snapshot = {}
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            path = join(root, filename)
+            path_stat = os.lstat(path)
+            snapshot[relpath(path, directory)] = (
+                path_stat.st_size, path_stat.st_mtime_ns)
+    return snapshot
+
+
+def changed_files(directory, snapshot):
+    '''Returns the files of ``directory`` added or modified since
+    ``snapshot`` was taken with :func:`snapshot_dir`.'''
+    current = snapshot_dir(directory)
+    return sorted(path for path, stats in current.items()
+                  if snapshot.get(path) != stats)
+
+
+def copied_files(directory, paths, source_dirs):
+    '''Returns the ``paths`` (relative to ``directory``) whose file has the
+    name and content of a file of ``source_dirs``: the files a build
+    copied from its build dirs, and not those that builds running at the
+    same time installed meanwhile.'''
+    names = {basename(path) for path in paths}
+    sources = {}
+    for source_dir in source_dirs:
+        for root, dirs, files in os.walk(source_dir):
+            for filename in files:
+                path = join(root, filename)
+                if filename in names and isfile(path):
+                    sources.setdefault(filename, set()).add(sha256sum(path))
+    return [path for path in paths
+            if sha256sum(join(directory, path)) in sources.get(
+                basename(path), ())]
+
+
+def relocate_file(filename, old_prefix, new_prefix):
+    '''Replaces ``old_prefix`` by ``new_prefix`` in ``filename`` if it is a
+    text file (binaries are left alone).'''
+    with open(filename, 'rb') as fileh:
+        data = fileh.read()
+    old_prefix = old_prefix.encode('utf-8')
+    if old_prefix not in data or b'\0' in data:
+        return False
+    mode = os.stat(filename).st_mode
+    os.chmod(filename, mode | stat.S_IWUSR)
+    with open(filename, 'wb') as fileh:
+        fileh.write(data.replace(old_prefix, new_prefix.encode('utf-8')))
+    os.chmod(filename, mode)
+    return True
+
+
+class PrebuiltCache:
+    '''A directory of recipe build artifacts, stored as
+    ``<root>/<recipe>/<arch>/<key>.tar.gz``.
+
+    The key of an artifact must identify all the inputs of the build (see
+    :meth:`~pythonforandroid.recipe.Recipe.get_artifact_key`), artifacts
+    are never updated once stored.'''
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_artifact(self, name, arch, key):
+        return join(self.root, name, arch, '{}.tar.gz'.format(key))
+
+    def lookup(self, name, arch, key):
+        '''Returns the stored artifact, or ``None``.'''
+        artifact = self.get_artifact(name, arch, key)
+        return artifact if exists(artifact) else None
+
+    def store(self, name, arch, key, contents, storage_dir):
+        '''Stores an artifact for the recipe ``name`` built for ``arch``.
+
+        ``contents`` maps the name of each root to a tuple with its
+        directory and the paths (relative to it) to store, which may be
+        directories. ``storage_dir`` is recorded so that the paths
+        pointing into it can be relocated by :meth:`restore`.'''
+        artifact = self.get_artifact(name, arch, key)
+        ensure_dir(dirname(artifact))
+        temp_artifact = '{}.{}.tmp'.format(artifact, os.getpid())
+        metadata = {'version': ARTIFACT_VERSION, 'recipe': name,
+                    'arch': arch, 'key': key, 'storage_dir': storage_dir}
+        with tarfile.open(temp_artifact, 'w:gz', compresslevel=1) as tar:
+            for root_name, (directory, paths) in sorted(contents.items()):
+                for path in paths:
+                    tar.add(join(directory, path),
+                            arcname=join(root_name, path))
+            data = json.dumps(metadata).encode('utf-8')
+            member = tarfile.TarInfo(METADATA_NAME)
+            member.size = len(data)
+            tar.addfile(member, fileobj=BytesIO(data))
+        # artifacts are complete or missing, even for concurrent builds
+        os.replace(temp_artifact, artifact)
+        info('Stored prebuilt {} for {} ({:.1f} MB)'.format(
+            name, arch, os.path.getsize(artifact) / 1e6))
+        return artifact
+
+    def restore(self, artifact, roots, storage_dir):
+        '''Extracts ``artifact`` into the directories named by ``roots``
+        (a dict of root name to directory), rewriting the text files that
+        refer to the storage dir the artifact was built in to refer to
+        ``storage_dir``. Returns the artifact metadata.'''
+        metadata = None
+        restored = []
+        with tarfile.open(artifact, 'r|gz') as tar:
+            for member in tar:
+                if member.name == METADATA_NAME:
+                    metadata = json.loads(
+                        tar.extractfile(member).read().decode('utf-8'))
+                    continue
+                root_name, _, path = member.name.partition('/')
+                if root_name not in roots or not path:
+                    continue
+                member.name = path
+                if member.islnk():
+                    member.linkname = member.linkname.partition('/')[2]
+                tar.extract(member, roots[root_name], **TAR_EXTRACT_KWARGS)
+                if member.isfile():
+                    restored.append(join(roots[root_name], path))
+        old_storage_dir = (metadata or {}).get('storage_dir')
+        if old_storage_dir and old_storage_dir != storage_dir:
+            relocated = [filename for filename in restored
+                         if relocate_file(filename, old_storage_dir,
+                                          storage_dir)]
+            debug('Relocated {} files from {} to {}'.format(
+                len(relocated), old_storage_dir, storage_dir))
+        return metadata
+
+
+class TreeCache:
+    '''A directory of built trees, stored unpacked as ``<root>/<key>``
+    along with their metadata in ``<root>/<key>.json``, and cloned (see
+    :func:`~pythonforandroid.util.clone_tree`) into the dirs using them.
+
+    As for :class:`PrebuiltCache`, the key must identify all the inputs of
+    the build, and trees are never updated once stored.'''
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_tree(self, key):
+        return join(self.root, key)
+
+    def lookup(self, key):
+        '''Returns the stored tree, or ``None``.'''
+        tree = self.get_tree(key)
+        return tree if exists(tree + '.json') else None
+
+    def store(self, key, directory):
+        '''Stores a copy of ``directory`` as the tree of ``key``, unless
+        another build stored it first. Returns the stored tree.'''
+        tree = self.get_tree(key)
+        with file_lock(join(self.root, 'locks', key)):
+            if self.lookup(key) is not None:
+                return tree
+            temp_tree = '{}.{}.tmp'.format(tree, os.getpid())
+            shutil.rmtree(temp_tree, ignore_errors=True)
+            if exists(tree):
+                shutil.rmtree(tree)
+            clone_tree(directory, temp_tree)
+            os.replace(temp_tree, tree)
+            with open(tree + '.json.tmp', 'w') as fileh:
+                json.dump({'version': ARTIFACT_VERSION, 'key': key,
+                           'directory': directory}, fileh)
+            # the metadata marks the tree as complete
+            os.replace(tree + '.json.tmp', tree + '.json')
+        info('Stored {} in the tree cache {}'.format(directory, tree))
+        return tree
+
+    def restore(self, tree, directory, relocate_dirs=()):
+        '''Replaces ``directory`` by a clone of ``tree``, rewriting the
+        text files of its ``relocate_dirs`` (relative to it) which refer to
+        the directory the tree was built in to refer to ``directory``.
+        Returns the method the tree was cloned with.'''
+        with open(tree + '.json') as fileh:
+            metadata = json.load(fileh)
+        if exists(directory):
+            shutil.rmtree(directory)
+        ensure_dir(dirname(directory))
+        method = clone_tree(tree, directory)
+        old_directory = metadata['directory']
+        relocated = []
+        if old_directory != directory:
+            for relocate_dir in relocate_dirs:
+                for root, dirs, files in os.walk(join(directory, relocate_dir)):
+                    for filename in files:
+                        filename = join(root, filename)
+                        if not os.path.islink(filename) and relocate_file(
+                                filename, old_directory, directory):
+                            relocated.append(filename)
+        info('Restored {} from the tree cache {} ({}, relocated {} '
+             'files)'.format(directory, tree, method, len(relocated)))
+        return method
@@ -0,0 +1,158 @@
+"""
+Measures where the time of a build goes.
+
+Each phase of a build (the download of a recipe, its build for an arch,
+the gradle run...) run in a :func:`profile` context is recorded with its
+wall and CPU time, the number of commands it ran and the bytes it wrote.
+The phases are appended to an events file as they end, also by the worker
+processes of parallel builds, and turned into a trace in the Chrome
+trace-event format (which chrome://tracing or https://ui.perfetto.dev
+open) and a summary table once the build is over.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from os.path import dirname
+import json
+import os
+import resource
+import time
+
+from pythonforandroid import logger
+from pythonforandroid.logger import info
+from pythonforandroid.util import ensure_dir
+
+# How many of the slowest steps the summary lists
+SUMMARY_STEPS = 20
+
+
+def get_usage():
+    '''Returns the CPU time (in seconds) and the bytes written to disk by
+    this process and its finished children, and the commands it ran.'''
+    cpu_time = 0.
+    written = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        cpu_time += usage.ru_utime + usage.ru_stime
+        # in 512 bytes blocks
+        written += usage.ru_oublock * 512
+    return cpu_time, written, logger.command_count
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{:.0f}{}'.format(size, unit)
+        size /= 1024
+    return '{:.1f}GB'.format(size)
+
+
+class BuildProfiler:
+    '''Records the phases of a build in ``events_file``, which is emptied
+    (and its dir created) when the profiler is created.'''
+
+    def __init__(self, events_file):
+        self.events_file = events_file
+        self.start = time.time()
+        ensure_dir(dirname(events_file))
+        with open(events_file, 'w'):
+            pass
+
+    @contextmanager
+    def phase(self, name, recipe=None, arch=None):
+        start = time.time()
+        cpu_time, written, commands = get_usage()
+        try:
+            yield
+        finally:
+            end = time.time()
+            end_cpu_time, end_written, end_commands = get_usage()
+            event = {
+                'name': ' '.join(str(part) for part in (name, recipe, arch)
+                                 if part is not None),
+                'cat': name,
+                'ph': 'X',
+                'ts': int(start * 1e6),
+                'dur': int((end - start) * 1e6),
+                'pid': os.getpid(),
+                'tid': os.getpid(),
+                'args': {
+                    'recipe': recipe,
+                    'arch': str(arch) if arch is not None else None,
+                    'cpu_time': round(end_cpu_time - cpu_time, 3),
+                    'commands': end_commands - commands,
+                    'bytes_written': end_written - written,
+                },
+            }
+            # a single write, so that the lines of concurrent worker
+            # processes don't mix
+            with open(self.events_file, 'a') as fileh:
+                fileh.write(json.dumps(event) + '\n')
+
+    def read_events(self):
+        with open(self.events_file) as fileh:
+            return [json.loads(line) for line in fileh if line.strip()]
+
+    def write_trace(self, trace_file):
+        '''Writes the phases recorded so far to ``trace_file``, in the
+        Chrome trace-event format.'''
+        with open(trace_file, 'w') as fileh:
+            json.dump({'traceEvents': self.read_events(),
+                       'displayTimeUnit': 'ms'}, fileh)
+
+    def get_summary(self):
+        '''Returns the lines of a table with the totals of each phase
+        (summed over the worker processes, so they may add up to more
+        than the build took) and the slowest steps.'''
+        events = self.read_events()
+        row = '{:<28} {:>9} {:>9} {:>8} {:>9}'
+        lines = ['Build profile ({:.1f}s)'.format(time.time() - self.start),
+                 row.format('phase', 'wall', 'cpu', 'commands', 'written')]
+
+        totals = defaultdict(lambda: [0., 0., 0, 0])
+        for event in events:
+            total = totals[event['cat']]
+            total[0] += event['dur'] / 1e6
+            total[1] += event['args']['cpu_time']
+            total[2] += event['args']['commands']
+            total[3] += event['args']['bytes_written']
+        for phase, (wall, cpu, commands, written) in sorted(
+                totals.items(), key=lambda item: -item[1][0]):
+            lines.append(row.format(
+                phase, '{:.1f}s'.format(wall), '{:.1f}s'.format(cpu),
+                commands, format_size(written)))
+
+        lines.append('')
+        lines.append(row.format('slowest steps', 'wall', 'cpu', 'commands',
+                                'written'))
+        for event in sorted(events, key=lambda event: -event['dur'])[
+                :SUMMARY_STEPS]:
+            lines.append(row.format(
+                event['name'][:28], '{:.1f}s'.format(event['dur'] / 1e6),
+                '{:.1f}s'.format(event['args']['cpu_time']),
+                event['args']['commands'],
+                format_size(event['args']['bytes_written'])))
+        return lines
+
+    def report(self, trace_file, summary_file):
+        '''Writes the trace and the summary, and logs the summary.'''
+        self.write_trace(trace_file)
+        lines = self.get_summary()
+        with open(summary_file, 'w') as fileh:
+            fileh.write('\n'.join(lines) + '\n')
+        for line in lines:
+            info(line)
+        info('Build trace written to {}'.format(trace_file))
+
+
+@contextmanager
+def profile(ctx, name, recipe=None, arch=None):
+    '''Records what runs in this context as the phase ``name`` (of the
+    ``recipe`` for the ``arch``, if given), if the build of ``ctx`` is
+    profiled.'''
+    profiler = getattr(ctx, 'profiler', None)
+    if not isinstance(profiler, BuildProfiler):
+        yield
+        return
+    with profiler.phase(name, recipe, arch):
+        yield
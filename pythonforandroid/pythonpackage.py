@@ -34,7 +34,10 @@
 
 
 import functools
+import hashlib
+import json
 import os
+import re
 import shutil
 import subprocess
 import sys
@@ -43,6 +46,7 @@ import tempfile
 import textwrap
 import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from io import open  # needed for python 2
 from urllib.parse import unquote as urlunquote
 from urllib.parse import urlparse
@@ -74,6 +78,154 @@ def transform_dep_for_pip(dependency):
     return dependency
 
 
+# The metadata files extracted for a package:
+METADATA_FILES = ("METADATA", "metadata_source", "pyproject.toml")
+
+# How long (in seconds) the metadata cached for a requirement which isn't
+# pinned to an exact version is used before it is resolved again:
+METADATA_CACHE_MAX_AGE = 24 * 3600
+
+# Folders skipped when hashing a local package folder:
+IGNORED_FOLDERS = (".git", ".hg", ".tox", ".eggs", "__pycache__",
+                   "build", "dist")
+
+
+def get_metadata_cache_folder():
+    """ Returns the folder of the persistent metadata cache, which is
+        $P4A_PYTHONPACKAGE_CACHE_DIR if set (an empty value disables the
+        cache), or a folder in the user cache dir.
+    """
+    folder = os.environ.get("P4A_PYTHONPACKAGE_CACHE_DIR")
+    if folder is None:
+        folder = os.path.join(
+            os.environ.get("XDG_CACHE_HOME") or
+            os.path.join(os.path.expanduser("~"), ".cache"),
+            "python-for-android", "pythonpackage"
+        )
+    return folder or None
+
+
+class MetadataCache(object):
+    """ A persistent cache of the metadata files extracted by
+        extract_metainfo_files_from_package(), stored in the given
+        folder as one JSON file per key.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _entry_path(self, key):
+        digest = hashlib.sha256(json.dumps(key).encode("utf-8"))
+        return os.path.join(self.folder, digest.hexdigest() + ".json")
+
+    def lookup(self, key, output_folder, max_age=None):
+        """ Writes the metadata files stored for the key to the output
+            folder. Returns False if there are none, or if they were
+            stored more than max_age seconds ago.
+        """
+        try:
+            with open(self._entry_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if entry.get("key") != key or (
+                max_age is not None and entry["time"] + max_age < time.time()
+                ):
+            return False
+        for name, contents in entry["files"].items():
+            with open(os.path.join(output_folder, name), "w",
+                      encoding="utf-8") as f:
+                f.write(contents)
+        return True
+
+    def store(self, key, output_folder):
+        """ Stores the metadata files of the output folder for the key. """
+        files = {}
+        try:
+            for name in METADATA_FILES:
+                if os.path.exists(os.path.join(output_folder, name)):
+                    with open(os.path.join(output_folder, name), "r",
+                              encoding="utf-8") as f:
+                        files[name] = f.read()
+        except UnicodeDecodeError:
+            return
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # unique to each store, the threads of a run store entries
+            # at the same time too
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.folder)
+        except OSError:
+            return
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "time": time.time(), "files": files},
+                          f)
+            # entries are complete or missing, even for concurrent runs
+            os.replace(temp_path, self._entry_path(key))
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+def _hash_folder(folder):
+    """ Returns a hash of the paths and contents of the files of a
+        package folder.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(
+            d for d in dirs
+            if d not in IGNORED_FOLDERS and not d.endswith(".egg-info")
+        )
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            digest.update(os.path.relpath(path, folder).encode("utf-8"))
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _normalize_requirement(dependency):
+    """ Normalizes the whitespace and the (PEP 503) project name of a
+        requirement.
+    """
+    dependency = " ".join(dependency.split())
+    name = re.match(r"[A-Za-z0-9._-]*", dependency).group(0)
+    return (re.sub(r"[-_.]+", "-", name).lower() +
+            dependency[len(name):])
+
+
+def _is_pinned_requirement(dependency):
+    """ Whether a requirement always resolves to the same package: pinned
+        to an exact version, or to an url with a hash.
+    """
+    if re.search(r"#(sha256|sha384|sha512|md5)=", dependency):
+        return True
+    return re.match(
+        r"^[A-Za-z0-9._-]+\s*(\[[^\]]*\])?\s*\(?\s*===?\s*[^\s,;*()]+"
+        r"\s*\)?\s*(;.*)?$", dependency
+    ) is not None
+
+
+def _get_metadata_cache_key(package):
+    """ Returns the key of the metadata of a package in the cache and its
+        max age: local folders are identified by their contents, others
+        by their normalized requirement.
+    """
+    environment = [sys.platform, "{}.{}".format(*sys.version_info[:2])]
+    folder = parse_as_folder_reference(package)
+    if folder is not None:
+        return (["folder", os.path.abspath(folder), _hash_folder(folder)] +
+                environment, None)
+    max_age = (None if _is_pinned_requirement(package)
+               else METADATA_CACHE_MAX_AGE)
+    return ["requirement", _normalize_requirement(package)] + environment, \
+        max_age
+
+
 def extract_metainfo_files_from_package(
         package,
         output_folder,
@@ -87,6 +239,11 @@ def extract_metainfo_files_from_package(
 
         - pytoml.yml  (only if package wasn't obtained as wheel)
         - METADATA
+
+        The files are kept in a persistent cache (see
+        get_metadata_cache_folder()) by requirement, and by the hash of
+        the package source, so they are only extracted again when the
+        package changes.
     """
 
     if package is None:
@@ -99,6 +256,16 @@ def extract_metainfo_files_from_package(
         print("extract_metainfo_files_from_package: extracting for " +
               "package: " + str(package))
 
+    cache_folder = get_metadata_cache_folder()
+    if cache_folder is not None:
+        cache = MetadataCache(cache_folder)
+        cache_key, max_age = _get_metadata_cache_key(package)
+        if cache.lookup(cache_key, output_folder, max_age=max_age):
+            if debug:
+                print("extract_metainfo_files_from_package: using cached " +
+                      "metadata of package: " + str(package))
+            return
+
     # A temp folder for making a package copy in case it's a local folder,
     # because extracting metadata might modify files
     # (creating sdists/wheels...)
@@ -130,8 +297,10 @@ def extract_metainfo_files_from_package(
                 "m._extract_metainfo_files_from_package_unsafe("
                 "    sys.argv[1],"
                 "    sys.argv[2],"
+                "    sys.argv[4] or None,"
                 ")",
-                package, output_folder, os.path.abspath(__file__)],
+                package, output_folder, os.path.abspath(__file__),
+                cache_folder or ""],
                 stderr=subprocess.STDOUT,  # make sure stderr is muted.
                 cwd=os.path.join(os.path.dirname(__file__), "..")
             )
@@ -150,6 +319,9 @@ def extract_metainfo_files_from_package(
     finally:
         shutil.rmtree(temp_folder)
 
+    if cache_folder is not None:
+        cache.store(cache_key, output_folder)
+
 
 def _get_system_python_executable():
     """ Returns the path the system-wide python binary.
@@ -438,7 +610,8 @@ def get_package_as_folder(dependency):
 
 def _extract_metainfo_files_from_package_unsafe(
         package,
-        output_path
+        output_path,
+        cache_folder=None
         ):
     # This is the unwrapped function that will
     # 1. make lots of stdout/stderr noise
@@ -461,6 +634,18 @@ def _extract_metainfo_files_from_package_unsafe(
         clean_up_path = True
 
     try:
+        # A downloaded package may be one whose metadata is cached already
+        # (e.g. the same release as an unpinned requirement resolved before)
+        source_cache_key = None
+        if clean_up_path and cache_folder is not None:
+            source_cache_key = [
+                "source", path_type, _hash_folder(path), sys.platform,
+                "{}.{}".format(*sys.version_info[:2]),
+            ]
+            if MetadataCache(cache_folder).lookup(source_cache_key,
+                                                  output_path):
+                return
+
         build_requires = []
         metadata_path = None
 
@@ -525,6 +710,9 @@ def _extract_metainfo_files_from_package_unsafe(
 
         # Copy the metadata file:
         shutil.copyfile(metadata_path, os.path.join(output_path, "METADATA"))
+
+        if source_cache_key is not None:
+            MetadataCache(cache_folder).store(source_cache_key, output_path)
     finally:
         if clean_up_path:
             shutil.rmtree(path)
@@ -669,78 +857,105 @@ def get_package_name(dependency,
     return result
 
 
+def _get_package_name_or_error(dependency):
+    try:
+        return get_package_name(dependency), None
+    except ValueError as e:
+        return None, e
+
+
 def get_package_dependencies(package,
                              recursive=False,
                              verbose=False,
-                             include_build_requirements=False):
+                             include_build_requirements=False,
+                             jobs=None):
     """ Obtain the dependencies from a package. Please note this
         function is possibly SLOW, especially if you enable
         the recursive mode.
+
+        The packages of each level of the dependency tree are processed
+        concurrently, by up to the given number of jobs (by default, the
+        cpu count capped at 4, since each one may set up a PEP 517 build
+        environment).
     """
+    if jobs is None:
+        jobs = min(4, os.cpu_count() or 1)
     packages_processed = set()
     package_queue = [package]
     reqs = set()
     reqs_as_names = set()
-    while len(package_queue) > 0:
-        current_queue = package_queue
-        package_queue = []
-        for package_dep in current_queue:
-            new_reqs = set()
-            if verbose:
-                print("get_package_dependencies: resolving dependency "
-                      f"to package name: {package_dep}")
-            package = get_package_name(package_dep)
-            if package.lower() in packages_processed:
-                continue
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while len(package_queue) > 0:
+            current_queue = package_queue
+            package_queue = []
+            if not recursive:
+                current_queue = current_queue[:1]
             if verbose:
-                print("get_package_dependencies: "
-                      "processing package: {}".format(package))
-                print("get_package_dependencies: "
-                      "Packages seen so far: {}".format(
-                          packages_processed
-                      ))
-            packages_processed.add(package.lower())
+                print("get_package_dependencies: resolving dependencies "
+                      f"to package names: {current_queue}")
+            packages = list(executor.map(get_package_name, current_queue))
+
+            # The packages of this level not processed yet:
+            level = []
+            for package_dep, package in zip(current_queue, packages):
+                if package.lower() in packages_processed:
+                    continue
+                if verbose:
+                    print("get_package_dependencies: "
+                          "processing package: {}".format(package))
+                    print("get_package_dependencies: "
+                          "Packages seen so far: {}".format(
+                              packages_processed
+                          ))
+                packages_processed.add(package.lower())
+                level.append(package_dep)
 
             # Use our regular folder processing to examine:
-            new_reqs = new_reqs.union(_extract_info_from_package(
-                package_dep, extract_type="dependencies",
-                debug=verbose,
-                include_build_requirements=include_build_requirements,
+            level_reqs = list(executor.map(
+                lambda package_dep: set(_extract_info_from_package(
+                    package_dep, extract_type="dependencies",
+                    debug=verbose,
+                    include_build_requirements=include_build_requirements,
+                )),
+                level
             ))
+            all_new_reqs = sorted(set().union(*level_reqs))
+            req_names = dict(zip(all_new_reqs, executor.map(
+                _get_package_name_or_error, all_new_reqs
+            )))
 
             # Process new requirements:
-            if verbose:
-                print('get_package_dependencies: collected '
-                      "deps of '{}': {}".format(
-                          package_dep, str(new_reqs),
-                      ))
-            for new_req in new_reqs:
-                try:
-                    req_name = get_package_name(new_req)
-                except ValueError as e:
-                    if new_req.find(";") >= 0:
-                        # Conditional dep where condition isn't met?
-                        # --> ignore it
+            for package_dep, new_reqs in zip(level, level_reqs):
+                if verbose:
+                    print('get_package_dependencies: collected '
+                          "deps of '{}': {}".format(
+                              package_dep, str(new_reqs),
+                          ))
+                for new_req in sorted(new_reqs):
+                    req_name, e = req_names[new_req]
+                    if e is not None:
+                        if new_req.find(";") >= 0:
+                            # Conditional dep where condition isn't met?
+                            # --> ignore it
+                            continue
+                        if verbose:
+                            print("get_package_dependencies: " +
+                                  "unexpected failure to get name " +
+                                  "of '" + str(new_req) + "': " +
+                                  str(e))
+                        raise RuntimeError(
+                            "failed to get " +
+                            "name of dependency: " + str(e)
+                        )
+                    if req_name.lower() in reqs_as_names:
                         continue
-                    if verbose:
-                        print("get_package_dependencies: " +
-                              "unexpected failure to get name " +
-                              "of '" + str(new_req) + "': " +
-                              str(e))
-                    raise RuntimeError(
-                        "failed to get " +
-                        "name of dependency: " + str(e)
-                    )
-                if req_name.lower() in reqs_as_names:
-                    continue
-                if req_name.lower() not in packages_processed:
-                    package_queue.append(new_req)
-                reqs.add(new_req)
-                reqs_as_names.add(req_name.lower())
+                    if req_name.lower() not in packages_processed:
+                        package_queue.append(new_req)
+                    reqs.add(new_req)
+                    reqs_as_names.add(req_name.lower())
 
             # Bail out here if we're not scanning recursively:
             if not recursive:
-                package_queue[:] = []  # wipe queue
                 break
     if verbose:
         print("get_package_dependencies: returning result: {}".format(reqs))
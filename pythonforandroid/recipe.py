@@ -9,17 +9,21 @@ from re import match
 import sh
 import shutil
 import fnmatch
-from urllib.request import urlretrieve
-from os import listdir, unlink, environ, mkdir, curdir, walk
+from os import listdir, unlink, environ, mkdir, curdir, walk, stat
 from sys import stdout
-import time
 try:
     from urlparse import urlparse
 except ImportError:
     from urllib.parse import urlparse
+from pythonforandroid.archive import ARCHIVE_EXTENSIONS, extract_archive
+from pythonforandroid.elf import find_libraries, strip_files
+from pythonforandroid.jobserver import get_cpu_jobs, reserve_jobs
+from pythonforandroid.download import link_or_copy, sha256sum
 from pythonforandroid.logger import (logger, info, warning, debug, shprint, info_main)
+from pythonforandroid.recipeindex import RecipeIndex
 from pythonforandroid.util import (current_directory, ensure_dir,
-                                   BuildInterruptingException)
+                                   BuildInterruptingException,
+                                   build_platform, clone_tree, file_lock)
 from pythonforandroid.util import load_source as import_recipe
 
 
@@ -59,6 +63,12 @@ class Recipe(with_metaclass(RecipeMeta)):
     finished correctly.
     '''
 
+    sha256sum = None
+    '''The sha256sum of the source from the :attr:`url`. Optional, but when
+    set the download is verified against it and a file with that content
+    already in the download cache is reused, whatever url it came from.
+    '''
+
     depends = []
     '''A list containing the names of any recipes that this recipe depends on.
     '''
@@ -104,6 +114,12 @@ class Recipe(with_metaclass(RecipeMeta)):
               path: `'.', None or ''`
     """
 
+    prebuilt_cacheable = True
+    '''Whether the build outputs of the recipe may be stored in, and
+    restored from, the prebuilt recipes cache (``--prebuilt-cache-dir``).
+    Recipes building outside of their build dir, or from sources which
+    are not versioned by the recipe, should set this to False.'''
+
     need_stl_shared = False
     '''Some libraries or python packages may need to be linked with android's
     stl. We can automatically do this for any recipe if we set this property to
@@ -163,9 +179,14 @@ class Recipe(with_metaclass(RecipeMeta)):
             return None
         return self.url.format(version=self.version)
 
-    def download_file(self, url, target, cwd=None):
+    def download_file(self, url, target, cwd=None, sha256=None):
         """
         (internal) Download an ``url`` to a ``target``.
+
+        Http(s) and file urls go through the shared download cache
+        (:attr:`Context.download_cache`): the content is fetched once,
+        trying the :attr:`Context.download_mirrors` first, and then linked
+        to ``target``.
         """
         if not url:
             return
@@ -175,33 +196,21 @@ class Recipe(with_metaclass(RecipeMeta)):
             target = join(cwd, target)
 
         parsed_url = urlparse(url)
-        if parsed_url.scheme in ('http', 'https'):
-            def report_hook(index, blksize, size):
+        if parsed_url.scheme in ('http', 'https', 'file'):
+            def report_hook(received, size):
                 if size <= 0:
-                    progression = '{0} bytes'.format(index * blksize)
+                    progression = '{0} bytes'.format(received)
                 else:
                     progression = '{0:.2f}%'.format(
-                        index * blksize * 100. / float(size))
-                if "CI" not in environ:
+                        received * 100. / float(size))
+                if "CI" not in environ and self.ctx.download_progress:
                     stdout.write('- Download {}\r'.format(progression))
                     stdout.flush()
 
-            if exists(target):
-                unlink(target)
-
-            # Download item with multiple attempts (for bad connections):
-            attempts = 0
-            while True:
-                try:
-                    urlretrieve(url, target, report_hook)
-                except OSError:
-                    attempts += 1
-                    if attempts >= 5:
-                        raise
-                    stdout.write('Download failed retrying in a second...')
-                    time.sleep(1)
-                    continue
-                break
+            cached = self.ctx.download_cache.fetch(
+                url, sha256=sha256, mirrors=self.ctx.download_mirrors,
+                report_hook=report_hook)
+            link_or_copy(cached, target)
             return target
         elif parsed_url.scheme in ('git', 'git+file', 'git+ssh', 'git+http', 'git+https'):
             if isdir(target):
@@ -323,6 +332,13 @@ class Recipe(with_metaclass(RecipeMeta)):
                 return local_recipe_dir
         return join(self.ctx.root_dir, 'recipes', self.name)
 
+    def get_recipe_file(self):
+        '''Returns the ``__init__.py`` defining the recipe, whose content
+        the stamps and keys of its builds depend on. Recipe modules are
+        loaded from their file without being registered in
+        ``sys.modules``, so ``inspect`` can not find it.'''
+        return join(self.get_recipe_dir(), '__init__.py')
+
     # Public Recipe API to be subclassed if needed
 
     def download_if_necessary(self):
@@ -339,59 +355,75 @@ class Recipe(with_metaclass(RecipeMeta)):
             info('Skipping {} download as no URL is set'.format(self.name))
             return
 
+        url, expected = self.get_download_url()
+
+        package_dir = join(self.ctx.packages_path, self.name)
+        ensure_dir(package_dir)
+        filename = join(package_dir, basename(url))
+        marker_filename = join(
+            package_dir, '.mark-{}'.format(basename(filename)))
+
+        do_download = True
+        if isfile(filename):
+            if not exists(marker_filename):
+                unlink(filename)
+            else:
+                self.check_download(filename, expected)
+                do_download = False
+
+        # If we got this far, we will download
+        if do_download:
+            debug('Downloading {} from {}'.format(self.name, url))
+
+            if exists(marker_filename):
+                unlink(marker_filename)
+            self.download_file(url, filename, sha256=expected['sha256'])
+            open(marker_filename, 'w').close()
+
+            if isfile(filename):
+                self.check_download(filename, {'md5': expected['md5']})
+        else:
+            info('{} download already cached, skipping'.format(self.name))
+
+    def get_download_url(self):
+        '''Returns the url to download, without its checksum fragment, and
+        the ``{algorithm: digest}`` values it must match (``None`` when
+        unknown).'''
         url = self.versioned_url
-        ma = match(u'^(.+)#md5=([0-9a-f]{32})$', url)
+        expected = {'md5': self.md5sum, 'sha256': self.sha256sum}
+        ma = match(u'^(.+)#(md5|sha256)=([0-9a-f]{32}|[0-9a-f]{64})$', url)
         if ma:                  # fragmented URL?
-            if self.md5sum:
+            url, algorithm, digest = ma.groups()
+            if expected[algorithm]:
                 raise ValueError(
-                    ('Received md5sum from both the {} recipe '
-                     'and its url').format(self.name))
-            url = ma.group(1)
-            expected_md5 = ma.group(2)
-        else:
-            expected_md5 = self.md5sum
-
-        shprint(sh.mkdir, '-p', join(self.ctx.packages_path, self.name))
-
-        with current_directory(join(self.ctx.packages_path, self.name)):
-            filename = shprint(sh.basename, url).stdout[:-1].decode('utf-8')
-
-            do_download = True
-            marker_filename = '.mark-{}'.format(filename)
-            if exists(filename) and isfile(filename):
-                if not exists(marker_filename):
-                    shprint(sh.rm, filename)
-                elif expected_md5:
-                    current_md5 = md5sum(filename)
-                    if current_md5 != expected_md5:
-                        debug('* Generated md5sum: {}'.format(current_md5))
-                        debug('* Expected md5sum: {}'.format(expected_md5))
-                        raise ValueError(
-                            ('Generated md5sum does not match expected md5sum '
-                             'for {} recipe').format(self.name))
-                    do_download = False
-                else:
-                    do_download = False
-
-            # If we got this far, we will download
-            if do_download:
-                debug('Downloading {} from {}'.format(self.name, url))
-
-                shprint(sh.rm, '-f', marker_filename)
-                self.download_file(self.versioned_url, filename)
-                shprint(sh.touch, marker_filename)
-
-                if exists(filename) and isfile(filename) and expected_md5:
-                    current_md5 = md5sum(filename)
-                    if expected_md5 is not None:
-                        if current_md5 != expected_md5:
-                            debug('* Generated md5sum: {}'.format(current_md5))
-                            debug('* Expected md5sum: {}'.format(expected_md5))
-                            raise ValueError(
-                                ('Generated md5sum does not match expected md5sum '
-                                 'for {} recipe').format(self.name))
-            else:
-                info('{} download already cached, skipping'.format(self.name))
+                    ('Received {}sum from both the {} recipe '
+                     'and its url').format(algorithm, self.name))
+            expected[algorithm] = digest
+        return url, expected
+
+    def clean_download_cache(self):
+        '''Removes the download of the recipe from the shared download
+        cache (:attr:`Context.download_cache`). Returns whether there was
+        one.'''
+        if self.url is None:
+            return False
+        url, expected = self.get_download_url()
+        return self.ctx.download_cache.remove(url, sha256=expected['sha256'])
+
+    def check_download(self, filename, expected):
+        '''Raises a ``ValueError`` if ``filename`` does not match the
+        ``{algorithm: digest}`` values in ``expected`` that are set.'''
+        for algorithm, checksum in (('md5', md5sum), ('sha256', sha256sum)):
+            expected_digest = expected.get(algorithm)
+            if not expected_digest:
+                continue
+            current_digest = checksum(filename)
+            if current_digest != expected_digest:
+                debug('* Generated {}sum: {}'.format(algorithm, current_digest))
+                debug('* Expected {}sum: {}'.format(algorithm, expected_digest))
+                raise ValueError(
+                    ('Generated {0}sum does not match expected {0}sum '
+                     'for {1} recipe').format(algorithm, self.name))
 
     def unpack(self, arch):
         info_main('Unpacking {} for {}'.format(self.name, arch))
@@ -408,65 +440,82 @@ class Recipe(with_metaclass(RecipeMeta)):
             shprint(sh.mkdir, '-p', build_dir)
             shprint(sh.rmdir, build_dir)
             ensure_dir(build_dir)
-            shprint(sh.cp, '-a', user_dir, self.get_build_dir(arch))
+            if self.ctx.clone_source_trees:
+                clone_tree(user_dir, self.get_build_dir(arch))
+            else:
+                shprint(sh.cp, '-a', user_dir, self.get_build_dir(arch))
             return
 
         if self.url is None:
             info('Skipping {} unpack as no URL is set'.format(self.name))
             return
 
-        filename = shprint(
-            sh.basename, self.versioned_url).stdout[:-1].decode('utf-8')
-        ma = match(u'^(.+)#md5=([0-9a-f]{32})$', filename)
+        filename = basename(self.versioned_url)
+        ma = match(u'^(.+)#(md5|sha256)=([0-9a-f]{32}|[0-9a-f]{64})$', filename)
         if ma:                  # fragmented URL?
             filename = ma.group(1)
 
-        with current_directory(build_dir):
-            directory_name = self.get_build_dir(arch)
-
-            if not exists(directory_name) or not isdir(directory_name):
-                extraction_filename = join(
-                    self.ctx.packages_path, self.name, filename)
-                if isfile(extraction_filename):
-                    if extraction_filename.endswith('.zip'):
-                        try:
-                            sh.unzip(extraction_filename)
-                        except (sh.ErrorReturnCode_1, sh.ErrorReturnCode_2):
-                            # return code 1 means unzipping had
-                            # warnings but did complete,
-                            # apparently happens sometimes with
-                            # github zips
-                            pass
-                        import zipfile
-                        fileh = zipfile.ZipFile(extraction_filename, 'r')
-                        root_directory = fileh.filelist[0].filename.split('/')[0]
-                        if root_directory != basename(directory_name):
-                            shprint(sh.mv, root_directory, directory_name)
-                    elif extraction_filename.endswith(
-                            ('.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')):
-                        sh.tar('xf', extraction_filename)
-                        root_directory = sh.tar('tf', extraction_filename).stdout.decode(
-                                'utf-8').split('\n')[0].split('/')[0]
-                        if root_directory != basename(directory_name):
-                            shprint(sh.mv, root_directory, directory_name)
-                    else:
-                        raise Exception(
-                            'Could not extract {} download, it must be .zip, '
-                            '.tar.gz or .tar.bz2 or .tar.xz'.format(extraction_filename))
-                elif isdir(extraction_filename):
-                    mkdir(directory_name)
-                    for entry in listdir(extraction_filename):
-                        if entry not in ('.git',):
-                            shprint(sh.cp, '-Rv',
-                                    join(extraction_filename, entry),
-                                    directory_name)
-                else:
-                    raise Exception(
-                        'Given path is neither a file nor a directory: {}'
-                        .format(extraction_filename))
+        directory_name = self.get_build_dir(arch)
 
+        if not exists(directory_name) or not isdir(directory_name):
+            extraction_filename = join(
+                self.ctx.packages_path, self.name, filename)
+            if isfile(extraction_filename):
+                if not extraction_filename.endswith(ARCHIVE_EXTENSIONS):
+                    raise Exception(
+                        'Could not extract {} download, it must be .zip, '
+                        '.tar.gz or .tar.bz2 or .tar.xz'.format(extraction_filename))
+                if self.ctx.clone_source_trees:
+                    source_dir = self.unpack_pristine(extraction_filename)
+                    ensure_dir(build_dir)
+                    method = clone_tree(source_dir, directory_name)
+                    info('Cloned {} sources for {} ({})'.format(
+                        self.name, arch, method))
+                else:
+                    extract_archive(extraction_filename, build_dir,
+                                    root_name=basename(directory_name))
+            elif isdir(extraction_filename):
+                mkdir(directory_name)
+                for entry in listdir(extraction_filename):
+                    if entry not in ('.git',):
+                        shprint(sh.cp, '-Rv',
+                                join(extraction_filename, entry),
+                                directory_name)
             else:
-                info('{} is already unpacked, skipping'.format(self.name))
+                raise Exception(
+                    'Given path is neither a file nor a directory: {}'
+                    .format(extraction_filename))
+
+        else:
+            info('{} is already unpacked, skipping'.format(self.name))
+
+    def get_pristine_dir(self, filename):
+        '''Returns the directory where the downloaded ``filename`` is
+        unpacked once, to be cloned to the build dir of each arch.'''
+        return join(self.ctx.build_dir, 'pristine_sources', self.name,
+                    basename(filename))
+
+    def unpack_pristine(self, extraction_filename):
+        '''Extracts the downloaded archive into :meth:`get_pristine_dir`,
+        unless it was already extracted from the same file, and returns
+        the pristine source tree.'''
+        pristine_dir = self.get_pristine_dir(extraction_filename)
+        stamp_filename = join(pristine_dir, '.unpacked')
+        archive_stat = stat(extraction_filename)
+        stamp = '{} {}'.format(archive_stat.st_size, archive_stat.st_mtime)
+        # archs are unpacked concurrently when building with several jobs
+        with file_lock(pristine_dir + '.lock'):
+            if isfile(stamp_filename):
+                with open(stamp_filename) as fileh:
+                    if fileh.read() == stamp:
+                        return join(pristine_dir, self.name)
+            if exists(pristine_dir):
+                rmtree(pristine_dir)
+            extract_archive(extraction_filename, pristine_dir,
+                            root_name=self.name)
+            with open(stamp_filename, 'w') as fileh:
+                fileh.write(stamp)
+        return join(pristine_dir, self.name)
 
     def get_recipe_env(self, arch=None, with_flags_in_cc=True):
         """Return the env specialized for the recipe
@@ -604,6 +653,9 @@ class Recipe(with_metaclass(RecipeMeta)):
         dirs = glob.glob(base_dir + '-*')
         if exists(base_dir):
             dirs.append(base_dir)
+        pristine_dir = join(self.ctx.build_dir, 'pristine_sources', self.name)
+        if arch is None and exists(pristine_dir):
+            dirs.append(pristine_dir)
         if not dirs:
             warning('Attempted to clean build for {} but found no existing '
                     'build dirs'.format(self.name))
@@ -617,6 +669,146 @@ class Recipe(with_metaclass(RecipeMeta)):
         # doesn't persist in site-packages
         shutil.rmtree(self.ctx.python_installs_dir)
 
+    def get_stamp_arch(self, arch):
+        '''Returns the arch the stamps of the recipe are computed and stored
+        for: the first arch for recipes whose build dir is shared between
+        archs (e.g. hostpython3), ``arch`` otherwise.'''
+        first_arch = self.ctx.archs[0]
+        if self.get_build_dir(first_arch.arch) == self.get_build_dir(arch.arch):
+            return first_arch
+        return arch
+
+    def get_stamp_filename(self, arch, kind):
+        '''Returns the file holding the ``'source'`` or ``'build'`` stamp of
+        the last build of the recipe for ``arch``, or the ``'prebuilt'`` one
+        of its pending restore from the prebuilt cache.'''
+        return join(self.ctx.build_dir, 'build_stamps',
+                    self.get_stamp_arch(arch).arch,
+                    '{}.{}'.format(self.get_dir_name(), kind))
+
+    def read_stamp(self, arch, kind):
+        '''Returns the stored stamp, or None if there is none yet.'''
+        filename = self.get_stamp_filename(arch, kind)
+        if not isfile(filename):
+            return None
+        with open(filename) as fileh:
+            return fileh.read()
+
+    def write_stamp(self, arch, kind, stamp):
+        filename = self.get_stamp_filename(arch, kind)
+        ensure_dir(dirname(filename))
+        with open(filename, 'w') as fileh:
+            fileh.write(stamp)
+
+    def get_patch_filenames(self, arch):
+        '''Returns the patch files :meth:`apply_patches` applies for
+        ``arch``.'''
+        filenames = []
+        for patch in self.patches:
+            if isinstance(patch, (tuple, list)):
+                patch, patch_check = patch
+                if not patch_check(arch=arch, recipe=self):
+                    continue
+            filenames.append(join(
+                self.get_recipe_dir(),
+                patch.format(version=self.version, arch=arch.arch)))
+        return filenames
+
+    def get_source_stamp(self, arch):
+        '''Returns a hash of what the source tree of the recipe is made of:
+        its url and version, the downloaded files, the recipe module and
+        the patches applied for ``arch``.'''
+        arch = self.get_stamp_arch(arch)
+        stamp = hashlib.sha256()
+
+        def update(*values):
+            for value in values:
+                stamp.update(str(value).encode('utf-8') + b'\0')
+
+        update(self.name, self.version, self.versioned_url, self.md5sum,
+               self.sha256sum,
+               environ.get('P4A_{}_DIR'.format(self.name.lower())))
+        package_dir = join(self.ctx.packages_path, self.name)
+        if isdir(package_dir):
+            for filename in sorted(listdir(package_dir)):
+                if not filename.startswith('.mark-'):
+                    package_stat = stat(join(package_dir, filename))
+                    update(filename, package_stat.st_size,
+                           package_stat.st_mtime)
+        for filename in [self.get_recipe_file()] + \
+                self.get_patch_filenames(arch):
+            update(filename)
+            if isfile(filename):
+                with open(filename, 'rb') as fileh:
+                    stamp.update(fileh.read())
+        return stamp.hexdigest()
+
+    def get_build_dependencies(self):
+        '''Returns the recipes of the build order this recipe depends on,
+        including the optional ones.'''
+        names = {name.lower(): name for name in self.ctx.recipe_build_order or []}
+        depends = [dep.lower() for dep in self.opt_depends]
+        for dep in self.depends:
+            # alternative dependencies are tuples or lists of names
+            depends.extend(dep if isinstance(dep, (tuple, list)) else [dep])
+        depends = {dep.lower() for dep in depends}
+        return [Recipe.get_recipe(names[dep], self.ctx)
+                for dep in sorted(depends) if dep in names]
+
+    def get_build_stamp(self, arch):
+        '''Returns a hash of all the inputs of the recipe build for
+        ``arch``: its source stamp, the Android API levels, the environment
+        it builds with (the variables that differ from ``os.environ``) and
+        the build stamps of its dependencies, so that rebuilding a
+        dependency outdates every recipe depending on it.'''
+        stamp_arch = self.get_stamp_arch(arch)
+        stamp = hashlib.sha256()
+
+        def update(*values):
+            for value in values:
+                stamp.update(str(value).encode('utf-8') + b'\0')
+
+        update(self.get_source_stamp(stamp_arch), stamp_arch.arch,
+               self.ctx.ndk_api, self.ctx.android_api)
+        env = self.get_recipe_env(stamp_arch)
+        for key in sorted(env):
+            if environ.get(key) != env[key]:
+                update(key, env[key])
+        for recipe in self.get_build_dependencies():
+            update(recipe.name, recipe.read_stamp(arch, 'build'))
+        return stamp.hexdigest()
+
+    def get_artifact_key(self, arch):
+        '''Returns a hash identifying the outputs of the recipe build for
+        ``arch`` in the prebuilt recipes cache. Unlike the build stamp it
+        does not depend on the storage dir: it covers the recipe version,
+        url, module and patches, the arch, the build options and platform,
+        the NDK, and the artifact keys of the dependencies.'''
+        stamp_arch = self.get_stamp_arch(arch)
+        stamp = hashlib.sha256()
+
+        def update(*values):
+            for value in values:
+                stamp.update(str(value).encode('utf-8') + b'\0')
+
+        update(self.get_dir_name(), self.version, self.versioned_url,
+               self.md5sum, self.sha256sum, stamp_arch.arch,
+               self.ctx.ndk_api, self.ctx.android_api, build_platform,
+               self.ctx.copy_libs, self.ctx.with_debug_symbols)
+        ndk_properties = join(self.ctx.ndk_dir, 'source.properties')
+        if isfile(ndk_properties):
+            with open(ndk_properties, 'rb') as fileh:
+                stamp.update(fileh.read())
+        for filename in [self.get_recipe_file()] + \
+                self.get_patch_filenames(stamp_arch):
+            update(basename(filename))
+            if isfile(filename):
+                with open(filename, 'rb') as fileh:
+                    stamp.update(fileh.read())
+        for recipe in self.get_build_dependencies():
+            update(recipe.name, recipe.get_artifact_key(arch))
+        return stamp.hexdigest()
+
     def install_libs(self, arch, *libs):
         libs_dir = self.ctx.get_libs_dir(arch.arch)
         if not libs:
@@ -671,6 +863,38 @@ class Recipe(with_metaclass(RecipeMeta)):
                     if isdir(fn):
                         yield name
 
+    @classmethod
+    def get_recipe_files(cls, ctx, refresh=False):
+        '''Returns a dict of the lowercase name of each recipe to its actual
+        spelling and its ``__init__.py``, the first recipe dirs taking
+        precedence. The recipe dirs are only listed again if ``refresh``.'''
+        recipe_dirs = tuple(cls.recipe_dirs(ctx))
+        if not hasattr(cls, "recipe_files"):
+            cls.recipe_files = {}
+        if refresh or recipe_dirs not in cls.recipe_files:
+            recipe_files = {}
+            for recipes_dir in reversed(recipe_dirs):
+                if not exists(recipes_dir):
+                    continue
+                for subfolder in listdir(recipes_dir):
+                    recipe_file = join(recipes_dir, subfolder, '__init__.py')
+                    if exists(recipe_file):
+                        recipe_files[subfolder.lower()] = (
+                            subfolder, recipe_file)
+            cls.recipe_files[recipe_dirs] = recipe_files
+        return cls.recipe_files[recipe_dirs]
+
+    @classmethod
+    def find_recipe_file(cls, name, ctx):
+        '''Returns the actual spelling and the ``__init__.py`` of the recipe
+        with the given (case insensitive) name, or ``None``.'''
+        name = name.lower()
+        recipe_files = cls.get_recipe_files(ctx)
+        if name not in recipe_files:
+            # it may have been added since the recipe dirs were listed
+            recipe_files = cls.get_recipe_files(ctx, refresh=True)
+        return recipe_files.get(name)
+
     @classmethod
     def get_recipe(cls, name, ctx):
         '''Returns the Recipe with the given name, if it exists.'''
@@ -680,23 +904,11 @@ class Recipe(with_metaclass(RecipeMeta)):
         if name in cls.recipes:
             return cls.recipes[name]
 
-        recipe_file = None
-        for recipes_dir in cls.recipe_dirs(ctx):
-            if not exists(recipes_dir):
-                continue
-            # Find matching folder (may differ in case):
-            for subfolder in listdir(recipes_dir):
-                if subfolder.lower() == name:
-                    recipe_file = join(recipes_dir, subfolder, '__init__.py')
-                    if exists(recipe_file):
-                        name = subfolder  # adapt to actual spelling
-                        break
-                    recipe_file = None
-            if recipe_file is not None:
-                break
-
-        if not recipe_file:
+        found = cls.find_recipe_file(name, ctx)
+        if found is None:
             raise ValueError('Recipe does not exist: {}'.format(name))
+        # adapt to actual spelling
+        name, recipe_file = found
 
         mod = import_recipe('pythonforandroid.recipes.{}'.format(name), recipe_file)
         if len(logger.handlers) > 1:
@@ -706,11 +918,49 @@ class Recipe(with_metaclass(RecipeMeta)):
         cls.recipes[name.lower()] = recipe
         return recipe
 
+    @classmethod
+    def get_recipe_index(cls, ctx):
+        '''Returns the :class:`~pythonforandroid.recipeindex.RecipeIndex`
+        stored in the build dir (only in memory without one).'''
+        filename = None
+        if ctx.build_dir:
+            filename = join(ctx.build_dir, 'recipe_index.json')
+        if not hasattr(cls, "recipe_indexes"):
+            cls.recipe_indexes = {}
+        if filename not in cls.recipe_indexes:
+            if filename is not None:
+                ensure_dir(ctx.build_dir)
+            cls.recipe_indexes[filename] = RecipeIndex(filename)
+        return cls.recipe_indexes[filename]
+
+    @classmethod
+    def get_recipe_info(cls, name, ctx):
+        '''Returns the metadata needed to resolve the dependencies of the
+        recipe with the given name (its depends, conflicts, opt_depends,
+        python_depends and version), if it exists.
+
+        The metadata comes from the recipe index, so the recipe module is
+        only imported if it was modified since it was indexed, and the
+        recipe itself is returned if it is already imported.'''
+        name = name.lower()
+        if name in getattr(cls, "recipes", {}):
+            return cls.recipes[name]
+        found = cls.find_recipe_file(name, ctx)
+        if found is None:
+            return cls.get_recipe(name, ctx)
+        recipe_file = found[1]
+        index = cls.get_recipe_index(ctx)
+        recipe_info = index.lookup(recipe_file)
+        if recipe_info is None:
+            recipe_info = index.store(recipe_file, cls.get_recipe(name, ctx))
+        return recipe_info
+
 
 class IncludedFilesBehaviour(object):
     '''Recipe mixin class that will automatically unpack files included in
     the recipe directory.'''
     src_filename = None
+    prebuilt_cacheable = False
 
     def prepare_build_dir(self, arch):
         if self.src_filename is None:
@@ -734,6 +984,7 @@ class BootstrapNDKRecipe(Recipe):
     '''
 
     dir_name = None  # The name of the recipe build folder in the jni dir
+    prebuilt_cacheable = False  # built with the bootstrap, not on its own
 
     def get_build_container_dir(self, arch):
         return self.get_jni_dir()
@@ -1066,14 +1317,20 @@ class CythonRecipe(PythonRecipe):
     def strip_object_files(self, arch, env, build_dir=None):
         if build_dir is None:
             build_dir = self.get_build_dir(arch.arch)
-        with current_directory(build_dir):
-            info('Stripping object files')
-            shprint(sh.find, '.', '-iname', '*.so', '-exec',
-                    '/usr/bin/echo', '{}', ';', _env=env)
-            shprint(sh.find, '.', '-iname', '*.so', '-exec',
-                    env['STRIP'].split(' ')[0], '--strip-unneeded',
-                    # '/usr/bin/strip', '--strip-unneeded',
-                    '{}', ';', _env=env)
+        info('Stripping object files')
+        strip = sh.Command(env['STRIP'].split(' ')[0]).bake(
+            '--strip-unneeded')
+        objcopy = None
+        debug_dir = self.ctx.debug_symbols_dir
+        if debug_dir:
+            objcopy = sh.Command(env['OBJCOPY'])
+            debug_dir = join(debug_dir, self.name, arch.arch)
+        # the recipe holds a job already, the strip threads get the free ones
+        with reserve_jobs(self.ctx, get_cpu_jobs(self.ctx) - 1,
+                          blocking=False) as jobs:
+            strip_files(find_libraries(build_dir), strip, env,
+                        jobs=jobs + 1, objcopy=objcopy,
+                        debug_dir=debug_dir, root_dir=build_dir)
 
     def cythonize_file(self, env, build_dir, filename):
         short_filename = filename
@@ -0,0 +1,133 @@
+"""
+An index of the static metadata of the recipes (their dependencies,
+conflicts and version), stored on disk so that the dependency graph can
+be resolved without importing every recipe module.
+"""
+
+from os import environ
+import inspect
+import json
+import os
+
+from pythonforandroid.logger import debug
+
+# changing it discards the indexes written by previous versions
+INDEX_VERSION = 1
+
+
+def _file_stats(filenames):
+    stats = {}
+    for filename in filenames:
+        try:
+            file_stat = os.stat(filename)
+        except OSError:
+            return None
+        stats[filename] = [file_stat.st_size, file_stat.st_mtime_ns]
+    return stats
+
+
+def _deplist(deps):
+    return [tuple(dep) if isinstance(dep, (list, tuple)) else dep
+            for dep in deps or []]
+
+
+class RecipeInfo(object):
+    '''The metadata of a recipe needed to resolve the dependencies, with
+    the same attributes as the :class:`~pythonforandroid.recipe.Recipe`.'''
+
+    def __init__(self, name, version=None, depends=None, conflicts=None,
+                 opt_depends=None, python_depends=None):
+        self.name = name
+        self._version = version
+        self.depends = _deplist(depends)
+        self.conflicts = list(conflicts or [])
+        self.opt_depends = list(opt_depends or [])
+        self.python_depends = list(python_depends or [])
+
+    @property
+    def version(self):
+        return environ.get('VERSION_' + self.name, self._version)
+
+    def get_opt_depends_in_list(self, recipes):
+        return [recipe for recipe in recipes if recipe in self.opt_depends]
+
+    @classmethod
+    def from_recipe(cls, recipe):
+        return cls(recipe.name, getattr(recipe, '_version', None),
+                   recipe.depends, recipe.conflicts, recipe.opt_depends,
+                   recipe.python_depends)
+
+    def to_dict(self):
+        return {'name': self.name, 'version': self._version,
+                'depends': self.depends, 'conflicts': self.conflicts,
+                'opt_depends': self.opt_depends,
+                'python_depends': self.python_depends}
+
+
+def get_recipe_source_files(recipe, recipe_file):
+    '''Returns the files defining the class of ``recipe`` (the first one
+    being ``recipe_file``) and its bases, which its metadata depends on.'''
+    filenames = [recipe_file]
+    for recipe_class in type(recipe).__mro__:
+        try:
+            filename = inspect.getfile(recipe_class)
+        except TypeError:
+            # a builtin class, or a class of a recipe module loaded from its
+            # file (like ``recipe_file``)
+            continue
+        if filename not in filenames:
+            filenames.append(filename)
+    return filenames
+
+
+class RecipeIndex(object):
+    '''The metadata of the recipes by recipe file, stored in ``filename``
+    (or only in memory if it is ``None``).
+
+    Each entry is only used while the files defining the recipe class (see
+    :func:`get_recipe_source_files`) keep their size and mtime.'''
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        if filename is None:
+            return
+        try:
+            with open(filename) as fileh:
+                data = json.load(fileh)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == INDEX_VERSION:
+            self.entries = data.get('recipes', {})
+
+    def lookup(self, recipe_file):
+        '''Returns the :class:`RecipeInfo` of the recipe defined in
+        ``recipe_file``, or ``None`` if it is missing or outdated.'''
+        entry = self.entries.get(recipe_file)
+        if entry is None or _file_stats(entry['files']) != entry['files']:
+            return None
+        return RecipeInfo(**entry['info'])
+
+    def store(self, recipe_file, recipe):
+        '''Stores the metadata of ``recipe``, defined in ``recipe_file``,
+        and returns its :class:`RecipeInfo`.'''
+        info = RecipeInfo.from_recipe(recipe)
+        files = _file_stats(get_recipe_source_files(recipe, recipe_file))
+        if files is not None:
+            self.entries[recipe_file] = {'info': info.to_dict(),
+                                         'files': files}
+            self.save()
+        return info
+
+    def save(self):
+        if self.filename is None:
+            return
+        temp_filename = '{}.{}.tmp'.format(self.filename, os.getpid())
+        try:
+            with open(temp_filename, 'w') as fileh:
+                json.dump({'version': INDEX_VERSION,
+                           'recipes': self.entries}, fileh)
+            os.replace(temp_filename, self.filename)
+        except OSError as e:
+            debug('Could not save the recipe index {}: {}'.format(
+                self.filename, e))
@@ -1,8 +1,11 @@
+import hashlib
+import os
+import platform
 import sh
+import subprocess
 
-from multiprocessing import cpu_count
 from pathlib import Path
-from os.path import join
+from os.path import basename, isfile, join
 
 from pythonforandroid.logger import shprint
 from pythonforandroid.patching import is_version_lt
@@ -10,7 +13,7 @@ from pythonforandroid.recipe import Recipe
 from pythonforandroid.util import (
     BuildInterruptingException,
     current_directory,
-    ensure_dir,
+    reset_build_dir_on_change,
 )
 
 HOSTPYTHON_VERSION_UNSET_MESSAGE = (
@@ -22,10 +25,34 @@ SETUP_DIST_NOT_FIND_MESSAGE = (
 )
 
 
+def get_host_compiler_version():
+    '''Returns the version output of the C compiler the hostpython is
+    built with, or an empty string if it can't be run.'''
+    for compiler in (os.environ.get('CC'), 'gcc', 'cc'):
+        if not compiler:
+            continue
+        try:
+            return subprocess.check_output(
+                compiler.split() + ['--version'],
+                stderr=subprocess.DEVNULL).decode('utf-8', 'replace')
+        except (OSError, subprocess.CalledProcessError):
+            continue
+    return ''
+
+
 class HostPython3Recipe(Recipe):
     '''
     The hostpython3's recipe.
 
+    With ``--optimize-python``, it is built with PGO (trained with the
+    test suite of CPython) and LTO, which makes the builds of the recipes
+    running it faster.
+
+    Its build dir is stored in the hostpython cache of the context (see
+    :attr:`~pythonforandroid.build.Context.hostpython_cache_dir`) once
+    built, and cloned from there by the builds of any storage dir needing
+    the same hostpython (see :meth:`get_host_cache_key`).
+
     .. versionchanged:: 2019.10.06.post0
         Refactored from deleted class ``python.HostPythonRecipe`` into here.
 
@@ -85,17 +112,86 @@ class HostPython3Recipe(Recipe):
     def get_path_to_python(self):
         return join(self.get_build_dir(), self.build_subdir)
 
+    @property
+    def configure_args(self):
+        if self.ctx.optimize_python:
+            return ('--enable-optimizations', '--with-lto')
+        return ()
+
+    def _add_options(self, stamp):
+        '''Folds the optimization options into the hash ``stamp``.'''
+        if not self.configure_args:
+            return stamp
+        return hashlib.sha256(' '.join(
+            (stamp,) + self.configure_args).encode('utf-8')).hexdigest()
+
+    def get_build_stamp(self, arch):
+        return self._add_options(super().get_build_stamp(arch))
+
+    def get_host_cache_key(self):
+        '''Returns the key of the hostpython build in the hostpython
+        cache: a hash of its version, sources, patches and configure
+        arguments, and of the host platform and C compiler.'''
+        key = hashlib.sha256()
+
+        def update(*values):
+            for value in values:
+                key.update(str(value).encode('utf-8') + b'\0')
+
+        update(self.get_dir_name(), self.version, self.versioned_url,
+               self.md5sum, self.sha256sum, platform.system(),
+               platform.machine(), platform.libc_ver(),
+               get_host_compiler_version(), *self.configure_args)
+        for filename in [self.get_recipe_file()] + \
+                self.get_patch_filenames(self.ctx.archs[0]):
+            update(basename(filename))
+            if isfile(filename):
+                with open(filename, 'rb') as fileh:
+                    key.update(fileh.read())
+        return key.hexdigest()
+
+    @property
+    def host_cache(self):
+        '''The hostpython cache of the context, or None if disabled or
+        built from local sources (``P4A_hostpython3_DIR``).'''
+        if 'P4A_{}_DIR'.format(self.name) in os.environ:
+            return None
+        return self.ctx.hostpython_cache
+
+    def prepare_build_dir(self, arch):
+        cache = self.host_cache
+        tree = cache.lookup(self.get_host_cache_key()) if cache else None
+        if tree is None:
+            super().prepare_build_dir(arch)
+            return
+        # the generated files of the build refer to the dir it ran in
+        cache.restore(tree, self.get_build_dir(), (self.build_subdir,))
+        # the restored build is not the one the build stamp was stored for
+        build_stamp_filename = self.get_stamp_filename(
+            self.ctx.archs[0], 'build')
+        if Path(build_stamp_filename).exists():
+            os.unlink(build_stamp_filename)
+
+    def get_artifact_key(self, arch):
+        return self._add_options(super().get_artifact_key(arch))
+
     def build_arch(self, arch):
         recipe_build_dir = self.get_build_dir(arch.arch)
 
         # Create a subdirectory to actually perform the build
         build_dir = join(recipe_build_dir, self.build_subdir)
-        ensure_dir(build_dir)
+        reset_build_dir_on_change(build_dir, ' '.join(self.configure_args))
+
+        env = dict(os.environ)
+        if self.ctx.optimize_python:
+            env['CFLAGS_NODIST'] = '-fno-semantic-interposition'
+            env['LDFLAGS_NODIST'] = '-fno-semantic-interposition'
 
         # Configure the build
         with current_directory(build_dir):
             if not Path('config.status').exists():
-                shprint(sh.Command(join(recipe_build_dir, 'configure')))
+                shprint(sh.Command(join(recipe_build_dir, 'configure')),
+                        *self.configure_args, _env=env)
 
         with current_directory(recipe_build_dir):
             # Create the Setup file. This copying from Setup.dist is
@@ -113,7 +209,7 @@ class HostPython3Recipe(Recipe):
                         SETUP_DIST_NOT_FIND_MESSAGE
                     )
 
-            shprint(sh.make, '-j', str(cpu_count()), '-C', build_dir)
+            shprint(sh.make, '-C', build_dir, _env=env)
 
             # make a copy of the python executable giving it the name we want,
             # because we got different python's executable names depending on
@@ -128,5 +224,9 @@ class HostPython3Recipe(Recipe):
 
         self.ctx.hostpython = self.python_exe
 
+        if self.host_cache is not None:
+            self.host_cache.store(self.get_host_cache_key(),
+                                  self.get_build_dir())
+
 
 recipe = HostPython3Recipe()
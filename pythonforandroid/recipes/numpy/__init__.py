@@ -1,5 +1,5 @@
 from pythonforandroid.recipe import CompiledComponentsPythonRecipe
-from multiprocessing import cpu_count
+from pythonforandroid.jobserver import get_cpu_jobs, reserve_jobs
 from os.path import join
 
 
@@ -19,13 +19,18 @@ class NumpyRecipe(CompiledComponentsPythonRecipe):
     call_hostpython_via_targetpython = False
 
     def build_compiled_components(self, arch):
-        self.setup_extra_args = ['-j', str(cpu_count())]
-        super().build_compiled_components(arch)
+        # setup.py doesn't know the jobserver, it gets the free jobs
+        with reserve_jobs(self.ctx, get_cpu_jobs(self.ctx) - 1,
+                          blocking=False) as jobs:
+            self.setup_extra_args = ['-j', str(jobs + 1)]
+            super().build_compiled_components(arch)
         self.setup_extra_args = []
 
     def rebuild_compiled_components(self, arch, env):
-        self.setup_extra_args = ['-j', str(cpu_count())]
-        super().rebuild_compiled_components(arch, env)
+        with reserve_jobs(self.ctx, get_cpu_jobs(self.ctx) - 1,
+                          blocking=False) as jobs:
+            self.setup_extra_args = ['-j', str(jobs + 1)]
+            super().rebuild_compiled_components(arch, env)
         self.setup_extra_args = []
 
 
@@ -1,23 +1,38 @@
 import glob
+import hashlib
+import re
 import sh
 import subprocess
 
-from multiprocessing import cpu_count
 from os import environ
-from os.path import dirname, exists, join
+from os.path import basename, dirname, exists, join
 from pathlib import Path
 from shutil import copy2
 
 from pythonforandroid.logger import info, warning, shprint
 from pythonforandroid.patching import version_starts_with, is_version_lt
 from pythonforandroid.recipe import Recipe, TargetPythonRecipe
+from pythonforandroid import sitezip
 from pythonforandroid.util import (
     current_directory,
     ensure_dir,
+    reset_build_dir_on_change,
     walk_valid_filens,
     BuildInterruptingException,
 )
 
+PGO_INSTRUMENTED_MESSAGE = (
+    'No profile data in {pgo_dir}, python3 is built instrumented: run a '
+    'representative workload in the app (like the benchmark testapp, which '
+    'writes a python-*.profraw file to its app dir), copy the profile data '
+    'into {pgo_dir} and build again'
+)
+
+FROZEN_C_UNSUPPORTED_MESSAGE = (
+    'Could not find the frozen modules table in {frozen_c}, the standard '
+    'library can not be frozen for this python version'
+)
+
 NDK_API_LOWER_THAN_SUPPORTED_MESSAGE = (
     'Target ndk-api is {ndk_api}, '
     'but the python3 recipe supports only {min_ndk_api}+'
@@ -46,6 +61,13 @@ class Python3Recipe(TargetPythonRecipe):
 
     .. note:: This recipe can be built only against API 21+.
 
+    With ``--optimize-python``, libpython is built with LTO and
+    ``-fno-semantic-interposition``. With ``--python-pgo-dir DIR`` it is
+    built using the profile data (``*.profraw`` or ``*.profdata`` files)
+    of ``DIR/<arch>``, or instrumented to collect them if there are none.
+    With ``--freeze-stdlib``, the :attr:`frozen_modules` are frozen into
+    libpython and the standard library is stored uncompressed in the zip.
+
     .. versionchanged:: 2019.10.06.post0
         - Refactored from deleted class ``python.GuestPythonRecipe`` into here
         - Added optional dependencies: :mod:`~pythonforandroid.recipes.libbz2`
@@ -100,6 +122,14 @@ class Python3Recipe(TargetPythonRecipe):
     recipe does).
     '''
 
+    frozen_modules = (
+        'abc', 'codecs', 'encodings', 'encodings.aliases',
+        'encodings.latin_1', 'encodings.utf_8', 'io', 'os', 'posixpath',
+        'genericpath', 'stat', '_collections_abc', '_sitebuiltins', 'site',
+    )
+    '''The modules of the standard library imported by the interpreter
+    startup, frozen into libpython with ``--freeze-stdlib``.'''
+
     MIN_NDK_API = 21
     '''Sets the minimal ndk api number needed to use the recipe.
 
@@ -201,8 +231,107 @@ class Python3Recipe(TargetPythonRecipe):
             warning('lld not found, linking without it. '
                     'Consider installing lld if linker errors occur.')
 
+        # the flags of the interpreter build only, not passed on to the
+        # extension modules built with it
+        nodist_flags = []
+        if self.ctx.optimize_python:
+            nodist_flags.append('-fno-semantic-interposition')
+            # the LTO objects can only be archived by llvm-ar
+            env['AR'] = env['LLVM_AR'] = join(arch.clang_path, 'llvm-ar')
+        if self.ctx.python_pgo_dir:
+            if self.get_pgo_profiles(arch):
+                nodist_flags.extend([
+                    '-fprofile-use=' + self.get_pgo_profdata(arch),
+                    '-Wno-profile-instr-out-of-date',
+                    '-Wno-profile-instr-unprofiled'])
+            else:
+                nodist_flags.append('-fprofile-generate')
+        if nodist_flags:
+            env['CFLAGS_NODIST'] = ' '.join(nodist_flags)
+            env['LDFLAGS_NODIST'] = ' '.join(nodist_flags)
+
         return env
 
+    def get_pgo_profiles(self, arch):
+        '''The profile data files collected for ``arch`` in the
+        ``python_pgo_dir`` of the context.'''
+        if not self.ctx.python_pgo_dir:
+            return []
+        pgo_dir = join(self.ctx.python_pgo_dir, arch.arch)
+        return sorted(glob.glob(join(pgo_dir, '*.profraw')) +
+                      glob.glob(join(pgo_dir, '*.profdata')))
+
+    def get_pgo_profdata(self, arch):
+        '''The profile data the profiles of ``arch`` are merged into.'''
+        return join(self.get_build_dir(arch.arch), 'python.profdata')
+
+    def get_optimization_key(self, arch):
+        '''Returns a string identifying the optimizations libpython is
+        built with for ``arch``, empty for the default build.'''
+        if not (self.ctx.optimize_python or self.ctx.python_pgo_dir or
+                self.ctx.freeze_stdlib):
+            return ''
+        key = hashlib.sha256()
+        key.update(str(self.ctx.optimize_python).encode('utf-8'))
+        key.update(str(bool(self.ctx.python_pgo_dir)).encode('utf-8'))
+        if self.ctx.freeze_stdlib:
+            key.update(' '.join(self.frozen_modules).encode('utf-8'))
+        for profile in self.get_pgo_profiles(arch):
+            with open(profile, 'rb') as fileh:
+                key.update(fileh.read())
+        return key.hexdigest()
+
+    def _add_optimization_key(self, stamp, arch):
+        '''Folds the optimization key of ``arch`` into the hash
+        ``stamp``, left as is for the default build.'''
+        key = self.get_optimization_key(arch)
+        if not key:
+            return stamp
+        return hashlib.sha256((stamp + key).encode('utf-8')).hexdigest()
+
+    def get_build_stamp(self, arch):
+        return self._add_optimization_key(
+            super().get_build_stamp(arch), arch)
+
+    def get_artifact_key(self, arch):
+        return self._add_optimization_key(
+            super().get_artifact_key(arch), arch)
+
+    def freeze_stdlib(self, arch, build_dir):
+        '''Writes the ``Python/frozen.c`` of ``build_dir``, built instead
+        of the one of the sources: its frozen modules (importlib) and the
+        :attr:`frozen_modules`, marshalled by the hostpython.'''
+        recipe_build_dir = self.get_build_dir(arch.arch)
+        frozen_c = join(recipe_build_dir, 'Python', 'frozen.c')
+        with open(frozen_c) as fileh:
+            source = fileh.read()
+        table = 'static const struct _frozen _PyImport_FrozenModules[]'
+        sentinel = re.search(r'^[ \t]*\{0, 0, 0\}', source, re.MULTILINE)
+        if table not in source or sentinel is None:
+            raise BuildInterruptingException(
+                FROZEN_C_UNSUPPORTED_MESSAGE.format(frozen_c=frozen_c))
+        source = (source[:sentinel.start()] + '    P4A_FROZEN_MODULES\n' +
+                  source[sentinel.start():])
+        source = source.replace(
+            table, '#include "p4a_frozen_modules.h"\n\n' + table)
+        # the headers next to the original file
+        source = re.sub(r'#include "(\w+\.h)"', lambda match: (
+            '#include "{}"'.format(join(recipe_build_dir, 'Python',
+                                        match.group(1)))
+            if exists(join(recipe_build_dir, 'Python', match.group(1)))
+            else match.group(0)), source)
+
+        ensure_dir(join(build_dir, 'Python'))
+        info('Freezing {} modules into libpython'.format(
+            len(self.frozen_modules)))
+        shprint(sh.Command(self.ctx.hostpython), '-OO',
+                join(dirname(__file__), 'freeze_modules.py'),
+                join(recipe_build_dir, 'Lib'),
+                join(build_dir, 'Python', 'p4a_frozen_modules.h'),
+                *self.frozen_modules)
+        with open(join(build_dir, 'Python', 'frozen.c'), 'w') as fileh:
+            fileh.write(source)
+
     def set_libs_flags(self, env, arch):
         '''Takes care to properly link libraries with python depending on our
         requirements and the attribute :attr:`opt_depends`.
@@ -285,7 +414,7 @@ class Python3Recipe(TargetPythonRecipe):
 
         # Create a subdirectory to actually perform the build
         build_dir = join(recipe_build_dir, 'android-build')
-        ensure_dir(build_dir)
+        reset_build_dir_on_change(build_dir, self.get_optimization_key(arch))
 
         # TODO: Get these dynamically, like bpo-30386 does
         sys_prefix = '/usr/local'
@@ -294,6 +423,21 @@ class Python3Recipe(TargetPythonRecipe):
         env = self.get_recipe_env(arch)
         env = self.set_libs_flags(env, arch)
 
+        configure_args = self.configure_args
+        if self.ctx.optimize_python:
+            configure_args += ('--with-lto',)
+        if self.get_pgo_profiles(arch):
+            shprint(sh.Command(join(arch.clang_path, 'llvm-profdata')),
+                    'merge', '-output=' + self.get_pgo_profdata(arch),
+                    *self.get_pgo_profiles(arch))
+        elif self.ctx.python_pgo_dir:
+            warning(PGO_INSTRUMENTED_MESSAGE.format(
+                pgo_dir=join(self.ctx.python_pgo_dir, arch.arch)))
+
+        if self.ctx.freeze_stdlib:
+            # found by make before the one of the sources, in its VPATH
+            self.freeze_stdlib(arch, build_dir)
+
         android_build = sh.Command(
             join(recipe_build_dir,
                  'config.guess'))().stdout.strip().decode('utf-8')
@@ -302,7 +446,7 @@ class Python3Recipe(TargetPythonRecipe):
             if not exists('config.status'):
                 shprint(
                     sh.Command(join(recipe_build_dir, 'configure')),
-                    *(' '.join(self.configure_args).format(
+                    *(' '.join(configure_args).format(
                                     android_host=env['HOSTARCH'],
                                     android_build=android_build,
                                     prefix=sys_prefix,
@@ -310,7 +454,7 @@ class Python3Recipe(TargetPythonRecipe):
                     _env=env)
 
             shprint(
-                sh.make, 'all', '-j', str(cpu_count()),
+                sh.make, 'all',
                 'INSTSONAME={lib_name}'.format(lib_name=self._libpython),
                 _env=env
             )
@@ -319,17 +463,24 @@ class Python3Recipe(TargetPythonRecipe):
             # better way, although this is probably acceptable
             sh.cp('pyconfig.h', join(recipe_build_dir, 'Include'))
 
-    def compile_python_files(self, dir):
+    def compile_python_files(self, *dirs):
         '''
         Compile the python files (recursively) for the python files inside
-        a given folder.
+        the given folders.
+
+        All the folders are compiled by a single hostpython process running
+        a pool of workers, and the files whose compiled file is up to date
+        are skipped (see the ``compile_pyfiles.py`` script of the common
+        bootstrap).
 
         .. note:: python2 compiles the files into extension .pyo, but in
             python3, and as of Python 3.5, the .pyo filename extension is no
             longer used...uses .pyc (https://www.python.org/dev/peps/pep-0488)
         '''
         args = [self.ctx.hostpython]
-        args += ['-OO', '-m', 'compileall', '-b', '-f', dir]
+        args += ['-OO', join(self.ctx.root_dir, 'bootstraps', 'common',
+                             'build', 'compile_pyfiles.py')]
+        args += list(dirs)
         subprocess.call(args)
 
     def create_python_bundle(self, dirn, arch):
@@ -349,12 +500,13 @@ class Python3Recipe(TargetPythonRecipe):
                 self.major_minor_version_string
             ))
 
-        # Compile to *.pyc/*.pyo the python modules
-        self.compile_python_files(modules_build_dir)
-        # Compile to *.pyc/*.pyo the standard python library
-        self.compile_python_files(join(self.get_build_dir(arch.arch), 'Lib'))
-        # Compile to *.pyc/*.pyo the other python packages (site-packages)
-        self.compile_python_files(self.ctx.get_python_install_dir())
+        # Compile to *.pyc/*.pyo the python modules, the standard python
+        # library and the other python packages (site-packages)
+        self.compile_python_files(
+            modules_build_dir,
+            join(self.get_build_dir(arch.arch), 'Lib'),
+            self.ctx.get_python_install_dir(),
+        )
 
         # Bundle compiled python modules to a folder
         modules_dir = join(dirn, 'modules')
@@ -373,7 +525,10 @@ class Python3Recipe(TargetPythonRecipe):
             stdlib_filens = list(walk_valid_filens(
                 '.', self.stdlib_dir_blacklist, self.stdlib_filen_blacklist))
             info("Zip {} files into the bundle".format(len(stdlib_filens)))
-            shprint(sh.zip, stdlib_zip, *stdlib_filens)
+            # stored uncompressed to be imported faster, the bundle is
+            # compressed anyway
+            zip_args = ('-0',) if self.ctx.freeze_stdlib else ()
+            shprint(sh.zip, *zip_args, stdlib_zip, *stdlib_filens)
 
         # copy the site-packages into place
         ensure_dir(join(dirn, 'site-packages'))
@@ -383,6 +538,20 @@ class Python3Recipe(TargetPythonRecipe):
             filens = list(walk_valid_filens(
                 '.', self.site_packages_dir_blacklist,
                 self.site_packages_filen_blacklist))
+            if self.ctx.site_packages_zip:
+                # the stdlib modules are found first, the site-packages
+                # shadowing them must stay after them in sys.path
+                stdlib_names = {
+                    filen.split('/')[1].split('.')[0]
+                    for filen in stdlib_filens} | {
+                    basename(filen).split('.')[0] for filen in module_filens}
+                site_packages_zip = join(dirn, 'site-packages.zip')
+                zipped = len(filens)
+                filens = sitezip.write_site_zip(
+                    site_packages_zip, '.', filens, exclude=stdlib_names)
+                info("Zip {} files into {}".format(
+                    zipped - len(filens), site_packages_zip))
+                copy2(sitezip.__file__, join(modules_dir, '_p4a_sitezip.py'))
             info("Copy {} files into the site-packages".format(len(filens)))
             for filen in filens:
                 info(" - copy {}".format(filen))
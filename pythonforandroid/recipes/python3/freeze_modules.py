@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''
+Write a C header holding the marshalled code of some modules of the
+standard library, to be frozen into libpython by the python3 recipe: the
+header defines ``P4A_FROZEN_MODULES``, the entries of the modules to add
+to the ``_PyImport_FrozenModules`` table of ``Python/frozen.c``.
+
+This must run with the python the modules are frozen for, with the
+optimization level of the python bundle, e.g.
+``hostpython3 -OO freeze_modules.py Lib frozen.h encodings os``.
+'''
+
+import argparse
+import marshal
+import os
+
+
+def get_module_source(lib_dir, name):
+    '''Returns the source file of the module ``name`` of ``lib_dir``, and
+    whether it is a package.'''
+    path = os.path.join(lib_dir, *name.split('.'))
+    if os.path.isdir(path):
+        return os.path.join(path, '__init__.py'), True
+    return path + '.py', False
+
+
+def freeze_module(lib_dir, name):
+    '''Returns the marshalled code of the module ``name`` of ``lib_dir``,
+    and whether it is a package.'''
+    source, is_package = get_module_source(lib_dir, name)
+    with open(source, 'rb') as fileh:
+        code = compile(fileh.read(), '<frozen {}>'.format(name), 'exec')
+    return marshal.dumps(code), is_package
+
+
+def write_header(filename, modules):
+    '''Writes the header of ``modules``, a list of tuples with the name of
+    each module, its marshalled code and whether it is a package.'''
+    lines = ['/* Generated by freeze_modules.py, do not edit */', '']
+    entries = []
+    for name, data, is_package in modules:
+        symbol = '_P4A_M__' + name.replace('.', '__')
+        lines.append('static const unsigned char {}[] = {{'.format(symbol))
+        for start in range(0, len(data), 20):
+            lines.append('    {},'.format(
+                ','.join(str(byte) for byte in data[start:start + 20])))
+        lines.extend(['};', ''])
+        # a negative size marks a package
+        entries.append('    {{"{}", {}, {}(int)sizeof({})}}, \\'.format(
+            name, symbol, '-' if is_package else '', symbol))
+    lines.append('#define P4A_FROZEN_MODULES \\')
+    lines.extend(entries)
+    lines.append('')
+    with open(filename, 'w') as fileh:
+        fileh.write('\n'.join(lines) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write a C header freezing some modules of the stdlib')
+    parser.add_argument('lib_dir', help='The Lib dir of the python sources')
+    parser.add_argument('header', help='The header to write')
+    parser.add_argument('modules', nargs='+', help='The modules to freeze')
+    args = parser.parse_args()
+    write_header(args.header, [
+        (name,) + freeze_module(args.lib_dir, name) for name in args.modules])
+
+
+if __name__ == '__main__':
+    main()
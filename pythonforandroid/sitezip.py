@@ -0,0 +1,194 @@
+"""
+Packs the pure Python packages of site-packages into a single uncompressed
+zip, along with an index of where each module is in it, and imports them
+from there with a path entry finder.
+
+The module only uses the standard library: it runs on the host to write
+the zip, and is copied into the python bundle to import from it on the
+device, where the finder looks the modules up in the index instead of
+searching the zip, in the order of the zip in ``sys.path``.
+"""
+
+from importlib.machinery import ModuleSpec
+from importlib.util import MAGIC_NUMBER
+import json
+import marshal
+import os
+import struct
+import sys
+import zipfile
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.index'
+
+# the data of each file starts at a multiple of this, padding the extra
+# field of its header like zipalign does
+ALIGNMENT = 4
+ALIGNMENT_EXTRA_ID = 0xd935
+
+MODULE_SUFFIXES = ('.pyc', '.py')
+
+
+def get_module_name(filename):
+    '''Returns the name of the module in the file ``filename`` (relative
+    to site-packages) and whether it is a package, or ``None`` if it is
+    not a Python module.'''
+    base, ext = os.path.splitext(filename)
+    if ext not in MODULE_SUFFIXES or '.' in base:
+        return None
+    parts = base.split('/')
+    if parts[-1] == '__init__':
+        return '.'.join(parts[:-1]), True
+    return '.'.join(parts), False
+
+
+def _is_zippable(top_level, filenames, exclude):
+    '''Whether the top level module or package ``top_level`` made of
+    ``filenames`` has only Python modules, all in regular packages, and
+    is not in ``exclude``.'''
+    names = [get_module_name(filename) for filename in filenames]
+    if None in names:
+        return False
+    packages = {name for name, is_package in names if is_package}
+    for name, is_package in names:
+        parent = name.rpartition('.')[0]
+        if parent and parent not in packages:
+            return False
+    return names[0][0].split('.')[0] not in exclude
+
+
+def write_site_zip(zip_filename, root, filenames, exclude=()):
+    '''Writes the top level modules and packages of ``filenames`` (relative
+    to ``root``) made only of Python modules to ``zip_filename``, except
+    those in ``exclude``, and their index next to it. Returns the
+    filenames which were not zipped (data files, extension modules and the
+    packages containing them, metadata...), to be copied as they are.'''
+    groups = {}
+    for filename in filenames:
+        filename = os.path.normpath(filename).replace(os.sep, '/')
+        groups.setdefault(filename.split('/')[0], []).append(filename)
+
+    zipped = []
+    left = []
+    for top_level, group in sorted(groups.items()):
+        if _is_zippable(top_level, group, exclude):
+            zipped.extend(group)
+        else:
+            left.extend(group)
+
+    modules = {}
+    with open(zip_filename, 'wb') as fileh, \
+            zipfile.ZipFile(fileh, 'w', zipfile.ZIP_STORED) as zip_file:
+        for filename in sorted(zipped):
+            with open(os.path.join(root, filename), 'rb') as source:
+                data = source.read()
+            info = zipfile.ZipInfo(filename, date_time=(1980, 1, 1, 0, 0, 0))
+            header_size = 30 + len(filename.encode('utf-8'))
+            padding = -(fileh.tell() + header_size + 4) % ALIGNMENT
+            info.extra = struct.pack('<HH', ALIGNMENT_EXTRA_ID, padding) + \
+                b'\0' * padding
+            offset = fileh.tell() + header_size + len(info.extra)
+            zip_file.writestr(info, data)
+
+            name, is_package = get_module_name(filename)
+            # the compiled module, if there is one
+            if name not in modules or filename.endswith('.pyc'):
+                modules[name] = [filename, is_package, offset, len(data)]
+
+    with open(zip_filename + INDEX_SUFFIX, 'w') as fileh:
+        json.dump({'version': INDEX_VERSION, 'modules': modules}, fileh)
+    return left
+
+
+class SiteZipLoader(object):
+    '''Loads a module from the zip of a :class:`SiteZipFinder`.'''
+
+    def __init__(self, finder, entry):
+        self.finder = finder
+        self.filename, self._is_package, self.offset, self.size = entry
+        self.path = os.path.join(finder.zip_filename, self.filename)
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        exec(self.get_code(module.__name__), module.__dict__)
+
+    def get_code(self, fullname):
+        data = self.finder.read(self.offset, self.size)
+        if self.filename.endswith('.pyc'):
+            if data[:4] != MAGIC_NUMBER:
+                raise ImportError('bad magic number in {}'.format(self.path),
+                                  name=fullname, path=self.path)
+            return marshal.loads(data[16:])
+        return compile(data, self.path, 'exec', dont_inherit=True)
+
+    def get_source(self, fullname):
+        if self.filename.endswith('.pyc'):
+            return None
+        return self.finder.read(self.offset, self.size).decode('utf-8')
+
+    def get_filename(self, fullname):
+        return self.path
+
+    def is_package(self, fullname):
+        return self._is_package
+
+
+class SiteZipFinder(object):
+    '''Finds the modules of the zip ``zip_filename`` in its index
+    ``modules``, written by :func:`write_site_zip`. It is the path entry
+    finder of the zip and of its package dirs, see :meth:`path_hook`.'''
+
+    def __init__(self, zip_filename, modules):
+        self.zip_filename = zip_filename
+        self.modules = modules
+
+    def path_hook(self, path):
+        '''The ``sys.path_hooks`` entry returning the finder for the
+        paths into the zip.'''
+        if path == self.zip_filename or path.startswith(
+                self.zip_filename + '/'):
+            return self
+        raise ImportError('not in {}'.format(self.zip_filename), path=path)
+
+    def find_spec(self, fullname, target=None):
+        entry = self.modules.get(fullname)
+        if entry is None:
+            return None
+        loader = SiteZipLoader(self, entry)
+        spec = ModuleSpec(fullname, loader, origin=loader.path,
+                          is_package=loader.is_package(fullname))
+        spec.has_location = True
+        if spec.submodule_search_locations is not None:
+            spec.submodule_search_locations.append(
+                os.path.dirname(loader.path))
+        return spec
+
+    def invalidate_caches(self):
+        pass
+
+    def read(self, offset, size):
+        with open(self.zip_filename, 'rb') as fileh:
+            fileh.seek(offset)
+            return fileh.read(size)
+
+
+def install(zip_filename):
+    '''Appends ``zip_filename`` to ``sys.path`` and imports its modules
+    with a :class:`SiteZipFinder`, so that the modules of the entries
+    before it (e.g. the app dir) take precedence, as for a directory.
+    Returns the finder, or ``None`` if the index could not be read.'''
+    try:
+        with open(zip_filename + INDEX_SUFFIX) as fileh:
+            data = json.load(fileh)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != INDEX_VERSION:
+        return None
+    finder = SiteZipFinder(zip_filename, data['modules'])
+    # ahead of zipimport, which would claim the zip
+    sys.path_hooks.insert(0, finder.path_hook)
+    sys.path_importer_cache.pop(zip_filename, None)
+    sys.path.append(zip_filename)
+    return finder
@@ -87,8 +87,10 @@ from distutils.version import LooseVersion
 
 from pythonforandroid.recipe import Recipe
 from pythonforandroid.logger import (logger, info, warning, setup_color,
+                                     setup_command_logs,
                                      Out_Style, Out_Fore,
                                      info_notify, info_main, shprint)
+from pythonforandroid.profiler import BuildProfiler, profile
 from pythonforandroid.util import current_directory
 from pythonforandroid.bootstrap import Bootstrap
 from pythonforandroid.distribution import Distribution, pretty_log_dists
@@ -393,6 +395,118 @@ class ToolchainCL:
             description='Copy libraries instead of using biglink (Android 4.3+)'
         )
 
+        add_boolean_option(
+            generic_parser, ['site-packages-zip'],
+            default=False,
+            description=('Pack the pure Python packages of site-packages '
+                         'into an indexed, uncompressed zip imported from '
+                         'by a meta path finder')
+        )
+
+        add_boolean_option(
+            generic_parser, ['biglink-lld'],
+            default=False,
+            description=('Biglink with lld, which links using several '
+                         'threads, instead of the default linker')
+        )
+
+        add_boolean_option(
+            generic_parser, ['optimize-python'],
+            default=False,
+            description=('Build python3 with LTO, and hostpython3 with PGO '
+                         'and LTO')
+        )
+
+        add_boolean_option(
+            generic_parser, ['freeze-stdlib'],
+            default=False,
+            description=('Freeze the stdlib modules imported at startup into '
+                         'libpython, and store the stdlib uncompressed in '
+                         'its zip, for a faster app startup')
+        )
+
+        generic_parser.add_argument(
+            '--python-pgo-dir', dest='python_pgo_dir', default=None,
+            help=('Build python3 with the profile data of the <arch> '
+                  'subdir of this dir, or instrumented to collect it if '
+                  'there is none'))
+
+        add_boolean_option(
+            generic_parser, ['clone-source-trees'],
+            default=False,
+            description=('Unpack each recipe source once and reflink (or '
+                         'copy) it into the build dir of every arch')
+        )
+
+        add_boolean_option(
+            generic_parser, ['profile-build'],
+            default=False,
+            description=('Measure each phase of the build, and write a trace '
+                         '(build_profile.json) and a summary '
+                         '(build_profile.txt) to the build dir')
+        )
+
+        add_boolean_option(
+            generic_parser, ['command-logs'],
+            default=False,
+            description=('Write the output of each build command to its own '
+                         'log file in the build dir, and only show a status '
+                         'line')
+        )
+
+        generic_parser.add_argument(
+            '--cpu-jobs', dest='cpu_jobs', type=int, default=None,
+            help=('How many compiler jobs all the recipe builds may run at '
+                  'the same time, shared through a make jobserver '
+                  '(default: the number of CPUs)'))
+
+        generic_parser.add_argument(
+            '--jobs', dest='jobs', type=int, default=1,
+            help=('How many recipes may be unpacked and built at the same '
+                  'time, for independent recipes and archs (default: 1)'))
+
+        generic_parser.add_argument(
+            '--download-jobs', '--download_jobs', dest='download_jobs',
+            type=int, default=4,
+            help='How many recipes may be downloaded at the same time '
+                 '(default: 4)')
+
+        generic_parser.add_argument(
+            '--download-cache-dir', '--download_cache_dir',
+            dest='download_cache_dir', default=None,
+            help=('Directory where downloads are cached by content, it may be '
+                  'shared between storage dirs (default: inside the storage '
+                  'dir)'))
+
+        generic_parser.add_argument(
+            '--prebuilt-cache-dir', '--prebuilt_cache_dir',
+            dest='prebuilt_cache_dir', default=None,
+            help=('Directory where built recipes are stored, to be restored '
+                  'instead of built again by builds with the same inputs, it '
+                  'may be shared between storage dirs (default: disabled)'))
+
+        add_boolean_option(
+            generic_parser, ['hostpython-cache'],
+            default=True,
+            description=('Reuse the hostpython built by the other storage '
+                         'dirs of the host, from the hostpython cache dir'))
+
+        generic_parser.add_argument(
+            '--hostpython-cache-dir', dest='hostpython_cache_dir',
+            default=join(os.environ.get('XDG_CACHE_HOME',
+                                        expanduser(join('~', '.cache'))),
+                         'python-for-android', 'hostpython3'),
+            help=('Directory where the built hostpython trees are stored, '
+                  'to be cloned by the builds of any storage dir (default: '
+                  'python-for-android/hostpython3 in the user cache dir)'))
+
+        generic_parser.add_argument(
+            '--download-mirror', '--download_mirror', dest='download_mirrors',
+            action='append', default=[],
+            help=('An url or local directory holding recipe downloads by '
+                  'file name, tried before the upstream urls. May be given '
+                  'several times'))
+
         self._read_configuration()
 
         subparsers = parser.add_subparsers(dest='subparser_name',
@@ -454,7 +568,8 @@ class ToolchainCL:
             'component', nargs='+',
             help=('The build component(s) to delete. You can pass any '
                   'number of arguments from "all", "builds", "dists", '
-                  '"distributions", "bootstrap_builds", "downloads".'))
+                  '"distributions", "bootstrap_builds", "downloads", '
+                  '"toolchain_probe".'))
 
         parser_clean_recipe_build = add_parser(
             subparsers,
@@ -534,6 +649,11 @@ class ToolchainCL:
             '--with-debug-symbols', dest='with_debug_symbols',
             action='store_const', const=True, default=False,
             help='Will keep debug symbols from `.so` files.')
+        parser_packaging.add_argument(
+            '--debug-symbols-dir', dest='debug_symbols_dir', default=None,
+            help=('Before stripping the `.so` files, keep their debug '
+                  'information in this directory, to symbolicate the '
+                  'native crashes of the release.'))
         parser_packaging.add_argument(
             '--keystore', dest='keystore', action='store', default=None,
             help=('Keystore for JAR signing key, will use jarsigner '
@@ -633,6 +753,10 @@ class ToolchainCL:
         self.ctx.with_debug_symbols = getattr(
             args, "with_debug_symbols", False
         )
+        self.ctx.debug_symbols_dir = getattr(args, "debug_symbols_dir", None)
+        if self.ctx.debug_symbols_dir:
+            self.ctx.debug_symbols_dir = realpath(
+                expanduser(self.ctx.debug_symbols_dir))
 
         have_setup_py_or_similar = False
         if getattr(args, "private", None) is not None:
@@ -696,6 +820,11 @@ class ToolchainCL:
 
         self.storage_dir = args.storage_dir
         self.ctx.setup_dirs(self.storage_dir)
+        if args.command_logs:
+            setup_command_logs(join(self.ctx.build_dir, 'logs'))
+        if args.profile_build:
+            self.ctx.profiler = BuildProfiler(
+                join(self.ctx.build_dir, 'build_profile.events'))
         self.sdk_dir = args.sdk_dir
         self.ndk_dir = args.ndk_dir
         self.android_api = args.android_api
@@ -707,12 +836,40 @@ class ToolchainCL:
 
         self.ctx.local_recipes = args.local_recipes
         self.ctx.copy_libs = args.copy_libs
+        self.ctx.biglink_lld = args.biglink_lld
+        self.ctx.site_packages_zip = args.site_packages_zip
+        self.ctx.optimize_python = args.optimize_python
+        self.ctx.freeze_stdlib = args.freeze_stdlib
+        if args.python_pgo_dir:
+            self.ctx.python_pgo_dir = realpath(
+                expanduser(args.python_pgo_dir))
+        self.ctx.jobs = max(1, args.jobs)
+        if args.cpu_jobs:
+            self.ctx.cpu_jobs = max(1, args.cpu_jobs)
+        self.ctx.clone_source_trees = args.clone_source_trees
+        self.ctx.download_jobs = max(1, args.download_jobs)
+        self.ctx.download_cache_dir = (
+            expanduser(args.download_cache_dir)
+            if args.download_cache_dir else None)
+        self.ctx.download_mirrors = args.download_mirrors
+        self.ctx.prebuilt_cache_dir = (
+            expanduser(args.prebuilt_cache_dir)
+            if args.prebuilt_cache_dir else None)
+        self.ctx.hostpython_cache_dir = (
+            realpath(expanduser(args.hostpython_cache_dir))
+            if args.hostpython_cache else None)
 
         self.ctx.activity_class_name = args.activity_class_name
 
         # Each subparser corresponds to a method
         command = args.subparser_name.replace('-', '_')
-        getattr(self, command)(args)
+        try:
+            getattr(self, command)(args)
+        finally:
+            if self.ctx.profiler is not None:
+                self.ctx.profiler.report(
+                    join(self.ctx.build_dir, 'build_profile.json'),
+                    join(self.ctx.build_dir, 'build_profile.txt'))
 
     @staticmethod
     def warn_on_carriage_return_args(args):
@@ -802,14 +959,17 @@ class ToolchainCL:
         else:
             for name in sorted(Recipe.list_recipes(ctx)):
                 try:
-                    recipe = Recipe.get_recipe(name, ctx)
+                    # from the recipe index, without importing the recipe
+                    recipe = Recipe.get_recipe_info(name, ctx)
                 except (IOError, ValueError):
                     warning('Recipe "{}" could not be loaded'.format(name))
+                    continue
                 except SyntaxError:
                     import traceback
                     traceback.print_exc()
                     warning(('Recipe "{}" could not be loaded due to a '
                              'syntax error').format(name))
+                    continue
                 version = str(recipe.version)
                 print('{Fore.BLUE}{Style.BRIGHT}{recipe.name:<12} '
                       '{Style.RESET_ALL}{Fore.LIGHTBLUE_EX}'
@@ -845,7 +1005,8 @@ class ToolchainCL:
             'distributions': self.clean_dists,
             'builds': self.clean_builds,
             'bootstrap_builds': self.clean_bootstrap_builds,
-            'downloads': self.clean_download_cache}
+            'downloads': self.clean_download_cache,
+            'toolchain_probe': self.clean_toolchain_probe}
 
         for component in components:
             if component not in component_clean_methods:
@@ -868,6 +1029,11 @@ class ToolchainCL:
         if exists(ctx.dist_dir):
             shutil.rmtree(ctx.dist_dir)
 
+    def clean_toolchain_probe(self, _args):
+        """Delete the stored results of probing the SDK, the NDK and the
+        host tools, so that they are probed again."""
+        self.ctx.toolchain_probe.clear()
+
     def clean_bootstrap_builds(self, _args):
         """Delete all the bootstrap builds."""
         if exists(join(self.ctx.build_dir, 'bootstrap_builds')):
@@ -922,8 +1088,17 @@ class ToolchainCL:
         if hasattr(args, 'recipes') and args.recipes:
             for package in args.recipes:
                 remove_path = join(ctx.packages_path, package)
-                if exists(remove_path):
+                removed = exists(remove_path)
+                if removed:
                     shutil.rmtree(remove_path)
+                try:
+                    recipe = Recipe.get_recipe(package, ctx)
+                except ValueError:
+                    pass
+                else:
+                    # also drop it from the cache shared by the storage dirs
+                    removed = recipe.clean_download_cache() or removed
+                if removed:
                     info('Download cache removed for: "{}"'.format(package))
                 else:
                     warning('No download cache found for "{}", skipping'.format(
@@ -934,6 +1109,12 @@ class ToolchainCL:
                 info('Download cache removed.')
             else:
                 print('No cache found at "{}"'.format(ctx.packages_path))
+            if ctx.download_cache_dir is not None:
+                # may be in use by other storage dirs, remove under locks
+                ctx.download_cache.clear()
+                info('Shared download cache cleared.')
+            elif exists(ctx.download_cache.root):
+                shutil.rmtree(ctx.download_cache.root)
 
     @require_prebuilt_dist
     def export_dist(self, args):
@@ -1032,9 +1213,10 @@ class ToolchainCL:
             self.hook("before_apk_build")
             os.environ["ANDROID_API"] = str(self.ctx.android_api)
             build = load_source('build', join(dist.dist_dir, 'build.py'))
-            build_args = build.parse_args_and_make_package(
-                args.unknown_args
-            )
+            with profile(ctx, 'make_package'):
+                build_args = build.parse_args_and_make_package(
+                    args.unknown_args
+                )
 
             self.hook("after_apk_build")
             self.hook("before_apk_assemble")
@@ -1072,8 +1254,9 @@ class ToolchainCL:
             else:
                 raise BuildInterruptingException(
                     "Unknown build mode {} for apk()".format(args.build_mode))
-            output = shprint(gradlew, gradle_task, _tail=20,
-                             _critical=True, _env=env)
+            with profile(ctx, 'gradle'):
+                output = shprint(gradlew, gradle_task, _tail=20,
+                                 _critical=True, _env=env)
         return output, build_args
 
     def _finish_package(self, args, output, build_args, package_type, output_dir):
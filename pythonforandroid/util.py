@@ -1,5 +1,10 @@
 import contextlib
-from os.path import exists, join
+import fcntl
+import multiprocessing
+import os
+import queue
+import traceback
+from os.path import dirname, exists, isfile, join
 from os import getcwd, chdir, makedirs, walk, uname
 import shutil
 from fnmatch import fnmatch
@@ -44,6 +49,75 @@ def ensure_dir(filename):
         makedirs(filename)
 
 
+FICLONE = 0x40049409  # from linux/fs.h
+
+
+def reflink_file(source, target):
+    """Creates ``target`` as a copy-on-write clone of ``source``, sharing
+    its data blocks. Raises an ``OSError`` if the filesystem (or the
+    platform) does not support it."""
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, target)
+
+
+def clone_tree(source, target):
+    """Recreates the directory ``source`` at ``target`` sharing the file
+    data when possible: files are reflinked where the filesystem supports
+    it, otherwise copied, so that either tree can be modified in place.
+    Returns the method that was used last, ``'reflink'`` or ``'copy'``."""
+    method = 'reflink'
+
+    def copy_function(src, dst):
+        nonlocal method
+        if method == 'reflink':
+            try:
+                reflink_file(src, dst)
+                return dst
+            except OSError:
+                if exists(dst):
+                    os.unlink(dst)
+                method = 'copy'
+        return shutil.copy2(src, dst)
+
+    shutil.copytree(source, target, symlinks=True, copy_function=copy_function)
+    return method
+
+
+def reset_build_dir_on_change(build_dir, options,
+                              filename='p4a_build_options'):
+    '''Empties ``build_dir`` if it was configured with other build
+    ``options`` (a string, empty for the default build) than the given
+    ones, so that it is configured and built again, and records them.'''
+    options_file = join(build_dir, filename)
+    previous = ''
+    if isfile(options_file):
+        with open(options_file) as fileh:
+            previous = fileh.read()
+    if previous != options and exists(build_dir):
+        info('Build options changed, cleaning {}'.format(build_dir))
+        shutil.rmtree(build_dir)
+    ensure_dir(build_dir)
+    if options and previous != options:
+        with open(options_file, 'w') as fileh:
+            fileh.write(options)
+
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """Holds an exclusive lock on ``filename`` (created if needed) for the
+    duration of the context, so that several processes sharing a directory
+    (parallel jobs, other storage dirs or CI workers on the same host) do
+    not step on each other. Blocks until the lock is available."""
+    ensure_dir(dirname(filename))
+    with open(filename, 'a') as fileh:
+        fcntl.flock(fileh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fileh, fcntl.LOCK_UN)
+
+
 def walk_valid_filens(base_dir, invalid_dir_names, invalid_file_patterns):
     """Recursively walks all the files and directories in ``dirn``,
     ignoring directories that match any pattern in ``invalid_dirns``
@@ -88,6 +162,79 @@ def load_source(module, filename):
         return SourceFileLoader(module, filename).load_module()
 
 
+def _run_parallel_task(results_queue, task, target):
+    try:
+        results_queue.put((task, True, target(task)))
+    except BaseException:
+        results_queue.put((task, False, traceback.format_exc()))
+
+
+def run_parallel_tasks(tasks, target, jobs, dependencies=None,
+                       on_result=None):
+    """Calls ``target(task)`` for each of the given ``tasks``, using up to
+    ``jobs`` forked worker processes at a time.
+
+    A task is only started once all the tasks listed for it in the
+    ``dependencies`` dict have finished. Each time a task finishes,
+    ``on_result(task, value)`` is called in the parent process *before* any
+    task depending on it is started, so it can be used to carry over any
+    state that the children need to inherit.
+
+    Tasks and the values returned by ``target`` must be picklable. If a
+    task fails, no further tasks are started and a
+    :class:`BuildInterruptingException` is raised once the running ones
+    have finished. Returns a dict mapping each task to its value.
+    """
+    dependencies = dependencies or {}
+    mp_context = multiprocessing.get_context('fork')
+    results_queue = mp_context.Queue()
+    pending = list(tasks)
+    running = {}
+    results = {}
+    failure = None
+    while pending or running:
+        if failure is None:
+            for task in list(pending):
+                if len(running) >= jobs:
+                    break
+                if all(dep in results for dep in dependencies.get(task, ())):
+                    pending.remove(task)
+                    process = mp_context.Process(
+                        target=_run_parallel_task,
+                        args=(results_queue, task, target))
+                    process.start()
+                    running[task] = process
+        if not running:
+            if failure is None:
+                failure = (pending[0], 'Unsatisfiable dependencies: {}'.format(
+                    dependencies.get(pending[0])))
+            break
+        try:
+            task, success, value = results_queue.get(timeout=1)
+        except queue.Empty:
+            # a worker may have been killed without being able to report
+            for task, process in list(running.items()):
+                if process.exitcode not in (None, 0):
+                    running.pop(task)
+                    if failure is None:
+                        failure = (task, 'Worker exited with code {}'.format(
+                            process.exitcode))
+            continue
+        running.pop(task).join()
+        if not success:
+            if failure is None:
+                failure = (task, value)
+            continue
+        results[task] = value
+        if on_result is not None:
+            on_result(task, value)
+    if failure is not None:
+        task, reason = failure
+        raise BuildInterruptingException(
+            'Parallel task {} failed'.format(task), instructions=reason)
+    return results
+
+
 class BuildInterruptingException(Exception):
     def __init__(self, message, instructions=None):
         super().__init__(message, instructions)
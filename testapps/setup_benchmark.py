@@ -0,0 +1,22 @@
+
+from distutils.core import setup
+from setuptools import find_packages
+
+options = {'apk': {'requirements': 'sdl2,python3',
+                   'android-api': 27,
+                   'ndk-api': 21,
+                   'bootstrap': 'sdl2',
+                   'dist-name': 'bdisttest_benchmark',
+                   'arch': 'arm64-v8a',
+                   }}
+
+setup(
+    name='testapp_benchmark',
+    version='1.0',
+    description='p4a python3 benchmark app, also used to collect PGO profiles',
+    author='Kivy team',
+    author_email='kivy-dev@googlegroups.com',
+    packages=find_packages(),
+    options=options,
+    package_data={'testapp_benchmark': ['*.py']}
+)
@@ -0,0 +1,173 @@
+'''
+A few pure Python benchmarks, in the spirit of those of pyperformance, to
+compare python3 builds on a device (e.g. with and without
+``--optimize-python``). The timings are printed to the logcat.
+
+When python3 is built instrumented (``--python-pgo-dir`` without profile
+data), the profile data of the run is written to ``python-<pid>.profraw``
+in the app dir, to be copied into the ``<arch>`` subdir of the PGO dir.
+'''
+
+import ctypes
+import json
+import os
+import sys
+import time
+
+REPEAT = 5
+
+
+def bench_nbody(iterations=20000):
+    bodies = [
+        ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0], 39.47),
+        ([4.84, -1.16, -0.10], [0.60, 2.81, -0.02], 0.037),
+        ([8.34, 4.12, -0.40], [-1.01, 1.82, 0.008], 0.011),
+        ([12.89, -15.11, -0.22], [1.08, 0.86, -0.01], 0.0017),
+        ([15.37, -25.91, 0.17], [0.97, 0.59, -0.03], 0.002),
+    ]
+    pairs = [(bodies[i], bodies[j])
+             for i in range(len(bodies)) for j in range(i + 1, len(bodies))]
+    dt = 0.01
+    for _ in range(iterations):
+        for ((x1, y1, z1), v1, m1), ((x2, y2, z2), v2, m2) in pairs:
+            dx, dy, dz = x1 - x2, y1 - y2, z1 - z2
+            mag = dt * ((dx * dx + dy * dy + dz * dz) ** -1.5)
+            b1m, b2m = m1 * mag, m2 * mag
+            v1[0] -= dx * b2m
+            v1[1] -= dy * b2m
+            v1[2] -= dz * b2m
+            v2[0] += dx * b1m
+            v2[1] += dy * b1m
+            v2[2] += dz * b1m
+        for r, (vx, vy, vz), m in bodies:
+            r[0] += dt * vx
+            r[1] += dt * vy
+            r[2] += dt * vz
+
+
+def bench_fannkuch(n=8):
+    count = list(range(1, n + 1))
+    perm1 = list(range(n))
+    max_flips = 0
+    r = n
+    while True:
+        while r != 1:
+            count[r - 1] = r
+            r -= 1
+        if perm1[0] != 0 and perm1[-1] != n - 1:
+            perm = perm1[:]
+            flips = 0
+            k = perm[0]
+            while k:
+                perm[:k + 1] = perm[k::-1]
+                flips += 1
+                k = perm[0]
+            max_flips = max(max_flips, flips)
+        while r != n:
+            perm1.insert(r, perm1.pop(0))
+            count[r] -= 1
+            if count[r] > 0:
+                break
+            r += 1
+        else:
+            return max_flips
+
+
+class Task(object):
+
+    def __init__(self, name, work):
+        self.name = name
+        self.work = work
+        self.runs = 0
+
+    def run(self, queue):
+        self.runs += 1
+        self.work -= 1
+        if self.work > 0:
+            queue.append(self)
+
+
+def bench_richards(tasks=200, work=100):
+    queue = [Task('task{}'.format(i), work + i % 7) for i in range(tasks)]
+    runs = 0
+    while queue:
+        task = queue.pop(0)
+        task.run(queue)
+        runs += 1
+    return runs
+
+
+def bench_float(points=50000):
+    from math import sin, cos, sqrt
+    values = []
+    for i in range(points):
+        x, y, z = sin(i), cos(i) * 3, (sin(i) * sin(i)) / 2
+        norm = sqrt(x * x + y * y + z * z)
+        values.append((x / norm, y / norm, z / norm))
+    return max(values)
+
+
+def bench_spectral_norm(n=100):
+    def eval_a(i, j):
+        return 1.0 / ((i + j) * (i + j + 1) // 2 + i + 1)
+
+    def times(u, transpose):
+        return [sum((eval_a(j, i) if transpose else eval_a(i, j)) * u_j
+                    for j, u_j in enumerate(u)) for i in range(len(u))]
+
+    u = [1.0] * n
+    for _ in range(5):
+        v = times(times(u, False), True)
+        u = times(times(v, False), True)
+    return sum(u_i * v_i for u_i, v_i in zip(u, v))
+
+
+def bench_json(count=2000):
+    data = {'key': 'value', 'list': list(range(20)), 'nested': {
+        'float': 1.5, 'bool': True, 'none': None, 'text': 'p4a' * 10}}
+    for _ in range(count):
+        json.loads(json.dumps(data))
+
+
+BENCHMARKS = (
+    bench_nbody, bench_fannkuch, bench_richards, bench_float,
+    bench_spectral_norm, bench_json,
+)
+
+
+def write_profile():
+    '''Writes the profile data of an instrumented python, if it is one.'''
+    libpython = 'libpython{}.{}.so'.format(*sys.version_info[:2])
+    for library in (None, libpython):
+        try:
+            library = ctypes.CDLL(library)
+            set_filename = library.__llvm_profile_set_filename
+            write_file = library.__llvm_profile_write_file
+            break
+        except (OSError, AttributeError):
+            continue
+    else:
+        return
+    filename = os.path.abspath('python-{}.profraw'.format(os.getpid()))
+    set_filename(filename.encode('utf-8'))
+    if write_file() == 0:
+        print('profile data written to', filename)
+
+
+def main():
+    total = 0
+    for benchmark in BENCHMARKS:
+        timings = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            benchmark()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        total += best
+        print('{}: {:.1f} ms'.format(benchmark.__name__[6:], best * 1000))
+    print('total: {:.1f} ms'.format(total * 1000))
+    write_profile()
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,53 @@ class TestHostPython3Recipe(RecipeCtx, unittest.TestCase):
             join(self.recipe.get_path_to_python(), 'python3')
         )
 
+    def test_configure_args(self):
+        self.assertEqual(self.recipe.configure_args, ())
+        stamp = self.recipe.get_artifact_key(self.arch)
+        self.recipe.ctx.optimize_python = True
+        self.addCleanup(setattr, self.recipe.ctx, 'optimize_python', False)
+        self.assertEqual(self.recipe.configure_args,
+                         ('--enable-optimizations', '--with-lto'))
+        self.assertNotEqual(self.recipe.get_artifact_key(self.arch), stamp)
+
+    def test_get_host_cache_key(self):
+        key = self.recipe.get_host_cache_key()
+        self.assertEqual(self.recipe.get_host_cache_key(), key)
+        with mock.patch(
+            "pythonforandroid.recipes.hostpython3.subprocess.check_output",
+            return_value=b"clang version 0",
+        ):
+            self.assertNotEqual(self.recipe.get_host_cache_key(), key)
+        self.recipe.ctx.optimize_python = True
+        self.addCleanup(setattr, self.recipe.ctx, 'optimize_python', False)
+        self.assertNotEqual(self.recipe.get_host_cache_key(), key)
+
+    def test_prepare_build_dir_from_cache(self):
+        """
+        The build dir is cloned from the hostpython cache when it holds a
+        hostpython built with the same key, and unpacked otherwise.
+        """
+        cache = mock.Mock()
+        with mock.patch(
+            "pythonforandroid.build.Context.hostpython_cache",
+            new_callable=mock.PropertyMock,
+            return_value=cache,
+        ), mock.patch(
+            "pythonforandroid.recipes.hostpython3.Recipe.prepare_build_dir"
+        ) as mock_prepare_build_dir:
+            cache.lookup.return_value = None
+            self.recipe.prepare_build_dir(self.arch.arch)
+            mock_prepare_build_dir.assert_called_once_with(self.arch.arch)
+            cache.restore.assert_not_called()
+
+            mock_prepare_build_dir.reset_mock()
+            cache.lookup.return_value = '/cache/key'
+            self.recipe.prepare_build_dir(self.arch.arch)
+            mock_prepare_build_dir.assert_not_called()
+            cache.lookup.assert_called_with(self.recipe.get_host_cache_key())
+        cache.restore.assert_called_once_with(
+            '/cache/key', self.recipe.get_build_dir(), ('native-build',))
+
     @mock.patch("pythonforandroid.recipes.hostpython3.Path.exists")
     def test_should_build(self, mock_exists):
         # test case for existing python exe which shouldn't trigger the build
@@ -1,5 +1,8 @@
+import os
+import sys
 import unittest
 
+from backports import tempfile
 from os.path import join
 from unittest import mock
 
@@ -9,6 +12,23 @@ from pythonforandroid.recipes.python3 import (
 from pythonforandroid.util import BuildInterruptingException
 from tests.recipes.recipe_lib_test import RecipeCtx
 
+FROZEN_C = """#include "Python.h"
+#include "importlib.h"
+
+static unsigned char M___hello__[] = {
+    227,0,0,0,
+};
+
+static const struct _frozen _PyImport_FrozenModules[] = {
+    {"_frozen_importlib", _Py_M__importlib_bootstrap,
+        (int)sizeof(_Py_M__importlib_bootstrap)},
+    {"__hello__", M___hello__, (int)sizeof(M___hello__)},
+    {0, 0, 0} /* sentinel */
+};
+
+const struct _frozen *PyImport_FrozenModules = _PyImport_FrozenModules;
+"""
+
 
 class TestPython3Recipe(RecipeCtx, unittest.TestCase):
     """
@@ -52,7 +72,10 @@ class TestPython3Recipe(RecipeCtx, unittest.TestCase):
         hostpy = self.recipe.ctx.hostpython = '/fake/hostpython3'
         self.recipe.compile_python_files(fake_compile_dir)
         mock_subprocess.assert_called_once_with(
-            [hostpy, '-OO', '-m', 'compileall', '-b', '-f', fake_compile_dir],
+            [hostpy, '-OO',
+             join(self.ctx.root_dir, 'bootstraps', 'common', 'build',
+                  'compile_pyfiles.py'),
+             fake_compile_dir],
         )
 
     @mock.patch("pythonforandroid.recipe.Recipe.check_recipe_choices")
@@ -83,6 +106,102 @@ class TestPython3Recipe(RecipeCtx, unittest.TestCase):
         mock_glob.assert_called()
         mock_check_recipe_choices.assert_called()
 
+    @mock.patch("pythonforandroid.recipe.Recipe.check_recipe_choices")
+    @mock.patch("pythonforandroid.archs.glob")
+    def test_get_recipe_env_optimize(
+        self,
+        mock_glob,
+        mock_check_recipe_choices,
+    ):
+        """
+        Test that with the optimizations on, the flags of the interpreter
+        build are passed as ``*_NODIST`` and the build stamp changes with
+        the profile data.
+        """
+        mock_glob.return_value = ["llvm"]
+        mock_check_recipe_choices.return_value = sorted(
+            self.ctx.recipe_build_order
+        )
+        default_stamp = self.recipe.get_build_stamp(self.arch)
+        self.assertEqual(self.recipe.get_optimization_key(self.arch), '')
+        self.addCleanup(setattr, self.recipe.ctx, 'optimize_python', False)
+        self.addCleanup(setattr, self.recipe.ctx, 'python_pgo_dir', None)
+
+        with tempfile.TemporaryDirectory() as pgo_dir:
+            self.recipe.ctx.optimize_python = True
+            self.recipe.ctx.python_pgo_dir = pgo_dir
+            env = self.recipe.get_recipe_env(self.arch)
+            self.assertEqual(
+                env['CFLAGS_NODIST'],
+                '-fno-semantic-interposition -fprofile-generate')
+            self.assertEqual(env['LDFLAGS_NODIST'], env['CFLAGS_NODIST'])
+            self.assertTrue(env['AR'].endswith('llvm-ar'))
+            self.assertNotIn('-fno-semantic-interposition', env['CFLAGS'])
+            instrumented_stamp = self.recipe.get_build_stamp(self.arch)
+
+            os.makedirs(join(pgo_dir, self.arch.arch))
+            with open(join(pgo_dir, self.arch.arch, 'a.profraw'), 'wb') as f:
+                f.write(b'profile')
+            env = self.recipe.get_recipe_env(self.arch)
+            self.assertIn(
+                '-fprofile-use=' + self.recipe.get_pgo_profdata(self.arch),
+                env['CFLAGS_NODIST'])
+            optimized_stamp = self.recipe.get_build_stamp(self.arch)
+
+        self.assertEqual(
+            len({default_stamp, instrumented_stamp, optimized_stamp}), 3)
+
+    def test_freeze_stdlib(self):
+        """
+        Test that method
+        :meth:`~pythonforandroid.recipes.python3.Python3Recipe.freeze_stdlib`
+        writes a ``frozen.c`` adding the frozen modules to the table of the
+        sources, and their marshalled code.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir, mock.patch.object(
+                self.recipe, 'get_build_dir', return_value=temp_dir):
+            os.makedirs(join(temp_dir, 'Python'))
+            with open(join(temp_dir, 'Python', 'frozen.c'), 'w') as fileh:
+                fileh.write(FROZEN_C)
+            open(join(temp_dir, 'Python', 'importlib.h'), 'w').close()
+            lib_dir = join(temp_dir, 'Lib')
+            os.makedirs(join(lib_dir, 'encodings'))
+            for filename in ('encodings/__init__.py', 'encodings/utf_8.py',
+                             'os.py'):
+                with open(join(lib_dir, filename), 'w') as fileh:
+                    fileh.write('value = 1\n')
+            self.recipe.frozen_modules = ('encodings', 'encodings.utf_8', 'os')
+            self.addCleanup(delattr, self.recipe, 'frozen_modules')
+            self.recipe.ctx.hostpython = sys.executable
+
+            build_dir = join(temp_dir, 'android-build')
+            self.recipe.freeze_stdlib(self.arch, build_dir)
+
+            with open(join(build_dir, 'Python', 'frozen.c')) as fileh:
+                frozen_c = fileh.read()
+            with open(join(build_dir, 'Python',
+                           'p4a_frozen_modules.h')) as fileh:
+                header = fileh.read()
+        self.assertIn('#include "{}"'.format(
+            join(temp_dir, 'Python', 'importlib.h')), frozen_c)
+        self.assertIn('#include "Python.h"', frozen_c)
+        self.assertIn('#include "p4a_frozen_modules.h"\n\nstatic const '
+                      'struct _frozen _PyImport_FrozenModules[]', frozen_c)
+        self.assertIn('    P4A_FROZEN_MODULES\n    {0, 0, 0}', frozen_c)
+        self.assertIn('{"encodings", _P4A_M__encodings, '
+                      '-(int)sizeof(_P4A_M__encodings)}', header)
+        self.assertIn('{"encodings.utf_8", _P4A_M__encodings__utf_8, '
+                      '(int)sizeof(_P4A_M__encodings__utf_8)}', header)
+
+    def test_freeze_stdlib_unsupported(self):
+        with tempfile.TemporaryDirectory() as temp_dir, mock.patch.object(
+                self.recipe, 'get_build_dir', return_value=temp_dir):
+            os.makedirs(join(temp_dir, 'Python'))
+            with open(join(temp_dir, 'Python', 'frozen.c'), 'w') as fileh:
+                fileh.write('/* frozen modules */\n')
+            with self.assertRaises(BuildInterruptingException):
+                self.recipe.freeze_stdlib(self.arch, temp_dir)
+
     def test_set_libs_flags(self):
         # todo: properly check `Python3Recipe.set_lib_flags`
         pass
@@ -196,8 +315,10 @@ class TestPython3Recipe(RecipeCtx, unittest.TestCase):
             join(recipe_build_dir, 'Lib'),
             self.ctx.get_python_install_dir(),
         ]
-        for n, (sp_call, kw) in enumerate(mock_subprocess.call_args_list):
-            self.assertEqual(sp_call[0][-1], expected_sp_paths[n])
+        # all the paths are compiled by a single call
+        mock_subprocess.assert_called_once()
+        sp_call, kw = mock_subprocess.call_args
+        self.assertEqual(sp_call[0][-3:], expected_sp_paths)
 
         # we expect two calls to `walk_valid_filens`
         self.assertEqual(len(mock_walk.call_args_list), 2)
@@ -0,0 +1,129 @@
+import io
+import os
+import stat
+import tarfile
+import unittest
+from unittest import mock
+import zipfile
+
+import pytest
+from backports import tempfile
+
+from pythonforandroid.archive import extract_archive
+
+
+MEMBERS = {
+    'package-1.0/setup.py': b'print("setup")\n',
+    'package-1.0/configure': b'#!/bin/sh\n',
+    'package-1.0/src/module.c': b'int main() {}\n',
+}
+
+
+def make_tar(filename, mode, prefix=''):
+    with tarfile.open(filename, mode) as tar:
+        for name, data in sorted(MEMBERS.items()):
+            member = tarfile.TarInfo(prefix + name)
+            member.size = len(data)
+            member.mode = 0o755 if name.endswith('configure') else 0o644
+            tar.addfile(member, io.BytesIO(data))
+        link = tarfile.TarInfo(prefix + 'package-1.0/link.c')
+        link.type = tarfile.SYMTYPE
+        link.linkname = 'src/module.c'
+        tar.addfile(link)
+
+
+def make_zip(filename):
+    with zipfile.ZipFile(filename, 'w') as zip_file:
+        zip_file.writestr('package-1.0/', b'')
+        for name, data in sorted(MEMBERS.items()):
+            member = zipfile.ZipInfo(name)
+            mode = 0o755 if name.endswith('configure') else 0o644
+            member.external_attr = (stat.S_IFREG | mode) << 16
+            zip_file.writestr(member, data)
+        link = zipfile.ZipInfo('package-1.0/link.c')
+        link.external_attr = (stat.S_IFLNK | 0o777) << 16
+        zip_file.writestr(link, b'src/module.c')
+
+
+class TestExtractArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.target = os.path.join(self.root, 'build')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def check_extracted(self, directory):
+        for name, data in MEMBERS.items():
+            path = os.path.join(directory, name.split('/', 1)[1])
+            with open(path, 'rb') as fileh:
+                assert fileh.read() == data
+        assert os.access(os.path.join(directory, 'configure'), os.X_OK)
+        assert not os.access(os.path.join(directory, 'setup.py'), os.X_OK)
+        assert os.readlink(os.path.join(directory, 'link.c')) == 'src/module.c'
+
+    def test_extract_archive(self):
+        for extension, mode in (('.tar.gz', 'w:gz'), ('.tbz2', 'w:bz2'),
+                                ('.tar.xz', 'w:xz')):
+            filename = os.path.join(self.root, 'package-1.0' + extension)
+            make_tar(filename, mode)
+            target = self.target + extension
+            assert extract_archive(filename, target) == 'package-1.0'
+            self.check_extracted(os.path.join(target, 'package-1.0'))
+
+    def test_extract_archive_zip(self):
+        filename = os.path.join(self.root, 'package-1.0.zip')
+        make_zip(filename)
+        assert extract_archive(filename, self.target) == 'package-1.0'
+        self.check_extracted(os.path.join(self.target, 'package-1.0'))
+
+    def test_extract_archive_root_name(self):
+        """
+        The top directory is renamed while extracting, a leading `./` in the
+        member names is ignored.
+        """
+        filename = os.path.join(self.root, 'package-1.0.tar.gz')
+        make_tar(filename, 'w:gz', prefix='./')
+        assert extract_archive(filename, self.target, 'package') == 'package-1.0'
+        assert os.listdir(self.target) == ['package']
+        self.check_extracted(os.path.join(self.target, 'package'))
+
+        filename = os.path.join(self.root, 'package-1.0.zip')
+        make_zip(filename)
+        target = os.path.join(self.root, 'build-zip')
+        assert extract_archive(filename, target, 'package') == 'package-1.0'
+        assert os.listdir(target) == ['package']
+        self.check_extracted(os.path.join(target, 'package'))
+
+    def test_extract_archive_errors(self):
+        with pytest.raises(ValueError):
+            extract_archive(os.path.join(self.root, 'package.rar'), self.target)
+        filename = os.path.join(self.root, 'evil.zip')
+        with zipfile.ZipFile(filename, 'w') as zip_file:
+            zip_file.writestr('../evil.txt', b'evil')
+        with pytest.raises(ValueError):
+            extract_archive(filename, self.target)
+        assert not os.path.exists(os.path.join(self.root, 'evil.txt'))
+
+    def test_extract_archive_interrupted(self):
+        """
+        A failed extraction leaves nothing behind, and a new one replaces
+        the previous tree.
+        """
+        filename = os.path.join(self.root, 'package-1.0.zip')
+        make_zip(filename)
+        with mock.patch('pythonforandroid.archive.shutil.copyfileobj',
+                        side_effect=OSError('No space left on device')):
+            with pytest.raises(OSError):
+                extract_archive(filename, self.target, 'package')
+        assert os.listdir(self.root) == ['package-1.0.zip']
+
+        stale_file = os.path.join(self.target, 'package', 'stale.c')
+        os.makedirs(os.path.dirname(stale_file))
+        open(stale_file, 'w').close()
+        extract_archive(filename, self.target, 'package')
+        assert not os.path.exists(stale_file)
+        self.check_extracted(os.path.join(self.target, 'package'))
+        assert sorted(os.listdir(self.root)) == ['build', 'package-1.0.zip']
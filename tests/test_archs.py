@@ -91,6 +91,35 @@ class TestArch(ArchSetUpBaseClass, unittest.TestCase):
         self.assertIsNone(arch.command_prefix)
         self.assertIsInstance(arch.include_dirs, list)
 
+    @mock.patch("pythonforandroid.archs.glob")
+    @mock.patch("pythonforandroid.archs.find_executable")
+    @mock.patch("pythonforandroid.build.ensure_dir")
+    def test_get_env_cache(
+            self, mock_ensure_dir, mock_find_executable, mock_glob):
+        """
+        The environments are built once for the same state, the `PATH` isn't
+        extended by each call and the callers get their own copy.
+        """
+        mock_find_executable.return_value = self.expected_compiler
+        mock_glob.return_value = ["llvm"]
+        arch = ArchARMv7_a(self.ctx)
+
+        env = arch.get_env()
+        path = environ["PATH"]
+        env["CFLAGS"] = "modified"
+        self.assertNotEqual(arch.get_env()["CFLAGS"], "modified")
+        self.assertEqual(environ["PATH"], path)
+        self.assertEqual(mock_find_executable.call_count, 1)
+
+        arch.get_env(with_flags_in_cc=False)
+        arch.extra_global_link_paths.append("/opt/libs")
+        self.assertIn("/opt/libs", arch.get_env()["LDFLAGS"])
+        self.assertEqual(mock_find_executable.call_count, 3)
+
+        arch.clear_env_cache()
+        arch.get_env()
+        self.assertEqual(mock_find_executable.call_count, 4)
+
 
 class TestArchARM(ArchSetUpBaseClass, unittest.TestCase):
     """
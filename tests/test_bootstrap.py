@@ -516,7 +516,8 @@ class GenericBootstrapTest(BaseClassSetupBootstrap):
         mock_bs_dir.assert_has_calls([mock.call("libs"), mock.call(libs_dir)])
         mock_glob.assert_called()
 
-    @mock.patch("pythonforandroid.bootstrap.shprint")
+    @mock.patch("pythonforandroid.bootstrap.strip_files")
+    @mock.patch("pythonforandroid.bootstrap.find_libraries")
     @mock.patch("pythonforandroid.bootstrap.sh.Command")
     @mock.patch("pythonforandroid.build.ensure_dir")
     @mock.patch("pythonforandroid.archs.glob")
@@ -527,7 +528,8 @@ class GenericBootstrapTest(BaseClassSetupBootstrap):
         mock_glob,
         mock_ensure_dir,
         mock_sh_command,
-        mock_sh_print,
+        mock_find_libraries,
+        mock_strip_files,
     ):
         mock_find_executable.return_value = os.path.join(
             self.ctx._ndk_dir,
@@ -551,9 +553,22 @@ class GenericBootstrapTest(BaseClassSetupBootstrap):
             mock_find_executable.return_value,
         )
         mock_sh_command.assert_called_once_with("arm-linux-androideabi-strip")
+        mock_find_libraries.assert_called_once_with(
+            os.path.join(bs.dist_dir, "_python_bundle", "_python_bundle",
+                         "modules"),
+            os.path.join(bs.dist_dir, "libs"),
+        )
+        mock_strip_files.assert_called_once_with(
+            mock_find_libraries.return_value,
+            mock_sh_command.return_value.bake.return_value,
+            mock.ANY,
+            jobs=mock.ANY,
+            objcopy=None,
+            debug_dir=None,
+            root_dir=bs.dist_dir,
+        )
         # check that the other mocks we made are actually called
         mock_ensure_dir.assert_called()
-        mock_sh_print.assert_called()
 
     @mock.patch("pythonforandroid.bootstrap.listdir")
     @mock.patch("pythonforandroid.bootstrap.sh.rm")
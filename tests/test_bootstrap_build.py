@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import unittest
+from unittest import mock
+
+from backports import tempfile
+
+from pythonforandroid.util import load_source
+
+DIST_INFO = {
+    'hostpython': None,
+    'python_version': '3.8',
+    'bootstrap': 'sdl2',
+}
+
+
+def load_build():
+    # the script reads the dist_info.json of its dist when imported
+    with mock.patch('builtins.open', mock.mock_open(
+            read_data=json.dumps(DIST_INFO))):
+        return load_source(
+            'build', os.path.join(os.path.dirname(__file__), os.pardir,
+                                  'pythonforandroid', 'bootstraps', 'common',
+                                  'build', 'build.py'))
+
+
+build = load_build()
+
+
+class TestParallelGzipFile(unittest.TestCase):
+
+    @mock.patch.object(build.ParallelGzipFile, 'block_size', 64 * 1024)
+    def test_round_trip(self):
+        """
+        The blocks deflated by several threads make a single gzip member,
+        which decompresses to the data written.
+        """
+        data = b''.join(str(i).encode() * (i % 7) for i in range(100000))
+        with tempfile.TemporaryDirectory() as root:
+            filename = os.path.join(root, 'data.gz')
+            gzip_file = build.ParallelGzipFile(filename, threads=4)
+            for start in range(0, len(data), 10000):
+                gzip_file.write(data[start:start + 10000])
+            gzip_file.close()
+            with gzip.open(filename) as fileh:
+                assert fileh.read() == data
+            if shutil.which('gzip') is not None:
+                subprocess.check_call(['gzip', '-t', filename])
+
+
+class TestMakeTar(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.source_dir = os.path.join(self.root, 'private')
+        self.tfn = os.path.join(self.root, 'private.tar')
+        self.digest_file = os.path.join(self.root, 'private.digest')
+        for name in ('main.py', 'lib/b.py', 'lib/a.py'):
+            self.write(name, name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, data):
+        filename = os.path.join(self.source_dir, name)
+        build.ensure_dir(os.path.dirname(filename))
+        with open(filename, 'w') as fileh:
+            fileh.write(data)
+        return filename
+
+    def make_tar(self):
+        with mock.patch('builtins.print'):
+            return build.make_tar(self.tfn, [self.source_dir],
+                                  digest_file=self.digest_file)
+
+    def read_tar(self):
+        with tarfile.open(self.tfn) as tar:
+            return {member.name: tar.extractfile(member).read().decode()
+                    for member in tar.getmembers() if member.isreg()}
+
+    def test_make_tar_unchanged(self):
+        """
+        The archive of an unchanged tree is kept, and the files touched
+        since are stored in the digest file, not to be hashed again.
+        """
+        digest = self.make_tar()
+        tar_mtime = os.stat(self.tfn).st_mtime_ns
+        filename = os.path.join(self.source_dir, 'main.py')
+        mtime = os.stat(filename).st_mtime_ns + 10 ** 9
+        os.utime(filename, ns=(mtime, mtime))
+        with mock.patch.object(build, 'ParallelGzipFile') as mock_gzip_file:
+            assert self.make_tar() == digest
+        mock_gzip_file.assert_not_called()
+        assert os.stat(self.tfn).st_mtime_ns == tar_mtime
+        cached = build.read_json(self.digest_file)['files'][filename]
+        assert cached[1] == mtime
+
+    def test_make_tar_changed(self):
+        digest = self.make_tar()
+        self.write('lib/a.py', 'changed')
+        assert self.make_tar() != digest
+        assert self.read_tar() == {
+            'main.py': 'main.py', 'lib/b.py': 'lib/b.py', 'lib/a.py': 'changed'}
+        assert build.read_json(self.digest_file)['digest'] != digest
+
+    def test_make_tar_sorted(self):
+        """
+        The files of a dir are added in sorted order before its subdirs,
+        so the same files always make the same archive.
+        """
+        digest = self.make_tar()
+        with tarfile.open(self.tfn) as tar:
+            assert tar.getnames() == ['main.py', 'lib', 'lib/a.py', 'lib/b.py']
+        with open(self.tfn, 'rb') as fileh:
+            data = fileh.read()
+        os.remove(self.digest_file)
+        assert self.make_tar() == digest
+        with open(self.tfn, 'rb') as fileh:
+            assert fileh.read() == data
+
+    def test_make_tar_manifest(self):
+        """
+        The manifest has the sha256 of every file of the archive, for the
+        device to only extract those changed.
+        """
+        manifest_file = os.path.join(self.root, 'private.manifest')
+        with mock.patch('builtins.print'):
+            build.make_tar(self.tfn, [self.source_dir],
+                           digest_file=self.digest_file,
+                           manifest_file=manifest_file)
+        with open(manifest_file) as fileh:
+            manifest = dict(reversed(line.split(' ', 1))
+                            for line in fileh.read().splitlines())
+        assert manifest == {
+            name: hashlib.sha256(data.encode()).hexdigest()
+            for name, data in self.read_tar().items()}
+
+
+class TestStageAsset(unittest.TestCase):
+
+    def test_remove_unstaged(self):
+        """
+        The assets of a previous build missing from this one are removed,
+        with the dirs left empty, and the others are kept.
+        """
+        with tempfile.TemporaryDirectory() as root:
+            assets_dir = os.path.join(root, 'assets')
+            for name in ('kept/a.txt', 'stale/b.txt', 'c.txt'):
+                filename = os.path.join(root, 'src', name)
+                build.ensure_dir(os.path.dirname(filename))
+                with open(filename, 'w') as fileh:
+                    fileh.write(name)
+            staged = set()
+            build.stage_asset(os.path.join(root, 'src'), assets_dir, staged)
+            build.remove_unstaged(assets_dir, staged)
+
+            staged = set()
+            build.stage_asset(os.path.join(root, 'src', 'kept'),
+                              os.path.join(assets_dir, 'kept'), staged)
+            build.stage_asset(os.path.join(root, 'src', 'c.txt'),
+                              os.path.join(assets_dir, 'c.txt'), staged)
+            build.remove_unstaged(assets_dir, staged)
+            assert sorted(os.listdir(assets_dir)) == ['c.txt', 'kept']
+            assert os.listdir(os.path.join(assets_dir, 'kept')) == ['a.txt']
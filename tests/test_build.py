@@ -1,7 +1,18 @@
+import os
+import shutil
 import unittest
 from unittest import mock
 
-from pythonforandroid.build import run_pymodules_install
+from backports import tempfile
+
+from pythonforandroid.build import (
+    Context, ToolchainProbe, biglink_function, build_recipe, copylibs_function,
+    get_dir_key, get_path_key, get_recipe_build_graph,
+    restore_prebuilt_recipe, run_pymodules_install, store_prebuilt_recipe,
+    unique_link_args, write_response_file)
+from pythonforandroid.elf import DependencyIndex
+from pythonforandroid.prebuilt import PrebuiltCache
+from tests.test_elf import make_elf
 
 
 class TestBuildBasic(unittest.TestCase):
@@ -19,6 +30,22 @@ class TestBuildBasic(unittest.TestCase):
         assert m_info.call_args_list[-1] == mock.call(
             'No Python modules and no setup.py to process, skipping')
 
+    @mock.patch('pythonforandroid.build.atexit.register')
+    @mock.patch('pythonforandroid.build.start_jobserver')
+    def test_start_jobserver(self, mock_start_jobserver, mock_register):
+        """
+        The jobserver dir, which goes in the `PATH`, is the same for every
+        build of a storage dir, so that it does not change the build stamps.
+        """
+        ctx = Context()
+        ctx.build_dir = '/storage/build'
+        ctx.start_jobserver()
+        ctx.start_jobserver()
+        mock_start_jobserver.assert_called_once_with(
+            ctx, '/storage/build/jobserver')
+        mock_register.assert_called_once_with(
+            mock_start_jobserver.return_value.close)
+
     def test_strip_if_with_debug_symbols(self):
         ctx = mock.Mock()
         ctx.python_recipe.major_minor_version_string = "python3.6"
@@ -48,3 +75,332 @@ class TestBuildBasic(unittest.TestCase):
             ctx.with_debug_symbols = False
             assert run_pymodules_install(ctx, modules, project_dir) is None
             assert m_CythonRecipe().strip_object_files.called is True
+
+
+class TestRecipeBuildGraph(unittest.TestCase):
+
+    def get_fake_recipe(self, name, depends=(), opt_depends=(),
+                        shared_build_dir=False):
+        recipe = mock.Mock(spec=['name', 'depends', 'opt_depends',
+                                 'get_build_dir'])
+        recipe.name = name
+        recipe.depends = list(depends)
+        recipe.opt_depends = list(opt_depends)
+        if shared_build_dir:
+            recipe.get_build_dir.side_effect = lambda arch: name
+        else:
+            recipe.get_build_dir.side_effect = lambda arch: name + arch
+        return recipe
+
+    def test_get_recipe_build_graph(self):
+        archs = [mock.Mock(arch='armeabi-v7a'), mock.Mock(arch='arm64-v8a')]
+        recipes = [
+            self.get_fake_recipe('hostpython3', shared_build_dir=True),
+            self.get_fake_recipe('openssl'),
+            self.get_fake_recipe('libffi'),
+            self.get_fake_recipe(
+                'python3', depends=['hostpython3', 'openssl', 'libffi'],
+                opt_depends=['libbz2']),
+            self.get_fake_recipe(
+                'pyjnius', depends=[('python3', 'python2'), 'six']),
+        ]
+        graph = get_recipe_build_graph(recipes, archs)
+        self.assertEqual(len(graph), 10)
+        self.assertEqual(graph[('openssl', 'arm64-v8a')], set())
+        self.assertEqual(graph[('hostpython3', 'arm64-v8a')],
+                         {('hostpython3', 'armeabi-v7a')})
+        self.assertEqual(graph[('python3', 'armeabi-v7a')], {
+            ('hostpython3', 'armeabi-v7a'),
+            ('openssl', 'armeabi-v7a'),
+            ('libffi', 'armeabi-v7a'),
+        })
+        self.assertEqual(graph[('pyjnius', 'arm64-v8a')],
+                         {('python3', 'arm64-v8a')})
+
+
+class TestBuildRecipe(unittest.TestCase):
+
+    def get_fake_recipe(self, should_build, stored_stamp):
+        recipe = mock.Mock()
+        recipe.name = 'fake'
+        recipe.ctx.prebuilt_cache = None
+        recipe.should_build.return_value = should_build
+        recipe.get_build_stamp.return_value = 'new-stamp'
+        recipe.read_stamp.return_value = stored_stamp
+        return recipe
+
+    def test_build_recipe(self):
+        """
+        A recipe is rebuilt if it says so or if its build stamp changed, an
+        unknown stamp (e.g. first build with stamps) defers to the recipe.
+        """
+        arch = mock.Mock()
+        for should_build, stored_stamp, built in (
+                (True, 'new-stamp', True),
+                (False, 'old-stamp', True),
+                (False, 'new-stamp', False),
+                (False, None, False)):
+            recipe = self.get_fake_recipe(should_build, stored_stamp)
+            with mock.patch('pythonforandroid.build.info'):
+                build_recipe(recipe, arch)
+            assert recipe.build_arch.called == built
+            assert recipe.install_libraries.call_args_list == [mock.call(arch)]
+            assert recipe.write_stamp.call_args_list == [
+                mock.call(arch, 'build', 'new-stamp')]
+
+    def test_build_recipe_restored(self):
+        """
+        A recipe just restored from the prebuilt cache is not built, even
+        if it says it should be, and the stamp of the restore is removed.
+        """
+        arch = mock.Mock()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            prebuilt_stamp = os.path.join(temp_dir, 'fake.prebuilt')
+            with open(prebuilt_stamp, 'w') as fileh:
+                fileh.write('key')
+            recipe = self.get_fake_recipe(True, None)
+            recipe.ctx.prebuilt_cache = mock.Mock()
+            recipe.prebuilt_cacheable = True
+            recipe.get_artifact_key.return_value = 'key'
+            recipe.get_stamp_filename.return_value = prebuilt_stamp
+            recipe.read_stamp.side_effect = lambda arch, kind: {
+                'prebuilt': 'key'}.get(kind)
+            with mock.patch('pythonforandroid.build.info'):
+                build_recipe(recipe, arch)
+            assert not recipe.build_arch.called
+            assert recipe.install_libraries.call_args_list == [mock.call(arch)]
+            assert recipe.write_stamp.call_args_list == [
+                mock.call(arch, 'build', 'new-stamp')]
+            assert not os.path.exists(prebuilt_stamp)
+
+
+class TestPrebuiltRecipe(unittest.TestCase):
+
+    def get_fake_recipe(self, storage_dir):
+        ctx = mock.Mock(storage_dir=storage_dir)
+        ctx.build_dir = os.path.join(storage_dir, 'build')
+        ctx.get_libs_dir.return_value = os.path.join(storage_dir, 'libs')
+        ctx.get_python_install_dir.return_value = os.path.join(
+            storage_dir, 'python')
+        for directory in ('build', 'libs', 'python'):
+            os.makedirs(os.path.join(storage_dir, directory))
+        ctx.prebuilt_cache = self.cache
+        recipe = mock.Mock(ctx=ctx, prebuilt_cacheable=True)
+        recipe.name = 'fake'
+        recipe.get_build_dir.return_value = os.path.join(
+            ctx.build_dir, 'other_builds', 'fake', 'arm64-v8a', 'fake')
+        recipe.get_build_container_dir.return_value = os.path.join(
+            ctx.build_dir, 'other_builds', 'fake', 'arm64-v8a')
+        recipe.get_stamp_arch.side_effect = lambda arch: arch
+        recipe.get_artifact_key.return_value = 'key'
+        recipe.get_stamp_filename.return_value = os.path.join(
+            ctx.build_dir, 'fake.build')
+        return recipe
+
+    def test_store_restore_prebuilt_recipe(self):
+        """
+        The outputs of a build are stored in the prebuilt cache, and
+        restored in another storage dir instead of building again.
+        """
+        arch = mock.Mock(arch='arm64-v8a')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.cache = PrebuiltCache(os.path.join(temp_dir, 'cache'))
+            recipe = self.get_fake_recipe(os.path.join(temp_dir, 'first'))
+            with open(os.path.join(recipe.ctx.get_libs_dir(), 'libold.so'),
+                      'w'):
+                pass
+            with store_prebuilt_recipe(recipe, arch):
+                build_dir = recipe.get_build_dir()
+                os.makedirs(build_dir)
+                with open(os.path.join(build_dir, 'fake.h'), 'w'):
+                    pass
+                with open(os.path.join(build_dir, 'libfake.so'), 'w') as fileh:
+                    fileh.write('fake')
+                shutil.copy(os.path.join(build_dir, 'libfake.so'),
+                            recipe.ctx.get_libs_dir())
+                # installed by a build running at the same time
+                with open(os.path.join(recipe.ctx.get_libs_dir(),
+                                       'libother.so'), 'w'):
+                    pass
+            assert self.cache.lookup('fake', 'arm64-v8a', 'key')
+
+            recipe = self.get_fake_recipe(os.path.join(temp_dir, 'second'))
+            with mock.patch('pythonforandroid.build.info_main'):
+                assert restore_prebuilt_recipe(recipe, arch)
+            assert os.path.isfile(
+                os.path.join(recipe.get_build_dir(), 'fake.h'))
+            assert os.listdir(recipe.ctx.get_libs_dir()) == ['libfake.so']
+            assert recipe.write_stamp.call_args_list == [
+                mock.call(arch, 'prebuilt', 'key')]
+
+            recipe.get_artifact_key.return_value = 'other-key'
+            assert not restore_prebuilt_recipe(recipe, arch)
+
+
+class TestToolchainProbe(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.sdk_dir = os.path.join(self.temp_dir.name, 'sdk')
+        os.makedirs(os.path.join(self.sdk_dir, 'platforms'))
+        self.filename = os.path.join(self.temp_dir.name, 'probe.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get(self):
+        """
+        The probe results are stored, and probed again once the directory
+        they were probed from changes or the probe is cleared.
+        """
+        probe = mock.Mock(return_value=[27, 28])
+        key = get_dir_key(self.sdk_dir, 'platforms')
+        assert ToolchainProbe(self.filename).get('apis', key, probe) == [
+            27, 28]
+        assert ToolchainProbe(self.filename).get('apis', key, probe) == [
+            27, 28]
+        assert probe.call_count == 1
+
+        os.makedirs(os.path.join(self.sdk_dir, 'platforms', 'android-29'))
+        key = get_dir_key(self.sdk_dir, 'platforms')
+        ToolchainProbe(self.filename).get('apis', key, probe)
+        assert probe.call_count == 2
+
+        toolchain_probe = ToolchainProbe(self.filename)
+        toolchain_probe.clear()
+        assert not os.path.exists(self.filename)
+        ToolchainProbe(self.filename).get('apis', key, probe)
+        assert probe.call_count == 3
+
+    def test_get_path_key(self):
+        """
+        The executables are probed again once a dir of the PATH changes.
+        """
+        bin_dir = os.path.join(self.temp_dir.name, 'bin')
+        os.makedirs(bin_dir)
+        path = os.pathsep.join([bin_dir, os.path.join(bin_dir, 'missing')])
+        probe = mock.Mock(return_value=None)
+        key = get_path_key(path)
+        assert key[0] == path and key[2] is None
+        ToolchainProbe(self.filename).get('ccache', key, probe)
+        ToolchainProbe(self.filename).get('ccache', get_path_key(path), probe)
+        assert probe.call_count == 1
+
+        open(os.path.join(bin_dir, 'ccache'), 'w').close()
+        os.utime(bin_dir, ns=(0, 0))
+        ToolchainProbe(self.filename).get('ccache', get_path_key(path), probe)
+        assert probe.call_count == 2
+
+    def test_get_missing_dir(self):
+        key = get_dir_key(os.path.join(self.temp_dir.name, 'missing'))
+        assert key is None
+        probe = mock.Mock(return_value=[])
+        ToolchainProbe(self.filename).get('apis', key, probe)
+        ToolchainProbe(self.filename).get('apis', key, probe)
+        assert probe.call_count == 2
+        assert not os.path.exists(self.filename)
+
+
+class TestBiglink(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_unique_link_args(self):
+        assert unique_link_args(
+            ['a.o', '-lfoo', 'b.o', '', '-lfoo', '-L', '-lm', 'a.o']) == [
+                'b.o', '-lfoo', '-lm', 'a.o']
+
+    @mock.patch('pythonforandroid.build.sh.Command')
+    @mock.patch('pythonforandroid.build.shprint')
+    def test_biglink_function(self, mock_shprint, mock_sh_command):
+        """
+        The objects are linked from their dirs, with the arguments in a
+        response file.
+        """
+        objs_paths = []
+        for name in ('foo', 'bar'):
+            objs_path = os.path.join(self.root, 'objects_' + name)
+            os.makedirs(objs_path)
+            objs_paths.append(objs_path)
+            with open(os.path.join(objs_path, name + '.so.o'), 'w'):
+                pass
+            with open(os.path.join(objs_path, name + '.so.libs'), 'w') as f:
+                f.write('-L/python/lib -lpython3.8 -lm')
+        response_files = []
+        mock_shprint.side_effect = lambda *args, **kwargs: (
+            response_files.append(open(args[-1][1:]).read()))
+        soname = os.path.join(self.root, 'libpymodules.so')
+
+        biglink_function(soname, objs_paths, extra_link_dirs=['/libs'],
+                         env={'CC': 'clang -target arm'}, use_lld=True)
+        mock_sh_command.assert_called_once_with('clang')
+        mock_shprint.assert_called_once_with(
+            mock_sh_command.return_value.bake.return_value, '-shared', '-O3',
+            '-o', soname, mock.ANY, _env=mock.ANY)
+        assert response_files == ['\n'.join([
+            '-fuse-ld=lld',
+            os.path.join(objs_paths[0], 'foo.so.o'),
+            os.path.join(objs_paths[1], 'bar.so.o'),
+            '-L/python/lib', '-lpython3.8', '-lm', '-L/libs']) + '\n']
+        assert sorted(os.listdir(self.root)) == [
+            'objects_bar', 'objects_foo']
+
+    def test_write_response_file(self):
+        filename = os.path.join(self.root, 'link.args')
+        write_response_file(filename, ['-L/my dir', 'a"b', '-lm'])
+        with open(filename) as fileh:
+            assert fileh.read() == '-L/my\\ dir\na\\"b\n-lm\n'
+
+
+class TestCopylibs(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        for directory in ('objs', 'libs', 'deps', 'dest'):
+            os.makedirs(os.path.join(self.root, directory))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, data):
+        filename = os.path.join(self.root, name)
+        with open(filename, 'wb') as fileh:
+            fileh.write(data)
+        return filename
+
+    @mock.patch('pythonforandroid.build.shprint')
+    def test_copylibs_function(self, mock_shprint):
+        """
+        The libraries needed by the objects, and those they need in turn,
+        are copied, without the ones provided by Android or the bootstrap.
+        """
+        self.write('objs/module.so.libs', b'foo static log')
+        self.write('objs/module.so.libdirs', ' '.join(
+            os.path.join(self.root, directory)
+            for directory in ('dest', 'libs', 'deps')).encode('utf-8'))
+        libfoo = self.write('libs/libfoo.so', make_elf(
+            [], needed=['libbar.so', 'libc.so', 'libSDL2.so']))
+        libbar = self.write('deps/libbar.so', make_elf(
+            [], needed=['libfoo.so']))
+        self.write('deps/libstatic.a', b'')
+        dependency_index = DependencyIndex()
+
+        copylibs_function(
+            os.path.join(self.root, 'dest', 'libpymodules.so'),
+            [os.path.join(self.root, 'objs')],
+            dependency_index=dependency_index)
+        mock_shprint.assert_called_once_with(
+            mock.ANY, libfoo, libbar, os.path.join(self.root, 'dest'))
+        assert set(dependency_index.entries) == {libfoo, libbar}
+
+        os.remove(libbar)
+        with self.assertRaises(RuntimeError):
+            copylibs_function(
+                os.path.join(self.root, 'dest', 'libpymodules.so'),
+                [os.path.join(self.root, 'objs')])
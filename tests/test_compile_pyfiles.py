@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+from importlib import util as importlib_util
+from unittest import mock
+
+from backports import tempfile
+
+COMPILE_PYFILES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'pythonforandroid', 'bootstraps', 'common', 'build', 'compile_pyfiles.py')
+
+
+def load_compile_pyfiles():
+    spec = importlib_util.spec_from_file_location(
+        'compile_pyfiles', COMPILE_PYFILES)
+    module = importlib_util.module_from_spec(spec)
+    # the worker processes look the compiled function up by module name
+    sys.modules['compile_pyfiles'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+compile_pyfiles = load_compile_pyfiles()
+
+
+class TestCompilePyfiles(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        os.makedirs(os.path.join(self.root, 'package', '__pycache__'))
+        self.sources = [os.path.join(self.root, 'main.py'),
+                        os.path.join(self.root, 'package', '__init__.py')]
+        for source in self.sources:
+            with open(source, 'w') as fileh:
+                fileh.write('value = 1\n')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_list_sources(self):
+        with open(os.path.join(self.root, 'package', '__pycache__',
+                               'cached.py'), 'w'):
+            pass
+        assert sorted(compile_pyfiles.list_sources([self.root])) == sorted(
+            self.sources)
+
+    def test_main(self):
+        """
+        The python files are compiled next to their sources, only those
+        changed since are compiled again.
+        """
+        assert compile_pyfiles.main(['-j', '2', self.root]) == 0
+        for source in self.sources:
+            assert os.path.exists(source + 'c')
+            assert compile_pyfiles.is_up_to_date(source)
+
+        with open(self.sources[0], 'w') as fileh:
+            fileh.write('value = 22\n')
+        assert not compile_pyfiles.is_up_to_date(self.sources[0])
+        mtime = os.stat(self.sources[1] + 'c').st_mtime_ns
+        with mock.patch.object(
+                compile_pyfiles, 'compile_files',
+                wraps=compile_pyfiles.compile_files) as mock_compile_files:
+            assert compile_pyfiles.main([self.root]) == 0
+        mock_compile_files.assert_called_once_with(
+            [self.sources[0]], mock.ANY)
+        assert compile_pyfiles.is_up_to_date(self.sources[0])
+        assert os.stat(self.sources[1] + 'c').st_mtime_ns == mtime
+
+    def test_main_errors(self):
+        with open(os.path.join(self.root, 'broken.py'), 'w') as fileh:
+            fileh.write('def (\n')
+        assert compile_pyfiles.main(['-j', '1', self.root]) == 1
+        for source in self.sources:
+            assert compile_pyfiles.is_up_to_date(source)
+        assert not os.path.exists(os.path.join(self.root, 'broken.pyc'))
+
+    def test_compile_files_broken_pool(self):
+        """
+        The files are compiled serially when a worker process dies.
+        """
+        from concurrent.futures.process import BrokenProcessPool
+        with mock.patch('concurrent.futures.ProcessPoolExecutor.map',
+                        side_effect=BrokenProcessPool('killed')):
+            assert compile_pyfiles.compile_files(self.sources, 2) == [
+                None, None]
+        for source in self.sources:
+            assert compile_pyfiles.is_up_to_date(source)
@@ -0,0 +1,153 @@
+import os
+import unittest
+from unittest import mock
+from urllib.request import pathname2url, urlopen
+
+import pytest
+from backports import tempfile
+
+from pythonforandroid.download import (
+    DownloadCache, download_url, mirror_url, sha256sum, url_key)
+
+
+def write_file(filename, data):
+    with open(filename, 'wb') as fileh:
+        fileh.write(data)
+
+
+def read_file(filename):
+    with open(filename, 'rb') as fileh:
+        return fileh.read()
+
+
+def file_url(filename):
+    return 'file://' + pathname2url(filename)
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.upstream = os.path.join(self.root, 'upstream')
+        self.mirror = os.path.join(self.root, 'mirror')
+        os.makedirs(self.upstream)
+        os.makedirs(self.mirror)
+        self.data = b'python-for-android' * 1000
+        self.source = os.path.join(self.upstream, 'package-1.0.tar.gz')
+        write_file(self.source, self.data)
+        self.url = file_url(self.source)
+        self.cache = DownloadCache(os.path.join(self.root, 'cache'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_mirror_url(self):
+        url = 'https://example.com/files/package-1.0.tar.gz?download=1'
+        assert mirror_url('https://mirror.local/p4a/', url) == (
+            'https://mirror.local/p4a/package-1.0.tar.gz')
+        assert mirror_url('/srv/mirror', url) == (
+            'file:///srv/mirror/package-1.0.tar.gz')
+
+    def test_download_url(self):
+        target = os.path.join(self.root, 'target')
+        report_hook = mock.Mock()
+        assert download_url(self.url, target, report_hook) == target
+        assert read_file(target) == self.data
+        assert not os.path.exists(target + '.part')
+        assert report_hook.call_args == mock.call(
+            len(self.data), len(self.data))
+
+    def test_download_url_resume(self):
+        """
+        A partial file left by an interrupted download is completed with a
+        range request.
+        """
+        target = os.path.join(self.root, 'target')
+        write_file(target + '.part', self.data[:100])
+        response = mock.MagicMock(status=206)
+        response.headers = {'Content-Length': str(len(self.data) - 100)}
+        response.read.side_effect = [self.data[100:], b'']
+        with mock.patch('pythonforandroid.download.urlopen') as m_urlopen:
+            m_urlopen.return_value.__enter__.return_value = response
+            download_url('https://example.com/package-1.0.tar.gz', target)
+        request = m_urlopen.call_args[0][0]
+        assert request.get_header('Range') == 'bytes=100-'
+        assert read_file(target) == self.data
+
+    def test_download_url_resume_not_supported(self):
+        """
+        The download starts over if the server ignores the range request.
+        """
+        target = os.path.join(self.root, 'target')
+        write_file(target + '.part', b'garbage')
+        download_url(self.url, target)
+        assert read_file(target) == self.data
+
+    def test_fetch(self):
+        path = self.cache.fetch(self.url)
+        assert path == self.cache.blob_path(sha256sum(self.source))
+        assert read_file(path) == self.data
+        assert self.cache.lookup(self.url) == path
+        assert os.listdir(os.path.join(self.cache.root, 'urls')) == [
+            url_key(self.url)]
+        # cached by now, the upstream file is not needed anymore
+        os.unlink(self.source)
+        assert self.cache.fetch(self.url) == path
+
+    def test_fetch_shared_by_content(self):
+        """
+        A file known by its sha256 is reused whatever url it came from.
+        """
+        digest = sha256sum(self.source)
+        self.cache.fetch(self.url)
+        other_url = 'https://example.com/package-1.0.tar.gz'
+        with mock.patch('pythonforandroid.download.urlopen') as m_urlopen:
+            path = self.cache.fetch(other_url, sha256=digest)
+        assert m_urlopen.call_args_list == []
+        assert path == self.cache.blob_path(digest)
+
+    def test_fetch_sha256_mismatch(self):
+        with pytest.raises(ValueError):
+            self.cache.fetch(self.url, sha256='0' * 64)
+        assert self.cache.lookup(self.url) is None
+
+    def test_fetch_mirrors(self):
+        """
+        Mirrors are tried in order before the upstream url, missing files
+        are skipped.
+        """
+        url = 'https://example.com/files/package-1.0.tar.gz'
+        write_file(os.path.join(self.mirror, 'package-1.0.tar.gz'), self.data)
+        mirrors = [os.path.join(self.root, 'empty'), file_url(self.mirror)]
+        with mock.patch('pythonforandroid.download.urlopen',
+                        wraps=urlopen) as m_urlopen:
+            path = self.cache.fetch(url, mirrors=mirrors)
+        assert read_file(path) == self.data
+        assert [call[0][0].full_url for call in m_urlopen.call_args_list] == [
+            mirror_url(mirrors[0], url), mirror_url(mirrors[1], url)]
+        assert self.cache.lookup(url) == path
+
+    def test_remove(self):
+        """
+        Removing an url drops its index entry and its content.
+        """
+        assert not self.cache.remove(self.url)
+        path = self.cache.fetch(self.url)
+        assert self.cache.remove(self.url)
+        assert self.cache.lookup(self.url) is None
+        assert not os.path.exists(path)
+        assert os.listdir(os.path.join(self.cache.root, 'urls')) == []
+        assert not self.cache.remove(self.url)
+
+    def test_clear(self):
+        """
+        Clearing the cache removes every url and the partial downloads.
+        """
+        path = self.cache.fetch(self.url)
+        partial = os.path.join(self.cache.root, 'partial', url_key('other'))
+        write_file(partial + '.part', b'python')
+        self.cache.clear()
+        assert self.cache.lookup(self.url) is None
+        assert not os.path.exists(path)
+        assert os.listdir(os.path.join(self.cache.root, 'partial')) == []
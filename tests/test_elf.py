@@ -0,0 +1,167 @@
+import os
+import struct
+import unittest
+from unittest import mock
+
+from backports import tempfile
+import sh
+
+from pythonforandroid import elf
+
+
+def make_elf(section_names, elf_class=elf.ELFCLASS64, needed=None):
+    '''Returns the content of an ELF file with (empty) sections named
+    ``section_names``, after the null section and the section names, and
+    a dynamic section needing the ``needed`` libraries if given.'''
+    endian = '<'
+    header_format = endian + elf.HEADER_FORMATS[elf_class]
+    section_format = endian + elf.SECTION_FORMATS[elf_class]
+    dynamic_format = endian + elf.DYNAMIC_FORMATS[elf_class]
+
+    # (name, type, data, link) of each section after the null one
+    sections = [('.shstrtab', 3, b'', 0)]
+    sections.extend((name, 1, b'', 0) for name in section_names)
+    if needed is not None:
+        dynstr = b'\0'
+        dynamic = b''
+        for lib in needed:
+            dynamic += struct.pack(dynamic_format, elf.DT_NEEDED,
+                                   len(dynstr))
+            dynstr += lib.encode('utf-8') + b'\0'
+        dynamic += struct.pack(dynamic_format, elf.DT_NULL, 0)
+        sections.append(('.dynstr', 3, dynstr, 0))
+        sections.append(('.dynamic', elf.SHT_DYNAMIC, dynamic,
+                         len(sections)))
+
+    names = b'\0'
+    name_offsets = []
+    for name, _, _, _ in sections:
+        name_offsets.append(len(names))
+        names += name.encode('utf-8') + b'\0'
+    sections[0] = ('.shstrtab', 3, names, 0)
+
+    offset = 16 + struct.calcsize(header_format)
+    contents = b''
+    headers = [struct.pack(section_format, *([0] * 10))]
+    for name_offset, section in zip(name_offsets, sections):
+        _, sh_type, data, link = section
+        headers.append(struct.pack(section_format, name_offset, sh_type, 0,
+                                   0, offset + len(contents), len(data),
+                                   link, 0, 1, 0))
+        contents += data
+    shoff = offset + len(contents)
+
+    ident = elf.ELF_MAGIC + bytes([elf_class, elf.ELFDATA2LSB, 1]) + \
+        b'\0' * 9
+    header = struct.pack(header_format, 3, 183, 1, 0, 0, shoff, 0,
+                         offset, 0, 0, struct.calcsize(section_format),
+                         len(headers), 1)
+    return ident + header + contents + b''.join(headers)
+
+
+class TestElf(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, data):
+        filename = os.path.join(self.temp_dir.name, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as fileh:
+            fileh.write(data)
+        return filename
+
+    def test_elf_file(self):
+        for elf_class in (elf.ELFCLASS32, elf.ELFCLASS64):
+            filename = self.write('libfoo.so', make_elf(
+                ['.dynsym', '.symtab', '.debug_info'], elf_class))
+            elf_file = elf.ElfFile(filename)
+            assert [section.name for section in elf_file.sections] == [
+                '', '.shstrtab', '.dynsym', '.symtab', '.debug_info']
+            assert elf_file.get_section('.symtab').type == 1
+            assert elf_file.get_section('.dynamic') is None
+            assert elf_file.has_debug_info()
+            assert not elf_file.is_stripped()
+
+        filename = self.write('libfoo.so', make_elf(['.dynsym', '.text']))
+        assert elf.ElfFile(filename).is_stripped()
+
+        for data in (b'', b'not an ELF file', make_elf(['.text'])[:70]):
+            with self.assertRaises(ValueError):
+                elf.ElfFile(self.write('libbroken.so', data))
+
+    def test_get_needed(self):
+        for elf_class in (elf.ELFCLASS32, elf.ELFCLASS64):
+            filename = self.write('libfoo.so', make_elf(
+                ['.text'], elf_class, needed=['libbar.so', 'libc.so']))
+            assert elf.ElfFile(filename).get_needed() == [
+                'libbar.so', 'libc.so']
+        filename = self.write('libfoo.so', make_elf(['.text']))
+        assert elf.ElfFile(filename).get_needed() == []
+
+    def test_dependency_index(self):
+        """
+        The needed libraries are read once, and again when the file changes.
+        """
+        filename = self.write('libfoo.so', make_elf([], needed=['libbar.so']))
+        index_file = os.path.join(self.temp_dir.name, 'index.json')
+        index = elf.DependencyIndex(index_file)
+        assert index.get_needed(filename) == ['libbar.so']
+        assert index.get_needed(self.write('libbroken.so', b'broken')) == []
+        index.save()
+
+        index = elf.DependencyIndex(index_file)
+        with mock.patch.object(elf, 'ElfFile') as mock_elf_file:
+            assert index.get_needed(filename) == ['libbar.so']
+        mock_elf_file.assert_not_called()
+
+        self.write('libfoo.so', make_elf([], needed=['libbaz.so', 'libm.so']))
+        assert index.get_needed(filename) == ['libbaz.so', 'libm.so']
+
+    def test_find_libraries(self):
+        libs = [self.write(name, b'') for name in (
+            'libs/armeabi-v7a/libmain.so', 'modules/_ssl.SO')]
+        self.write('modules/README', b'')
+        assert elf.find_libraries(
+            os.path.join(self.temp_dir.name, 'libs'),
+            os.path.join(self.temp_dir.name, 'modules'),
+            os.path.join(self.temp_dir.name, 'missing')) == libs
+
+    def test_strip_files(self):
+        """
+        Only the libraries which are not stripped yet are stripped, keeping
+        their debug information aside if asked to.
+        """
+        stripped = self.write('libs/libstripped.so', make_elf(['.text']))
+        symbols = self.write('libs/libsymbols.so', make_elf(['.symtab']))
+        debug = self.write('libs/libdebug.so', make_elf(['.debug_info']))
+        broken = self.write('libs/libbroken.so', b'broken')
+        strip = mock.Mock()
+        strip.side_effect = lambda filename, **kwargs: (
+            filename == broken and self.fail_strip())
+        objcopy = mock.Mock()
+        debug_dir = os.path.join(self.temp_dir.name, 'symbols')
+
+        assert elf.strip_files(
+            [stripped, symbols, debug, broken], strip, {}, jobs=2,
+            objcopy=objcopy, debug_dir=debug_dir,
+            root_dir=self.temp_dir.name) == 2
+        assert sorted(call[0][0] for call in strip.call_args_list) == sorted(
+            [symbols, debug, broken])
+        calls = []
+        for library in (symbols, debug):
+            debug_file = os.path.join(
+                debug_dir, 'libs', os.path.basename(library) + '.debug')
+            calls.extend([
+                mock.call('--only-keep-debug', library, debug_file, _env={}),
+                mock.call('--add-gnu-debuglink=' + debug_file, library,
+                          _env={})])
+        assert sorted(objcopy.call_args_list) == sorted(calls)
+        assert os.path.isdir(os.path.dirname(debug_file))
+
+    @staticmethod
+    def fail_strip():
+        raise sh.ErrorReturnCode_1('strip', b'', b'File format not recognized')
@@ -1,12 +1,14 @@
 from pythonforandroid.build import Context
 from pythonforandroid.graph import (
-    fix_deplist, get_dependency_tuple_list_for_recipe,
-    get_recipe_order_and_bootstrap, obvious_conflict_checker,
+    DependencyResolver, find_order, fix_deplist,
+    get_dependency_tuple_list_for_recipe, get_recipe_order_and_bootstrap,
+    obvious_conflict_checker,
 )
 from pythonforandroid.bootstrap import Bootstrap
 from pythonforandroid.recipe import Recipe
 from pythonforandroid.util import BuildInterruptingException
 from itertools import product
+import time
 
 from unittest import mock
 import pytest
@@ -52,7 +54,7 @@ invalid_combinations_simple = list(invalid_combinations)
 def get_fake_recipe(name, depends=None, conflicts=None):
     recipe = mock.Mock()
     recipe.name = name
-    recipe.get_opt_depends_in_list = lambda: []
+    recipe.get_opt_depends_in_list = lambda recipes: []
     recipe.get_dir_name = lambda: name
     recipe.depends = list(depends or [])
     recipe.conflicts = list(conflicts or [])
@@ -208,6 +210,60 @@ def test_multichoice_obvious_conflict_checker(monkeypatch):
         assert "conflict" in e_info.value.message.lower()
 
 
+def test_recipe_order_backtracking(monkeypatch):
+    # the first alternative of recipe1 pulls in a conflict, that only shows
+    # once its own dependencies are added:
+    with monkeypatch.context() as m:
+        register_fake_recipes_for_test(m, [
+            get_fake_recipe("recipe1", depends=[("lib1", "lib2"), "lib3"]),
+            get_fake_recipe("lib1", depends=["lib4"]),
+            get_fake_recipe("lib2"),
+            get_fake_recipe("lib3"),
+            get_fake_recipe("lib4", conflicts=["lib3"]),
+        ])
+        graph = DependencyResolver(ctx).resolve([("recipe1",)])
+    assert graph == {
+        "recipe1": {"lib2", "lib3"}, "lib2": set(), "lib3": set()}
+    assert list(find_order(graph)) == ["lib2", "lib3", "recipe1"]
+
+
+def test_recipe_order_synthetic_graph(monkeypatch):
+    """
+    A graph of 256 recipes depending on a choice between two other recipes,
+    half of which pull in a conflict, is resolved quickly (there are
+    2 ** 224 possible orders).
+    """
+    recipes = [get_fake_recipe("bad", conflicts=["recipe0_0"])]
+    for layer in range(8):
+        for index in range(32):
+            name = "recipe{}_{}".format(layer, index)
+            depends = []
+            if layer > 0:
+                choice = "choice{}_{}".format(layer, index)
+                depends = ["recipe{}_{}".format(layer - 1, index),
+                           (choice + "a", choice + "b")]
+                recipes.append(get_fake_recipe(
+                    choice + "a", depends=["bad"] if index % 2 else []))
+                recipes.append(get_fake_recipe(choice + "b"))
+            recipes.append(get_fake_recipe(name, depends=depends))
+    with monkeypatch.context() as m:
+        register_fake_recipes_for_test(m, recipes)
+        start = time.time()
+        graph = DependencyResolver(ctx).resolve(
+            [("recipe7_{}".format(index),) for index in range(32)])
+        elapsed = time.time() - start
+    assert elapsed < 10
+    assert "bad" not in graph
+    assert len(graph) == 256 + 224
+    order = list(find_order({name: set(deps) for name, deps in graph.items()}))
+    assert sorted(order) == sorted(graph)
+    for name, deps in graph.items():
+        assert all(order.index(dep) < order.index(name) for dep in deps)
+        if name.startswith("choice"):
+            index = int(name[:-1].split("_")[1])
+            assert name.endswith("b" if index % 2 else "a")
+
+
 def test_bootstrap_dependency_addition():
     build_order, python_modules, bs = get_recipe_order_and_bootstrap(
         ctx, ['kivy'], None)
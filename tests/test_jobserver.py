@@ -0,0 +1,75 @@
+import os
+import shutil
+import subprocess
+import time
+import unittest
+from unittest import mock
+
+from backports import tempfile
+
+from pythonforandroid.jobserver import (
+    JobServer, get_cpu_jobs, reserve_jobs)
+
+MAKEFILE = '''all: a b c d
+a b c d:
+\t@sleep 0.3
+'''
+
+
+class TestJobServer(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.jobserver = JobServer(3, os.path.join(self.temp_dir.name, 'js'))
+        self.ctx = mock.Mock(cpu_jobs=3, jobserver=self.jobserver)
+
+    def tearDown(self):
+        self.jobserver.close()
+        self.temp_dir.cleanup()
+
+    def test_get_cpu_jobs(self):
+        assert get_cpu_jobs(self.ctx) == 3
+        assert get_cpu_jobs(mock.Mock(cpu_jobs=None)) == os.cpu_count()
+
+    def test_reserve_jobs(self):
+        with reserve_jobs(self.ctx) as jobs:
+            assert jobs == 1
+            with reserve_jobs(self.ctx, 5, blocking=False) as jobs:
+                assert jobs == 2
+                with reserve_jobs(self.ctx, 1, blocking=False) as jobs:
+                    assert jobs == 0
+        with reserve_jobs(self.ctx, 3, blocking=False) as jobs:
+            assert jobs == 3
+        with reserve_jobs(mock.Mock(jobserver=None), 4) as jobs:
+            assert jobs == 4
+
+    def test_restart(self):
+        """
+        A jobserver starts in the dir of one which was not closed, with all
+        its tokens.
+        """
+        directory = os.path.join(self.temp_dir.name, 'restarted')
+        # killed: its FIFO is closed but not removed
+        os.close(JobServer(2, directory).fd)
+        jobserver = JobServer(3, directory)
+        self.addCleanup(jobserver.close)
+        assert len(jobserver.acquire(4, blocking=False)) == 3
+
+    @unittest.skipIf(shutil.which('make') is None, 'make is not installed')
+    def test_make_wrapper(self):
+        """
+        The make wrapper ignores the jobs asked on its command line, and only
+        runs as many as there are tokens left, and its implicit one: here
+        only the implicit one.
+        """
+        with open(os.path.join(self.temp_dir.name, 'Makefile'), 'w') as f:
+            f.write(MAKEFILE)
+        with reserve_jobs(self.ctx, 3):
+            start = time.time()
+            subprocess.check_call(
+                [self.jobserver.make, '-j', '8', '-C', self.temp_dir.name],
+                stdout=subprocess.DEVNULL)
+        assert time.time() - start >= 1.15
+        # the tokens were given back by make
+        with reserve_jobs(self.ctx, 3, blocking=False) as jobs:
+            assert jobs == 3
@@ -1,5 +1,11 @@
+import os
 import unittest
+from unittest import mock
 from unittest.mock import MagicMock
+
+import sh
+from backports import tempfile
+
 from pythonforandroid import logger
 
 
@@ -16,3 +22,52 @@ class TestShprint(unittest.TestCase):
         command.return_value = expected_command_output
         output = logger.shprint(command, 'a1', k1='k1')
         self.assertEqual(output, expected_command_output)
+
+
+class TestShprintCommandLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        logger.setup_command_logs(self.temp_dir.name)
+        self.addCleanup(logger.setup_command_logs, None)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_output_to_file(self):
+        """
+        The output of the command goes to its own log file, from which the
+        callers get it.
+        """
+        output = logger.shprint(
+            sh.Command('sh'), '-c', 'seq 1 100000; echo done >&2')
+        self.assertEqual(output.exit_code, 0)
+        lines = output.stdout.decode('utf-8').splitlines()
+        self.assertEqual(lines[0], '1')
+        self.assertEqual(lines[-2:], ['100000', 'done'])
+        self.assertEqual(output.splitlines(), lines)
+        log_files = os.listdir(self.temp_dir.name)
+        self.assertEqual(len(log_files), 1)
+        self.assertTrue(log_files[0].endswith('-sh.log'))
+
+    def test_failure_tail(self):
+        with mock.patch('pythonforandroid.logger.info') as m_info, \
+                self.assertRaises(sh.ErrorReturnCode_3) as e:
+            logger.shprint(sh.Command('sh'), '-c', 'seq 1 2000; exit 3',
+                           _tail=2)
+        self.assertEqual(
+            e.exception.stdout.decode('utf-8').splitlines(),
+            [str(n) for n in range(1001, 2001)])
+        stdout_tail = m_info.call_args_list[-2][0][0]
+        self.assertIn('last 2 lines of 1000', stdout_tail)
+        self.assertIn('1999\t\n2000', stdout_tail)
+
+    def test_read_log(self):
+        filename = os.path.join(self.temp_dir.name, 'test.log')
+        with open(filename, 'wb') as fileh:
+            fileh.write(b'# header\n' + b''.join(
+                b'%d\n' % n for n in range(50000)))
+        self.assertEqual(
+            logger.read_log(filename, 9, 2), b'49998\n49999\n')
+        self.assertEqual(
+            logger.read_log(filename, 9).splitlines()[0], b'0')
@@ -0,0 +1,141 @@
+import os
+import unittest
+
+from backports import tempfile
+
+from pythonforandroid.prebuilt import (
+    PrebuiltCache, TreeCache, changed_files, relocate_file, snapshot_dir)
+
+
+def write_file(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as fileh:
+        fileh.write(data)
+
+
+def read_file(filename):
+    with open(filename, 'rb') as fileh:
+        return fileh.read()
+
+
+class TestPrebuiltCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.cache = PrebuiltCache(os.path.join(self.root, 'cache'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_changed_files(self):
+        directory = os.path.join(self.root, 'libs')
+        write_file(os.path.join(directory, 'libold.so'), b'old')
+        write_file(os.path.join(directory, 'libmodified.so'), b'old')
+        snapshot = snapshot_dir(directory)
+        write_file(os.path.join(directory, 'libnew.so'), b'new')
+        write_file(os.path.join(directory, 'libmodified.so'), b'modified')
+        assert changed_files(directory, snapshot) == [
+            'libmodified.so', 'libnew.so']
+
+    def test_relocate_file(self):
+        text_file = os.path.join(self.root, 'Makefile')
+        write_file(text_file, b'CFLAGS=-I/old/storage/build/include\n')
+        os.chmod(text_file, 0o444)
+        binary_file = os.path.join(self.root, 'lib.so')
+        write_file(binary_file, b'\0/old/storage/build')
+        assert relocate_file(text_file, '/old/storage', '/new')
+        assert not relocate_file(binary_file, '/old/storage', '/new')
+        assert read_file(text_file) == b'CFLAGS=-I/new/build/include\n'
+        assert read_file(binary_file) == b'\0/old/storage/build'
+
+    def test_store_restore(self):
+        """
+        An artifact stored from a storage dir is restored, relocated, into
+        another one.
+        """
+        old_storage = os.path.join(self.root, 'old')
+        new_storage = os.path.join(self.root, 'new')
+        for storage_dir in (old_storage, new_storage):
+            os.makedirs(os.path.join(storage_dir, 'build'))
+            os.makedirs(os.path.join(storage_dir, 'libs'))
+        build_dir = os.path.join(old_storage, 'build', 'other_builds', 'openssl')
+        write_file(os.path.join(build_dir, 'Makefile'),
+                   'PREFIX={}\n'.format(build_dir).encode('utf-8'))
+        write_file(os.path.join(build_dir, 'libssl.so'), b'\0ELF')
+        write_file(os.path.join(old_storage, 'libs', 'libssl.so'), b'\0ELF')
+
+        assert self.cache.lookup('openssl', 'arm64-v8a', 'key') is None
+        contents = {
+            'build': (os.path.join(old_storage, 'build'),
+                      ['other_builds/openssl']),
+            'libs': (os.path.join(old_storage, 'libs'), ['libssl.so']),
+        }
+        artifact = self.cache.store(
+            'openssl', 'arm64-v8a', 'key', contents, old_storage)
+        assert self.cache.lookup('openssl', 'arm64-v8a', 'key') == artifact
+        assert os.listdir(os.path.dirname(artifact)) == ['key.tar.gz']
+
+        roots = {'build': os.path.join(new_storage, 'build'),
+                 'libs': os.path.join(new_storage, 'libs'),
+                 'python': os.path.join(new_storage, 'python')}
+        metadata = self.cache.restore(artifact, roots, new_storage)
+        assert metadata['recipe'] == 'openssl'
+        new_build_dir = os.path.join(
+            new_storage, 'build', 'other_builds', 'openssl')
+        assert read_file(os.path.join(new_build_dir, 'Makefile')) == (
+            'PREFIX={}\n'.format(new_build_dir).encode('utf-8'))
+        assert read_file(os.path.join(new_build_dir, 'libssl.so')) == b'\0ELF'
+        assert read_file(os.path.join(new_storage, 'libs', 'libssl.so')) == (
+            b'\0ELF')
+        assert not os.path.exists(roots['python'])
+
+
+class TestTreeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.cache = TreeCache(os.path.join(self.root, 'cache'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_store_restore(self):
+        """
+        A tree stored from a storage dir is cloned into another one, where
+        its generated files are relocated without changing the stored ones.
+        """
+        build_dir = os.path.join(self.root, 'old', 'hostpython3')
+        makefile = os.path.join(build_dir, 'native-build', 'Makefile')
+        write_file(makefile, 'srcdir={}\n'.format(build_dir).encode('utf-8'))
+        write_file(os.path.join(build_dir, 'native-build', 'python3'),
+                   b'\0ELF')
+        write_file(os.path.join(build_dir, 'Lib', 'os.py'), b'# os')
+
+        assert self.cache.lookup('key') is None
+        tree = self.cache.store('key', build_dir)
+        assert self.cache.lookup('key') == tree
+        assert sorted(os.listdir(self.cache.root)) == [
+            'key', 'key.json', 'locks']
+        # the stored tree is a copy, the build dir may be modified
+        write_file(makefile, b'modified')
+        assert self.cache.store('key', build_dir) == tree
+        assert read_file(os.path.join(tree, 'native-build', 'Makefile')) == (
+            'srcdir={}\n'.format(build_dir).encode('utf-8'))
+
+        new_build_dir = os.path.join(self.root, 'new', 'hostpython3')
+        write_file(os.path.join(new_build_dir, 'Lib', 'old.py'), b'')
+        method = self.cache.restore(tree, new_build_dir, ('native-build',))
+        assert method in ('reflink', 'copy')
+        assert read_file(os.path.join(
+            new_build_dir, 'native-build', 'Makefile')) == (
+                'srcdir={}\n'.format(new_build_dir).encode('utf-8'))
+        assert read_file(os.path.join(tree, 'native-build', 'Makefile')) == (
+            'srcdir={}\n'.format(build_dir).encode('utf-8'))
+        assert read_file(os.path.join(
+            new_build_dir, 'native-build', 'python3')) == b'\0ELF'
+        assert os.listdir(os.path.join(new_build_dir, 'Lib')) == ['os.py']
+        # a build writing into the restored tree leaves the stored one as is
+        write_file(os.path.join(new_build_dir, 'Lib', 'os.py'), b'# new os')
+        assert read_file(os.path.join(tree, 'Lib', 'os.py')) == b'# os'
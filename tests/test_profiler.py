@@ -0,0 +1,77 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+import sh
+from backports import tempfile
+
+from pythonforandroid.logger import shprint
+from pythonforandroid.profiler import BuildProfiler, profile
+from pythonforandroid.util import run_parallel_tasks
+
+
+class TestBuildProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.ctx = mock.Mock()
+        self.ctx.profiler = BuildProfiler(
+            os.path.join(self.temp_dir.name, 'events'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_profile(self):
+        """
+        The phases are recorded, also by worker processes, in a Chrome
+        trace with their CPU time, commands and bytes written.
+        """
+        with mock.patch('pythonforandroid.logger.info'):
+            with profile(self.ctx, 'download', 'python3'):
+                shprint(sh.true)
+                shprint(sh.true)
+
+        def build(arch):
+            with profile(self.ctx, 'build', 'python3', arch):
+                pass
+
+        run_parallel_tasks(['armeabi-v7a', 'arm64-v8a'], build, 2)
+
+        trace_file = os.path.join(self.temp_dir.name, 'trace.json')
+        self.ctx.profiler.write_trace(trace_file)
+        with open(trace_file) as fileh:
+            events = json.load(fileh)['traceEvents']
+        self.assertEqual(
+            sorted(event['name'] for event in events),
+            ['build python3 arm64-v8a', 'build python3 armeabi-v7a',
+             'download python3'])
+        download = [event for event in events if event['cat'] == 'download']
+        self.assertEqual(download[0]['ph'], 'X')
+        self.assertEqual(download[0]['args']['commands'], 2)
+        self.assertEqual(download[0]['args']['recipe'], 'python3')
+        self.assertEqual(
+            len({event['pid'] for event in events}), 3)
+
+        summary = self.ctx.profiler.get_summary()
+        self.assertTrue(summary[0].startswith('Build profile'))
+        self.assertEqual(
+            [line.split()[0] for line in summary[2:4]],
+            sorted(['build', 'download'], key=lambda phase: -sum(
+                event['dur'] for event in events if event['cat'] == phase)))
+
+    def test_profile_disabled(self):
+        for ctx in (mock.Mock(), mock.Mock(profiler=None), None):
+            with profile(ctx, 'build', 'python3'):
+                pass
+        self.assertEqual(self.ctx.profiler.read_events(), [])
+
+    def test_missing_dir(self):
+        """
+        The dir of the events file is created, as the build dir of a new
+        storage dir does not exist yet when the profiler is created.
+        """
+        events_file = os.path.join(self.temp_dir.name, 'build', 'events')
+        profiler = BuildProfiler(events_file)
+        self.assertTrue(os.path.isfile(events_file))
+        self.assertEqual(profiler.read_events(), [])
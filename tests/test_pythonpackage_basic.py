@@ -11,10 +11,15 @@ import sys
 import subprocess
 import tempfile
 import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 from pythonforandroid.pythonpackage import (
+    MetadataCache,
     _extract_info_from_package,
+    _get_metadata_cache_key,
+    extract_metainfo_files_from_package,
     get_dep_names_of_package,
     get_package_name,
     _get_system_python_executable,
@@ -152,6 +157,98 @@ def test_get_dep_names_of_package():
         shutil.rmtree(test_fake_package)
 
 
+def test_metadata_cache():
+    temp_d = tempfile.mkdtemp(prefix="p4a-pythonpackage-test-tmp-")
+    try:
+        output_folder = os.path.join(temp_d, "output")
+        os.mkdir(output_folder)
+        fake_metadata_extract("testpackage", output_folder)
+        cache = MetadataCache(os.path.join(temp_d, "cache"))
+        key = ["requirement", "testpackage==0.1"]
+        assert not cache.lookup(key, output_folder)
+        cache.store(key, output_folder)
+
+        cached_folder = os.path.join(temp_d, "cached")
+        os.mkdir(cached_folder)
+        assert cache.lookup(key, cached_folder)
+        assert sorted(os.listdir(cached_folder)) == [
+            "METADATA", "metadata_source"]
+        with open(os.path.join(cached_folder, "METADATA")) as f:
+            assert "Name: testpackage" in f.read()
+        with mock.patch("time.time", return_value=time.time() + 60):
+            assert not cache.lookup(key, cached_folder, max_age=30)
+    finally:
+        shutil.rmtree(temp_d)
+
+
+def test_metadata_cache_threads():
+    """ Several threads can store the same entry at the same time. """
+    temp_d = tempfile.mkdtemp(prefix="p4a-pythonpackage-test-tmp-")
+    try:
+        output_folder = os.path.join(temp_d, "output")
+        os.mkdir(output_folder)
+        fake_metadata_extract("testpackage", output_folder)
+        cache = MetadataCache(os.path.join(temp_d, "cache"))
+        key = ["requirement", "testpackage==0.1"]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(32):
+                executor.submit(cache.store, key, output_folder)
+        assert len(os.listdir(os.path.join(temp_d, "cache"))) == 1
+        assert cache.lookup(key, output_folder)
+    finally:
+        shutil.rmtree(temp_d)
+
+
+def test_get_metadata_cache_key():
+    key, max_age = _get_metadata_cache_key("Test_Package == 0.1")
+    assert key[:2] == ["requirement", "test-package == 0.1"]
+    assert max_age is None
+    key2, max_age = _get_metadata_cache_key("test-package==0.1")
+    assert key2 != key
+    assert max_age is None
+    assert _get_metadata_cache_key("test-package>=0.1")[1] is not None
+
+    # local folders are identified by their contents
+    temp_d = tempfile.mkdtemp(prefix="p4a-pythonpackage-test-tmp-")
+    try:
+        with open(os.path.join(temp_d, "setup.py"), "w") as f:
+            f.write("from setuptools import setup\n")
+        key, max_age = _get_metadata_cache_key(temp_d)
+        assert max_age is None
+        os.mkdir(os.path.join(temp_d, "build"))
+        with open(os.path.join(temp_d, "build", "ignored.py"), "w"):
+            pass
+        assert _get_metadata_cache_key(temp_d)[0] == key
+        with open(os.path.join(temp_d, "setup.py"), "a") as f:
+            f.write("setup(name='testpackage')\n")
+        assert _get_metadata_cache_key(temp_d)[0] != key
+    finally:
+        shutil.rmtree(temp_d)
+
+
+def test_extract_metainfo_files_from_package_cached():
+    def fake_check_output(cmd, **kwargs):
+        fake_metadata_extract(cmd[3], cmd[4])
+
+    temp_d = tempfile.mkdtemp(prefix="p4a-pythonpackage-test-tmp-")
+    try:
+        with mock.patch.dict(os.environ, {
+                "P4A_PYTHONPACKAGE_CACHE_DIR": os.path.join(temp_d, "cache")
+                }), mock.patch("pythonforandroid.pythonpackage.subprocess."
+                               "check_output",
+                               side_effect=fake_check_output) as m_check:
+            for output_folder in ("output1", "output2"):
+                output_folder = os.path.join(temp_d, output_folder)
+                os.mkdir(output_folder)
+                extract_metainfo_files_from_package(
+                    "testpackage==0.1", output_folder
+                )
+                assert os.path.exists(os.path.join(output_folder, "METADATA"))
+        assert m_check.call_count == 1
+    finally:
+        shutil.rmtree(temp_d)
+
+
 def test_transform_dep_for_pip():
     # A reminder, this entire function we test here is just a workaround
     # for https://github.com/pypa/pip/issues/6097 (and not a nice one.)
@@ -1,5 +1,6 @@
 import os
 import pytest
+import tarfile
 import types
 import unittest
 import warnings
@@ -7,6 +8,7 @@ from unittest import mock
 from backports import tempfile
 from platform import system
 
+from pythonforandroid.archive import extract_archive
 from pythonforandroid.build import Context
 from pythonforandroid.recipe import Recipe, import_recipe
 from pythonforandroid.archs import ArchAarch_64
@@ -26,10 +28,6 @@ def patch_logger_debug():
     return patch_logger('debug')
 
 
-def patch_urlretrieve():
-    return mock.patch('pythonforandroid.recipe.urlretrieve')
-
-
 class DummyRecipe(Recipe):
     pass
 
@@ -72,6 +70,41 @@ class TestRecipe(unittest.TestCase):
         self.assertEqual(
             e.exception.args[0], 'Recipe does not exist: {}'.format(recipe_name))
 
+    def test_stamps_loaded_recipe(self):
+        """
+        The source stamp and the artifact key of a recipe loaded from its
+        file, as in a build, cover its `__init__.py`.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            ctx = Context()
+            ctx.setup_dirs(temp_dir)
+            ctx.ndk_api = 21
+            ctx.recipe_build_order = []
+            ctx.local_recipes = os.path.join(temp_dir, 'recipes')
+            recipe_file = os.path.join(
+                ctx.local_recipes, 'p4atestrecipe', '__init__.py')
+            os.makedirs(os.path.dirname(recipe_file))
+            with open(recipe_file, 'w') as fileh:
+                fileh.write('from pythonforandroid.recipe import Recipe\n'
+                            'class TestRecipe(Recipe):\n'
+                            '    pass\n'
+                            'recipe = TestRecipe()\n')
+            recipe = Recipe.get_recipe('p4atestrecipe', ctx)
+            self.addCleanup(Recipe.recipes.pop, 'p4atestrecipe')
+            arch = ArchAarch_64(ctx)
+            assert recipe.get_recipe_file() == recipe_file
+            source_stamp = recipe.get_source_stamp(arch)
+            with open(recipe_file, 'a') as fileh:
+                fileh.write('recipe.version = "1.0"\n')
+            assert recipe.get_source_stamp(arch) != source_stamp
+            # and so does its prebuilt artifact key
+            ctx.ndk_dir = temp_dir
+            ctx.android_api = 27
+            artifact_key = recipe.get_artifact_key(arch)
+            with open(recipe_file, 'a') as fileh:
+                fileh.write('recipe.version = "2.0"\n')
+            assert recipe.get_artifact_key(arch) != artifact_key
+
     def test_import_recipe(self):
         """
         Verifies we can dynamically import a recipe without warnings.
@@ -135,53 +168,222 @@ class TestRecipe(unittest.TestCase):
         with (
                 patch_logger_debug()) as m_debug, (
                 mock.patch.object(Recipe, 'download_file')) as m_download_file, (
-                mock.patch('pythonforandroid.recipe.sh.touch')) as m_touch, (
                 tempfile.TemporaryDirectory()) as temp_dir:
             recipe.ctx.setup_dirs(temp_dir)
             recipe.download()
-        assert m_download_file.call_args_list == [mock.call(url, filename)]
+            package_dir = os.path.join(recipe.ctx.packages_path, 'test_recipe')
+            assert os.path.isfile(
+                os.path.join(package_dir, '.mark-{}'.format(filename)))
+        assert m_download_file.call_args_list == [
+            mock.call(url, os.path.join(package_dir, filename), sha256=None)]
         assert m_debug.call_args_list == [
             mock.call(
                 'Downloading test_recipe from '
                 'https://www.python.org/ftp/python/3.7.4/Python-3.7.4.tgz')]
-        assert m_touch.call_count == 1
+
+    def test_clean_download_cache(self):
+        """
+        The download of the recipe is removed from the shared download
+        cache, by its url without the checksum fragment.
+        """
+        recipe, filename = self.get_dummy_python_recipe_for_download_tests()
+        url = recipe.url
+        recipe._url += '#sha256=' + '0' * 64
+        with (
+                mock.patch('pythonforandroid.build.DownloadCache.remove',
+                           return_value=True)) as m_remove, (
+                tempfile.TemporaryDirectory()) as temp_dir:
+            recipe.ctx.setup_dirs(temp_dir)
+            assert recipe.clean_download_cache()
+        assert m_remove.call_args_list == [mock.call(url, sha256='0' * 64)]
+
+    def test_download_sha256_mismatch(self):
+        """
+        Verifies an already downloaded package is checked against the
+        `sha256sum` from the url fragment.
+        """
+        recipe, filename = self.get_dummy_python_recipe_for_download_tests()
+        recipe._url += '#sha256=' + '0' * 64
+        with tempfile.TemporaryDirectory() as temp_dir:
+            recipe.ctx.setup_dirs(temp_dir)
+            package_dir = os.path.join(recipe.ctx.packages_path, 'test_recipe')
+            os.makedirs(package_dir)
+            for name in (filename, '.mark-{}'.format(filename)):
+                with open(os.path.join(package_dir, name), 'w') as fileh:
+                    fileh.write('data')
+            with pytest.raises(ValueError) as e:
+                recipe.download()
+        assert e.value.args[0] == (
+            'Generated sha256sum does not match expected sha256sum '
+            'for test_recipe recipe')
 
     def test_download_file_scheme_https(self):
         """
-        Verifies `urlretrieve()` is being called on https downloads.
+        Verifies https downloads go through the download cache and end up
+        linked at the target.
         """
         recipe, filename = self.get_dummy_python_recipe_for_download_tests()
         url = recipe.url
         with (
-                patch_urlretrieve()) as m_urlretrieve, (
+                mock.patch('pythonforandroid.download.urlopen')) as m_urlopen, (
                 tempfile.TemporaryDirectory()) as temp_dir:
+            m_urlopen.return_value.__enter__.return_value.read.side_effect = [
+                b'data', b'']
+            m_urlopen.return_value.__enter__.return_value.headers = {}
             recipe.ctx.setup_dirs(temp_dir)
-            assert recipe.download_file(url, filename) == filename
-        assert m_urlretrieve.call_args_list == [
-            mock.call(url, filename, mock.ANY)
-        ]
+            target = os.path.join(temp_dir, filename)
+            assert recipe.download_file(url, target) == target
+            with open(target, 'rb') as fileh:
+                assert fileh.read() == b'data'
+        assert m_urlopen.call_count == 1
+        assert m_urlopen.call_args[0][0].full_url == url
 
     def test_download_file_scheme_https_oserror(self):
         """
-        Checks `urlretrieve()` is being retried on `OSError`.
+        Checks `urlopen()` is being retried on `OSError`.
         After a number of retries the exception is re-reaised.
         """
         recipe, filename = self.get_dummy_python_recipe_for_download_tests()
         url = recipe.url
         with (
-                patch_urlretrieve()) as m_urlretrieve, (
-                mock.patch('pythonforandroid.recipe.time.sleep')) as m_sleep, (
+                mock.patch('pythonforandroid.download.urlopen')) as m_urlopen, (
+                mock.patch('pythonforandroid.download.time.sleep')) as m_sleep, (
                 pytest.raises(OSError)), (
                 tempfile.TemporaryDirectory()) as temp_dir:
             recipe.ctx.setup_dirs(temp_dir)
-            m_urlretrieve.side_effect = OSError
-            assert recipe.download_file(url, filename) == filename
+            m_urlopen.side_effect = OSError
+            recipe.download_file(url, os.path.join(temp_dir, filename))
         retry = 5
-        expected_call_args_list = [mock.call(url, filename, mock.ANY)] * retry
-        assert m_urlretrieve.call_args_list == expected_call_args_list
+        assert m_urlopen.call_count == retry
         expected_call_args_list = [mock.call(1)] * (retry - 1)
         assert m_sleep.call_args_list == expected_call_args_list
 
+    def test_unpack(self):
+        """
+        Verifies the downloaded archive is extracted in-process into the
+        build container dir, with its top directory renamed after the
+        recipe.
+        """
+        recipe, filename = self.get_dummy_python_recipe_for_download_tests()
+        recipe.ctx.ndk_api = 21
+        recipe.ctx.recipe_build_order = []
+        with (
+                mock.patch('pythonforandroid.recipe.extract_archive')) as m_extract, (
+                tempfile.TemporaryDirectory()) as temp_dir:
+            recipe.ctx.setup_dirs(temp_dir)
+            package_dir = os.path.join(recipe.ctx.packages_path, 'test_recipe')
+            os.makedirs(package_dir)
+            open(os.path.join(package_dir, filename), 'w').close()
+            recipe.unpack('arm64-v8a')
+            assert m_extract.call_args_list == [mock.call(
+                os.path.join(package_dir, filename),
+                recipe.get_build_container_dir('arm64-v8a'),
+                root_name='test_recipe')]
+
+    def test_unpack_clone_source_trees(self):
+        """
+        With `clone_source_trees` the archive is extracted once, and the
+        build dir of each arch is cloned from that pristine tree.
+        """
+        recipe, filename = self.get_dummy_python_recipe_for_download_tests()
+        recipe.ctx.ndk_api = 21
+        recipe.ctx.recipe_build_order = []
+        recipe.ctx.clone_source_trees = True
+        with (
+                mock.patch('pythonforandroid.recipe.extract_archive',
+                           wraps=extract_archive)) as m_extract, (
+                tempfile.TemporaryDirectory()) as temp_dir:
+            recipe.ctx.setup_dirs(temp_dir)
+            package_dir = os.path.join(recipe.ctx.packages_path, 'test_recipe')
+            os.makedirs(package_dir)
+            source_file = os.path.join(temp_dir, 'setup.py')
+            with open(source_file, 'w') as fileh:
+                fileh.write('setup()')
+            with tarfile.open(os.path.join(package_dir, filename), 'w:gz') as tar:
+                tar.add(source_file, 'Python-3.7.4/setup.py')
+            for arch in ('arm64-v8a', 'x86_64'):
+                recipe.unpack(arch)
+                build_file = os.path.join(recipe.get_build_dir(arch), 'setup.py')
+                with open(build_file) as fileh:
+                    assert fileh.read() == 'setup()'
+                # writing to the build dir leaves the pristine tree as is
+                with open(build_file, 'w') as fileh:
+                    fileh.write('patched()')
+            pristine_file = os.path.join(
+                recipe.get_pristine_dir(filename), 'test_recipe', 'setup.py')
+            with open(pristine_file) as fileh:
+                assert fileh.read() == 'setup()'
+            assert m_extract.call_count == 1
+            assert m_extract.call_args[0][1] == recipe.get_pristine_dir(filename)
+
+    def test_build_stamp(self):
+        """
+        The build stamp changes with the patches, the build environment and
+        the build stamps of the dependencies.
+        """
+        recipe, filename = self.get_dummy_python_recipe_for_download_tests()
+        recipe.ctx.ndk_api = 21
+        recipe.ctx.android_api = 27
+        recipe.ctx.recipe_build_order = []
+        arch = ArchAarch_64(recipe.ctx)
+        recipe.ctx.archs = [arch]
+        dependency = mock.Mock()
+        dependency.read_stamp.return_value = 'dependency-stamp'
+        env = {'CFLAGS': '-O2'}
+        with (
+                mock.patch.object(DummyRecipe, 'get_recipe_env',
+                                  return_value=env)), (
+                mock.patch.object(DummyRecipe, 'get_build_dependencies',
+                                  return_value=[dependency])), (
+                tempfile.TemporaryDirectory()) as temp_dir, (
+                mock.patch.object(DummyRecipe, 'get_recipe_dir',
+                                  return_value=temp_dir)):
+            recipe.ctx.setup_dirs(temp_dir)
+            patch_file = os.path.join(temp_dir, 'fix.patch')
+            with open(patch_file, 'w') as fileh:
+                fileh.write('--- a/setup.py\n+++ b/setup.py\n')
+            recipe.patches = ['fix.patch']
+            stamps = [recipe.get_build_stamp(arch)]
+            assert recipe.get_build_stamp(arch) == stamps[0]
+            env['CFLAGS'] = '-O3'
+            stamps.append(recipe.get_build_stamp(arch))
+            dependency.read_stamp.return_value = 'rebuilt-dependency-stamp'
+            stamps.append(recipe.get_build_stamp(arch))
+            source_stamp = recipe.get_source_stamp(arch)
+            with open(patch_file, 'a') as fileh:
+                fileh.write('+new line\n')
+            assert recipe.get_source_stamp(arch) != source_stamp
+            stamps.append(recipe.get_build_stamp(arch))
+            assert len(set(stamps)) == len(stamps)
+
+            assert recipe.read_stamp(arch, 'build') is None
+            recipe.write_stamp(arch, 'build', stamps[-1])
+            assert recipe.read_stamp(arch, 'build') == stamps[-1]
+
+    def test_artifact_key(self):
+        """
+        The prebuilt artifact key does not depend on the storage dir, but
+        changes with the dependencies keys.
+        """
+        recipe, filename = self.get_dummy_python_recipe_for_download_tests()
+        recipe.ctx.ndk_api = 21
+        recipe.ctx.android_api = 27
+        recipe.ctx.ndk_dir = '/opt/android/android-ndk'
+        recipe.ctx.recipe_build_order = []
+        arch = ArchAarch_64(recipe.ctx)
+        recipe.ctx.archs = [arch]
+        dependency = mock.Mock()
+        dependency.get_artifact_key.return_value = 'dependency-key'
+        with mock.patch.object(DummyRecipe, 'get_build_dependencies',
+                               return_value=[dependency]):
+            keys = []
+            for storage_dir in ('/storage/first', '/storage/second'):
+                recipe.ctx.setup_dirs(storage_dir)
+                keys.append(recipe.get_artifact_key(arch))
+            assert keys[0] == keys[1]
+            dependency.get_artifact_key.return_value = 'rebuilt-key'
+            assert recipe.get_artifact_key(arch) != keys[0]
+
 
 class TestLibraryRecipe(BaseClassSetupBootstrap, unittest.TestCase):
     def setUp(self):
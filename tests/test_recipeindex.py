@@ -0,0 +1,96 @@
+import os
+import unittest
+from unittest import mock
+
+from backports import tempfile
+
+from pythonforandroid.build import Context
+from pythonforandroid.recipe import Recipe
+from pythonforandroid.recipeindex import RecipeIndex, RecipeInfo
+
+RECIPE_SOURCE = '''
+from pythonforandroid.recipe import Recipe
+
+
+class LibFakeRecipe(Recipe):
+    version = '1.0'
+    depends = ['libffi', ('sdl2', 'genericndkbuild')]
+    conflicts = ['libotherfake']
+    opt_depends = ['openssl']
+
+
+recipe = LibFakeRecipe()
+'''
+
+
+class TestRecipeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.ctx = Context()
+        self.ctx.setup_dirs(os.path.join(self.temp_dir.name, 'storage'))
+        self.ctx.local_recipes = os.path.join(self.temp_dir.name, 'recipes')
+        self.recipe_file = os.path.join(
+            self.ctx.local_recipes, 'libfake', '__init__.py')
+        os.makedirs(os.path.dirname(self.recipe_file))
+        with open(self.recipe_file, 'w') as fileh:
+            fileh.write(RECIPE_SOURCE)
+        # these tests load recipes in a fresh cache, restored afterwards
+        self.addCleanup(setattr, Recipe, 'recipes',
+                        getattr(Recipe, 'recipes', {}))
+        self.addCleanup(setattr, Recipe, 'recipe_indexes',
+                        getattr(Recipe, 'recipe_indexes', {}))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def check_info(self, info):
+        assert info.name == 'libfake'
+        assert info.version == '1.0'
+        assert info.depends == ['libffi', ('sdl2', 'genericndkbuild')]
+        assert info.conflicts == ['libotherfake']
+        assert info.get_opt_depends_in_list(['openssl', 'jpeg']) == [
+            'openssl']
+
+    def test_get_recipe_info(self):
+        """
+        The metadata of a recipe is indexed the first time it is needed, and
+        read from the index afterwards, without importing the recipe.
+        """
+        Recipe.recipes = {}
+        info = Recipe.get_recipe_info('LibFake', self.ctx)
+        assert isinstance(info, RecipeInfo)
+        self.check_info(info)
+        assert os.path.exists(
+            os.path.join(self.ctx.build_dir, 'recipe_index.json'))
+
+        # a new process, with the index stored in the build dir
+        Recipe.recipes = {}
+        Recipe.recipe_indexes = {}
+        with mock.patch('pythonforandroid.recipe.import_recipe') as m_import:
+            info = Recipe.get_recipe_info('libfake', self.ctx)
+        m_import.assert_not_called()
+        self.check_info(info)
+
+        with mock.patch.dict(os.environ, {'VERSION_libfake': '2.0'}):
+            assert info.version == '2.0'
+
+        # an imported recipe is used as is
+        recipe = Recipe.get_recipe('libfake', self.ctx)
+        assert Recipe.get_recipe_info('libfake', self.ctx) is recipe
+
+        with self.assertRaises(ValueError):
+            Recipe.get_recipe_info('libmissing', self.ctx)
+
+    def test_index_invalidation(self):
+        Recipe.recipes = {}
+        index = RecipeIndex(os.path.join(self.temp_dir.name, 'index.json'))
+        assert index.lookup(self.recipe_file) is None
+        index.store(self.recipe_file, Recipe.get_recipe('libfake', self.ctx))
+        self.check_info(index.lookup(self.recipe_file))
+
+        index = RecipeIndex(index.filename)
+        self.check_info(index.lookup(self.recipe_file))
+        with open(self.recipe_file, 'a') as fileh:
+            fileh.write('recipe.depends = []\n')
+        assert index.lookup(self.recipe_file) is None
@@ -0,0 +1,131 @@
+import os
+import py_compile
+import sys
+import unittest
+import zipfile
+
+from backports import tempfile
+
+from pythonforandroid import sitezip
+
+SOURCES = {
+    'p4atestpkg/__init__.py': 'value = 1\n',
+    'p4atestpkg/sub/__init__.py': '',
+    'p4atestpkg/sub/module.py': 'from .. import value\nvalue += 1\n',
+    'p4atestmod.py': 'value = 3\n',
+    'p4atestdata/__init__.py': '',
+    'p4atestdata/data.txt': 'data',
+    'p4atestnamespace/module.py': '',
+    'json/__init__.py': '',
+}
+
+
+class TestSiteZip(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.temp_dir.name, 'site-packages')
+        self.filenames = ['p4atestpkg-1.0.dist-info/METADATA']
+        for filename, source in SOURCES.items():
+            path = os.path.join(self.root, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as fileh:
+                fileh.write(source)
+            if filename.endswith('.py'):
+                # the bundle has the legacy compiled files, not the sources
+                py_compile.compile(path, path + 'c', doraise=True)
+                filename += 'c'
+            self.filenames.append('./' + filename)
+        os.makedirs(os.path.join(self.root, 'p4atestpkg-1.0.dist-info'))
+        with open(os.path.join(self.root, self.filenames[0]), 'w'):
+            pass
+        self.zip_filename = os.path.join(self.temp_dir.name,
+                                         'site-packages.zip')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_module_name(self):
+        assert sitezip.get_module_name('foo/bar.pyc') == ('foo.bar', False)
+        assert sitezip.get_module_name('foo/__init__.py') == ('foo', True)
+        assert sitezip.get_module_name('foo/bar.so') is None
+        assert sitezip.get_module_name('foo-1.0.dist-info/bar.py') is None
+
+    def test_write_site_zip(self):
+        """
+        Only the packages made of Python modules are zipped, with each
+        module found at its offset in the index.
+        """
+        left = sitezip.write_site_zip(self.zip_filename, self.root,
+                                      self.filenames, exclude={'json'})
+        assert sorted(left) == [
+            'json/__init__.pyc',
+            'p4atestdata/__init__.pyc', 'p4atestdata/data.txt',
+            'p4atestnamespace/module.pyc',
+            'p4atestpkg-1.0.dist-info/METADATA']
+
+        with zipfile.ZipFile(self.zip_filename) as zip_file:
+            assert zip_file.testzip() is None
+            assert sorted(zip_file.namelist()) == [
+                'p4atestmod.pyc', 'p4atestpkg/__init__.pyc',
+                'p4atestpkg/sub/__init__.pyc', 'p4atestpkg/sub/module.pyc']
+            assert {info.compress_type for info in zip_file.infolist()} == {
+                zipfile.ZIP_STORED}
+
+        finder = self.install()
+        with open(self.zip_filename, 'rb') as fileh:
+            data = fileh.read()
+        for name, (filename, _, offset, size) in finder.modules.items():
+            assert offset % sitezip.ALIGNMENT == 0
+            with open(os.path.join(self.root, filename), 'rb') as fileh:
+                assert data[offset:offset + size] == fileh.read()
+
+    def install(self):
+        finder = sitezip.install(self.zip_filename)
+        self.addCleanup(sys.path_importer_cache.clear)
+        self.addCleanup(sys.path_hooks.remove, finder.path_hook)
+        self.addCleanup(sys.path.remove, self.zip_filename)
+        for name in ('p4atestpkg', 'p4atestpkg.sub', 'p4atestpkg.sub.module',
+                     'p4atestmod'):
+            self.addCleanup(sys.modules.pop, name, None)
+        return finder
+
+    def test_install(self):
+        sitezip.write_site_zip(self.zip_filename, self.root, self.filenames)
+        self.install()
+        assert sys.path[-1] == self.zip_filename
+
+        import p4atestmod
+        from p4atestpkg.sub import module
+        assert p4atestmod.value == 3
+        assert module.value == 2
+        assert module.__file__ == os.path.join(
+            self.zip_filename, 'p4atestpkg/sub/module.pyc')
+        assert module.__spec__.loader.get_filename(
+            module.__name__) == module.__file__
+        import p4atestpkg
+        assert p4atestpkg.__path__ == [
+            os.path.join(self.zip_filename, 'p4atestpkg')]
+
+        assert sitezip.install(
+            os.path.join(self.temp_dir.name, 'missing.zip')) is None
+
+    def test_install_shadowed(self):
+        """
+        The modules of the sys.path entries before the zip, such as the app
+        dir, are imported instead of those of the zip.
+        """
+        sitezip.write_site_zip(self.zip_filename, self.root, self.filenames)
+        app_dir = os.path.join(self.temp_dir.name, 'app')
+        os.makedirs(app_dir)
+        with open(os.path.join(app_dir, 'p4atestmod.py'), 'w') as fileh:
+            fileh.write('value = 4\n')
+        sys.path.insert(0, app_dir)
+        self.addCleanup(sys.path.remove, app_dir)
+        self.install()
+
+        import p4atestmod
+        from p4atestpkg.sub import module
+        assert p4atestmod.value == 4
+        assert module.__file__ == os.path.join(
+            self.zip_filename, 'p4atestpkg/sub/module.pyc')
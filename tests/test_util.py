@@ -136,3 +136,129 @@ class TestUtil(unittest.TestCase):
         )
         with self.assertRaises(SystemExit):
             util.handle_build_exception(exc)
+
+    def test_run_parallel_tasks(self):
+        """
+        Test method :meth:`~pythonforandroid.util.run_parallel_tasks`. We make
+        sure that every task runs in a forked worker, that a task only starts
+        once its dependencies are finished (and `on_result` has been called
+        for them) and that the results are collected in the parent process.
+        """
+        finished = []
+
+        def target(task):
+            # the parent records the finished tasks in `on_result`, and the
+            # forked worker inherits that state
+            return task, sorted(finished), os.getpid()
+
+        def on_result(task, value):
+            finished.append(task)
+
+        dependencies = {"c": {"a", "b"}, "d": {"c"}}
+        results = util.run_parallel_tasks(
+            ["a", "b", "c", "d"], target, 2,
+            dependencies=dependencies, on_result=on_result,
+        )
+        self.assertEqual(set(results), {"a", "b", "c", "d"})
+        self.assertEqual(set(results["c"][1]), {"a", "b"})
+        self.assertEqual(set(results["d"][1]), {"a", "b", "c"})
+        self.assertNotIn(os.getpid(), {value[2] for value in results.values()})
+        self.assertEqual(finished.index("d"), 3)
+
+    def test_run_parallel_tasks_failure(self):
+        """
+        Test that a failing task of
+        :meth:`~pythonforandroid.util.run_parallel_tasks` raises a
+        `BuildInterruptingException` and prevents its dependant tasks from
+        starting.
+        """
+        def target(task):
+            if task == "a":
+                raise ValueError("task a failed")
+            return task
+
+        on_result = mock.Mock()
+        with self.assertRaises(util.BuildInterruptingException) as e:
+            util.run_parallel_tasks(
+                ["a", "b"], target, 1, dependencies={"b": {"a"}},
+                on_result=on_result,
+            )
+        self.assertIn("ValueError: task a failed", e.exception.instructions)
+        on_result.assert_not_called()
+
+    def test_file_lock(self):
+        """
+        Test method :meth:`~pythonforandroid.util.file_lock`: the lock file
+        and its directory are created, and the lock is exclusive.
+        """
+        import fcntl
+        with util.temp_directory() as temp_dir:
+            lock_file = os.path.join(temp_dir, 'locks', 'test.lock')
+            with util.file_lock(lock_file):
+                self.assertTrue(os.path.isfile(lock_file))
+                with open(lock_file) as fileh, self.assertRaises(OSError):
+                    fcntl.flock(fileh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            with open(lock_file) as fileh:
+                fcntl.flock(fileh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_clone_tree(self):
+        """
+        Test method :meth:`~pythonforandroid.util.clone_tree`: the cloned
+        tree has the same content, and its files can be modified without
+        changing the source.
+        """
+        with util.temp_directory() as temp_dir:
+            source = os.path.join(temp_dir, 'source')
+            os.makedirs(os.path.join(source, 'src'))
+            with open(os.path.join(source, 'src', 'file.c'), 'w') as fileh:
+                fileh.write('source')
+            os.symlink('src/file.c', os.path.join(source, 'link.c'))
+            target = os.path.join(temp_dir, 'target')
+            method = util.clone_tree(source, target)
+            self.assertIn(method, ('reflink', 'copy'))
+            filename = os.path.join(target, 'src', 'file.c')
+            with open(filename) as fileh:
+                self.assertEqual(fileh.read(), 'source')
+            self.assertEqual(
+                os.readlink(os.path.join(target, 'link.c')), 'src/file.c')
+
+            with open(filename, 'w') as fileh:
+                fileh.write('patched')
+            with open(os.path.join(source, 'src', 'file.c')) as fileh:
+                self.assertEqual(fileh.read(), 'source')
+
+    def test_clone_tree_copy(self):
+        """
+        Test method :meth:`~pythonforandroid.util.clone_tree` falls back to
+        copies when reflinks are not supported.
+        """
+        with util.temp_directory() as temp_dir:
+            source = os.path.join(temp_dir, 'source')
+            os.makedirs(source)
+            open(os.path.join(source, 'file.c'), 'w').close()
+            with mock.patch('pythonforandroid.util.reflink_file',
+                            side_effect=OSError):
+                self.assertEqual(util.clone_tree(
+                    source, os.path.join(temp_dir, 'copy')), 'copy')
+            self.assertEqual(
+                os.stat(os.path.join(source, 'file.c')).st_nlink, 1)
+
+    def test_reset_build_dir_on_change(self):
+        """
+        Test method :meth:`~pythonforandroid.util.reset_build_dir_on_change`:
+        the build dir is only emptied when the build options change.
+        """
+        with util.temp_directory() as temp_dir:
+            build_dir = os.path.join(temp_dir, 'build')
+            object_file = os.path.join(build_dir, 'object.o')
+            util.reset_build_dir_on_change(build_dir, '')
+            open(object_file, 'w').close()
+            util.reset_build_dir_on_change(build_dir, '')
+            self.assertTrue(os.path.isfile(object_file))
+            util.reset_build_dir_on_change(build_dir, 'lto')
+            self.assertEqual(os.listdir(build_dir), ['p4a_build_options'])
+            open(object_file, 'w').close()
+            util.reset_build_dir_on_change(build_dir, 'lto')
+            self.assertTrue(os.path.isfile(object_file))
+            util.reset_build_dir_on_change(build_dir, '')
+            self.assertEqual(os.listdir(build_dir), [])